@@ -0,0 +1,121 @@
+"""Runs the benchmark scenarios and compares them with a stored baseline.
+
+Run from the repository root:
+
+    python -m benchmarks                     # 1000 folders, 20k tracks
+    python -m benchmarks --folders 10000 --tracks 1000000 --root /big/disk
+    python -m benchmarks --save-baseline     # record the current numbers
+
+The synthetic library is kept in --root between runs. Settings and indexes
+go to a scratch HOME, so the real configuration is never touched. Exits
+with status 1 if a scenario's median is more than --tolerance slower than
+in the baseline, which is only meaningful on the machine that recorded it.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+DEFAULT_ROOT = Path(tempfile.gettempdir()) / "pytui-music-bench"
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument('--root', type=Path, default=DEFAULT_ROOT,
+                        help="where the synthetic library is generated")
+    parser.add_argument('--folders', type=int, default=1000)
+    parser.add_argument('--tracks', type=int, default=20000)
+    parser.add_argument('--tiny', action='store_true',
+                        help="write short WAV files instead of empty ones")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="timed runs per scenario")
+    parser.add_argument('--only', action='append', default=[],
+                        help="run scenarios whose name contains this")
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline (0.25 = 25%%)")
+    return parser.parse_args()
+
+def measure(run, repeat):
+    """Returns the times of repeat calls of run in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+def main():
+    args = parse_args()
+    library_key = f"{args.folders}x{args.tracks}"
+
+    home = tempfile.mkdtemp(prefix="pytui-music-bench-home-")
+    os.environ['HOME'] = home
+    # Makes the repository modules importable when run from elsewhere
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+    from benchmarks.generator import generate_library
+    from benchmarks.scenarios import Context, SCENARIOS
+
+    root = str(args.root / library_key)
+    print(f"Generating {args.folders} folders with {args.tracks} tracks "
+          f"in {root} ...", flush=True)
+    start = time.perf_counter()
+    albums = generate_library(root, args.folders, args.tracks, args.tiny)
+    print(f"  ready in {time.perf_counter() - start:.1f} s\n")
+    ctx = Context(root, albums)
+
+    baseline = {}
+    if args.baseline.is_file():
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f).get(library_key, {})
+
+    results = {}
+    regressions = []
+    print(f"{'scenario':<24}{'min ms':>10}{'median ms':>11}{'baseline':>10}")
+    try:
+        for name, scenario in SCENARIOS:
+            if args.only and not any(part in name for part in args.only):
+                continue
+            times = measure(scenario(ctx), args.repeat)
+            median = statistics.median(times)
+            results[name] = median
+
+            old = baseline.get(name)
+            note = ""
+            if old is not None:
+                change = median / old - 1 if old else 0.0
+                note = f"{old:>10.3f}  {change:+.0%}"
+                if change > args.tolerance:
+                    regressions.append(name)
+                    note += "  REGRESSION"
+            print(f"{name:<24}{min(times):>10.3f}{median:>11.3f}{note}")
+    finally:
+        from library import close_all
+        close_all()
+        shutil.rmtree(home, ignore_errors=True)
+
+    if args.save_baseline:
+        stored = {}
+        if args.baseline.is_file():
+            with open(args.baseline, 'r') as f:
+                stored = json.load(f)
+        stored.setdefault(library_key, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
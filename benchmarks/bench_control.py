@@ -0,0 +1,144 @@
+"""Round-trip and push latency of the control socket with many clients,
+against a stub player, so no mpv is needed.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_control [CLIENTS]
+"""
+import json
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from profiler import percentile
+
+COMMANDS = 200
+
+class StubState:
+    def __init__(self):
+        self.current = 0
+        self.media_title = None
+        self.time_pos = 0.0
+        self.duration = 180.0
+        self.pause = False
+        self.volume = 50
+
+class StubSession:
+    """Just enough of PlayerSession for the control server."""
+
+    def __init__(self, tracks=100):
+        self.state = StubState()
+        self.playlist = [f"/music/{i:03}.mp3" for i in range(tracks)]
+        self.queue = object()
+        self.repeat = 'all'
+        self.shuffle = False
+        self.listeners = []
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def status(self):
+        return {
+            'index': self.state.current,
+            'paused': self.state.pause,
+            'volume': self.state.volume,
+            'repeat': self.repeat,
+        }
+
+    def play(self, idx):
+        self.state.current = idx
+        self._changed()
+
+    def next(self):
+        self.play((self.state.current + 1) % len(self.playlist))
+
+    def prev(self):
+        self.play((self.state.current - 1) % len(self.playlist))
+
+    def toggle_pause(self):
+        self.state.pause = not self.state.pause
+        self._changed()
+
+    def change_volume(self, step):
+        self.state.volume = max(0, min(150, self.state.volume + step))
+        self._changed()
+
+    def toggle_lock(self):
+        self.repeat = 'all' if self.repeat == 'one' else 'one'
+        self._changed()
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock, sock.makefile('rb')
+
+def request(sock, lines, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+    while True:
+        reply = json.loads(lines.readline())
+        if 'event' not in reply:
+            return reply
+
+def main():
+    from control import ControlServer
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    # One track per command, so every push names the command it follows
+    session = StubSession(COMMANDS + 1)
+    path = str(Path(tempfile.mkdtemp()) / "control.sock")
+    server = ControlServer(session, path=path)
+    if not server.start():
+        sys.exit(f"Could not start the server: {server.error}")
+
+    # Subscribers note when they see each track index pushed
+    seen = {}
+    seen_lock = threading.Lock()
+    subscribers = []
+    for _ in range(clients):
+        sock, lines = connect(path)
+        assert request(sock, lines, {'command': 'subscribe'})['ok']
+        subscribers.append(sock)
+
+        def listen(lines=lines):
+            for line in lines:
+                message = json.loads(line)
+                if message.get('event') == 'status':
+                    index = message['status']['index']
+                    with seen_lock:
+                        seen.setdefault(index, []).append(time.perf_counter())
+        threading.Thread(target=listen, daemon=True).start()
+
+    sock, lines = connect(path)
+    round_trips = []
+    sent_at = {}
+    for n in range(COMMANDS):
+        index = (n + 1) % len(session.playlist)
+        sent_at[index] = time.perf_counter()
+        start = time.perf_counter()
+        reply = request(sock, lines, {'id': n, 'command': 'play', 'index': index})
+        round_trips.append(time.perf_counter() - start)
+        assert reply['ok'] and reply['id'] == n, reply
+        time.sleep(0.002)
+    time.sleep(0.5)
+
+    pushes = []
+    for index, times in seen.items():
+        if index in sent_at:
+            pushes.extend(t - sent_at[index] for t in times)
+    delivered = sum(len(times) for times in seen.values())
+    print(f"{clients} subscribers, {COMMANDS} play commands")
+    for label, values in (("round trip", round_trips), ("push", pushes)):
+        values = sorted(v * 1000 for v in values)
+        print(f"{label:<12}median {percentile(values, 0.5):6.2f} ms   "
+              f"p99 {percentile(values, 0.99):6.2f} ms")
+    print(f"pushes delivered: {delivered} of {clients * COMMANDS}")
+
+    for subscriber in subscribers:
+        subscriber.close()
+    sock.close()
+    server.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Frame time of the playlist pane for growing playlist sizes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_playlist_view
+"""
+import time
+from playlist_view import PlaylistView
+from benchmarks.fakescreen import FakeScreen
+
+SIZES = (100, 1_000, 10_000, 100_000)
+FRAMES = 200
+ROWS = 60
+WIDTH = 120
+
+class NamesOnly:
+    """Metadata stand-in that has no tags, like a library without mutagen."""
+
+    def __init__(self, playlist):
+        self.playlist = playlist
+
+    def get(self, idx):
+        return None
+
+    def want(self, indices):
+        pass
+
+    def name(self, idx):
+        return self.playlist[idx].rsplit('/', 1)[-1]
+
+def make_playlist(size):
+    return [
+        f"/music/Album {i // 12}/{i % 12 + 1:02d} 曲名 Track {i} 🎵.flac"
+        for i in range(size)
+    ]
+
+def bench(size):
+    playlist = make_playlist(size)
+    view = PlaylistView(playlist, NamesOnly(playlist), range(0, size, 7))
+    screen = FakeScreen(ROWS + 10, WIDTH + 4)
+    selected = size // 2
+    offset = max(0, selected - ROWS // 2)
+
+    start = time.perf_counter()
+    for frame in range(FRAMES):
+        screen.clear_calls()
+        view.draw(screen, 5, 2, ROWS, WIDTH, offset, selected, 0, frame)
+    return (time.perf_counter() - start) / FRAMES
+
+def main():
+    print(f"{'tracks':>8}  {'ms/frame':>9}")
+    for size in SIZES:
+        print(f"{size:>8}  {bench(size) * 1000:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Time to read the head of the next track with and without prefetching.
+
+mpv needs the first few hundred kilobytes of a file before audio starts,
+so this is used as a stand-in for time-to-first-audio at track changes.
+Files are dropped from the page cache with POSIX_FADV_DONTNEED before each
+run, which works for local file systems without root.
+
+    python -m benchmarks.bench_prefetch [DIRECTORY]
+"""
+import os
+import sys
+import tempfile
+import time
+from prefetch import Prefetcher
+
+TRACKS = 4
+TRACK_SIZE = 16 << 20
+HEAD_SIZE = 512 << 10
+
+def make_tracks(directory):
+    paths = []
+    block = os.urandom(1 << 20)
+    for i in range(TRACKS):
+        path = os.path.join(directory, f"track{i}.flac")
+        with open(path, 'wb') as f:
+            for _ in range(TRACK_SIZE // len(block)):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        paths.append(path)
+    return paths
+
+def drop_cache(paths):
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def read_head(path):
+    start = time.perf_counter()
+    with open(path, 'rb', buffering=0) as f:
+        f.read(HEAD_SIZE)
+    return time.perf_counter() - start
+
+def run(paths, prefetch):
+    drop_cache(paths)
+    prefetcher = Prefetcher(64 << 20)
+    timings = []
+    try:
+        for current, path in enumerate(paths[:-1]):
+            if prefetch:
+                prefetcher.schedule(paths[current + 1:current + 3])
+                # Stands in for the rest of the current track playing
+                time.sleep(0.5)
+            timings.append(read_head(paths[current + 1]))
+    finally:
+        prefetcher.close()
+    return timings
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else None
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        paths = make_tracks(tmp)
+        for label, prefetch in (("cold", False), ("prefetched", True)):
+            timings = run(paths, prefetch)
+            average = sum(timings) / len(timings) * 1000
+            print(f"{label:>11}: {average:8.3f} ms per track change")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Memory per track of a TrackTable against a list of path strings, and
+the time to build, search and sort it.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tracktable [TRACKS]
+"""
+import sys
+import time
+import tracemalloc
+from benchmarks.generator import ARTISTS, album_path, track_name
+from tracktable import TrackTable
+
+TRACKS_PER_ALBUM = 12
+
+def make_paths(count):
+    return [
+        f"{album_path('/music', i // TRACKS_PER_ALBUM)}/{track_name(i)}"
+        for i in range(count)
+    ]
+
+def traced(build):
+    """Returns (result of build, bytes it still holds)."""
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{count} tracks in {count // TRACKS_PER_ALBUM} folders "
+          f"by {len(ARTISTS)} artists")
+
+    paths, list_bytes = traced(lambda: make_paths(count))
+    table, table_bytes = traced(lambda: TrackTable.from_paths(paths))
+    print(f"{'list of paths':<16}{list_bytes / count:>8.1f} bytes/track")
+    print(f"{'TrackTable':<16}{table_bytes / count:>8.1f} bytes/track "
+          f"({table.nbytes() / count:.1f} by nbytes())")
+    del paths
+
+    start = time.perf_counter()
+    TrackTable.from_paths(make_paths(count))
+    print(f"\n{'build':<16}{(time.perf_counter() - start) * 1000:>10.1f} ms "
+          "(including the path strings)")
+    for query in ("night", "夜明け", "echo 99"):
+        start = time.perf_counter()
+        found = table.search(query)
+        print(f"{'search ' + query:<16}{(time.perf_counter() - start) * 1000:>10.1f} ms"
+              f"  {len(found)} found")
+    for key in ('duration', 'name'):
+        start = time.perf_counter()
+        table.sort_indices(key)
+        print(f"{'sort by ' + key:<16}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import curses
+
+# curses only defines the ACS_* line drawing characters after initscr(),
+# which needs a real terminal
+for _name, _char in (
+        ('ACS_HLINE', '-'),
+        ('ACS_VLINE', '|'),
+        ('ACS_ULCORNER', '+'),
+        ('ACS_URCORNER', '+'),
+        ('ACS_LLCORNER', '+'),
+        ('ACS_LRCORNER', '+')
+):
+    if not hasattr(curses, _name):
+        setattr(curses, _name, ord(_char))
+
+class FakeScreen:
+    """Headless stand-in for a curses window.
+
+    Every draw call is recorded as a tuple in ``calls`` so scenarios can
+    count them; ``clear_calls`` empties the list between frames.
+    """
+
+    def __init__(self, height=50, width=160):
+        self.height = height
+        self.width = width
+        self.calls = []
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def clear_calls(self):
+        self.calls.clear()
+
+    def addstr(self, y, x, text, attr=0):
+        self.calls.append(('addstr', y, x, text, attr))
+
+    def hline(self, y, x, char, n):
+        self.calls.append(('hline', y, x, char, n))
+
+    def box(self):
+        self.calls.append(('box',))
+
+    def erase(self):
+        self.calls.append(('erase',))
+
+    def clear(self):
+        self.calls.append(('clear',))
+
+    def noutrefresh(self):
+        self.calls.append(('noutrefresh',))
+
+    def refresh(self):
+        self.calls.append(('refresh',))
+
+class FakeState:
+    """The player state the player view reads, like session.PlayerState."""
+
+    def __init__(self, title="", duration=245.0):
+        self.current = 0
+        self.media_title = title
+        self.time_pos = 61.0
+        self.duration = duration
+        self.pause = False
+        self.volume = 50
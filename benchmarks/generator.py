@@ -0,0 +1,72 @@
+import os
+import struct
+
+# Names mixing ASCII, accented Latin, CJK (two cells wide) and emoji
+ARTISTS = (
+    "The Band", "Sigur Rós", "坂本龍一", "Beyoncé", "東京事変",
+    "Mötley Crüe", "BTS 방탄소년단", "🎸 Guitar Heroes"
+)
+WORDS = (
+    "Night", "夜明け", "Lumière", "Sommarväder", "사랑", "Rain 🌧",
+    "Éternité", "星空", "Drive", "Fjärran", "Ｆｕｌｌｗｉｄｔｈ", "Echo"
+)
+EXTENSIONS = ('.mp3', '.flac', '.ogg', '.m4a', '.wav')
+
+# Marks a finished library so it is not generated twice
+STAMP_FILE = ".generated"
+
+def tiny_wav():
+    """Returns a valid, silent 8 kHz mono WAV file of 1/100 s."""
+    samples = b"\0\0" * 80
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(samples), b"WAVE",
+        b"fmt ", 16, 1, 1, 8000, 16000, 2, 16,
+        b"data", len(samples)
+    )
+    return header + samples
+
+def track_name(i):
+    word = WORDS[i % len(WORDS)]
+    other = WORDS[(i * 7 + 3) % len(WORDS)]
+    return f"{i % 100 + 1:02d} - {word} {other} {i}{EXTENSIONS[i % len(EXTENSIONS)]}"
+
+def album_path(root, i):
+    artist = ARTISTS[i % len(ARTISTS)]
+    return os.path.join(root, f"{artist} {i // 20}", f"Album {i} {WORDS[i % len(WORDS)]}")
+
+def generate_library(root, folders=1000, tracks=20000, tiny=False):
+    """Creates folders album folders holding tracks files in total below root.
+
+    Files are empty unless tiny is set, in which case they are short WAV
+    files (whatever their extension) that decoders accept.
+    Returns the list of album folders.
+    """
+    stamp = os.path.join(root, STAMP_FILE)
+    signature = f"{folders} {tracks} {int(tiny)}"
+    albums = [album_path(root, i) for i in range(folders)]
+    try:
+        with open(stamp, 'r') as f:
+            if f.read() == signature:
+                return albums
+    except OSError:
+        pass
+
+    content = tiny_wav() if tiny else b""
+    per_album, extra = divmod(tracks, folders)
+    track = 0
+    for i, album in enumerate(albums):
+        os.makedirs(album, exist_ok=True)
+        for _ in range(per_album + (1 if i < extra else 0)):
+            path = os.path.join(album, track_name(track))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if content:
+                    os.write(fd, content)
+            finally:
+                os.close(fd)
+            track += 1
+
+    with open(stamp, 'w') as f:
+        f.write(signature)
+    return albums
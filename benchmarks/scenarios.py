@@ -0,0 +1,176 @@
+"""Timed scenarios of the benchmark suite.
+
+Each scenario is a function taking the ``Context`` and returning the
+callable to time, so that setup is not measured. Repository modules are
+imported lazily because ``__main__`` has to point HOME at a scratch
+directory before config.py computes its paths.
+"""
+import os
+import shutil
+import threading
+
+class Context:
+    """What the scenarios share: the library and the folders in it."""
+
+    def __init__(self, root, albums):
+        self.root = root
+        self.albums = albums
+        self.album = max(albums, key=lambda a: len(os.listdir(a)))
+
+def _reset_library():
+    from library import LIBRARY_DIR, close_all
+    close_all()
+    shutil.rmtree(LIBRARY_DIR, ignore_errors=True)
+
+def get_folders_cold(ctx):
+    from library import get_folders
+
+    def run():
+        _reset_library()
+        get_folders(ctx.root)
+    return run
+
+def get_folders_warm(ctx):
+    from library import get_folders
+    _reset_library()
+    get_folders(ctx.root)
+    return lambda: get_folders(ctx.root)
+
+def album_scan_warm(ctx):
+    from library import AlbumScanner
+
+    def run():
+        found = threading.Event()
+        scanner = AlbumScanner(ctx.root, found.set)
+        while not scanner.done:
+            found.wait()
+            found.clear()
+        scanner.cancel()
+        return scanner.drain()
+    # The first walk fills the index, the timed ones only stat
+    _reset_library()
+    run()
+    return run
+
+def open_folder(ctx):
+    import player
+
+    def run():
+        opened = player.open_folder(ctx.album)
+        if opened is not None:
+            opened[1].close()
+    run()
+    return run
+
+def player_frame(ctx):
+    import player
+    from benchmarks.fakescreen import FakeScreen, FakeState
+    playlist, metadata, view = player.open_folder(ctx.album)
+    metadata.close()
+    screen = FakeScreen()
+    state = FakeState(view.name(0))
+    selected = len(playlist) // 2
+    frames = iter(range(1 << 62))
+
+    def run():
+        screen.clear_calls()
+        player.draw_player_tui(
+            screen, state, playlist, selected, 0,
+            max(0, selected - 20), next(frames), next(frames),
+            False, {}, view
+        )
+    return run
+
+def spectrum_frame(ctx):
+    """A player frame with the spectrum pane, fed with a synthetic sweep."""
+    import numpy
+    import player
+    from visualizer import Spectrum, FFT_SIZE, RATE
+    from benchmarks.fakescreen import FakeScreen, FakeState
+    playlist, metadata, view = player.open_folder(ctx.album)
+    metadata.close()
+    screen = FakeScreen()
+    state = FakeState(view.name(0))
+    spectrum = Spectrum()
+    bars = player.spectrum_bars(screen.width)
+    t = numpy.arange(10 * RATE) / RATE
+    pcm = (0.5 * numpy.sin(2 * numpy.pi * (100 + 200 * t) * t)).astype(numpy.float32)
+    frames = iter(range(1 << 62))
+
+    def run():
+        frame = next(frames)
+        start = frame * RATE // 20 % (len(pcm) - FFT_SIZE)
+        levels = spectrum.bars(pcm[start:start + FFT_SIZE], bars)
+        screen.clear_calls()
+        player.draw_player_tui(
+            screen, state, playlist, 0, 0, 0, frame, frame,
+            False, {}, view, spectrum=levels
+        )
+    return run
+
+def menu_frame(ctx):
+    from tui import draw_menu
+    from benchmarks.fakescreen import FakeScreen
+    items = [".. (Back)"] + sorted(
+        os.path.relpath(a, ctx.root) for a in ctx.albums
+    )
+    screen = FakeScreen()
+    selected = len(items) // 2
+
+    def run():
+        screen.clear_calls()
+        draw_menu(screen, selected, items, "Select a folder", "q: Back")
+    return run
+
+def config_round_trip(ctx):
+    from config import load_config, save_config
+    config = load_config()
+    config['paths'] = [ctx.root] + [f"/mnt/music{i}" for i in range(20)]
+
+    def run():
+        save_config(config)
+        load_config()
+    return run
+
+def seen_songs_round_trip(ctx):
+    from config import load_seen_songs, save_seen_songs
+    names = sorted(os.listdir(ctx.album))
+    runs = iter(range(1 << 62))
+
+    def run():
+        # A new folder key each time, like a first visit
+        folder = f"{ctx.album}#{next(runs)}"
+        save_seen_songs(folder, dict.fromkeys(names, "2024-01-01T00:00:00"))
+        load_seen_songs(folder)
+    return run
+
+def history_query(ctx):
+    from history import PlayHistory, START, COMPLETE
+    names = sorted(os.listdir(ctx.album))
+    history = PlayHistory()
+    # Years of listening: 20k plays spread over the album
+    for play in range(20000):
+        path = os.path.join(ctx.album, names[play % len(names)])
+        history.record(START, path)
+        history.record(COMPLETE, path, 180)
+    history.close()
+    history = PlayHistory()
+    history.rollup()
+
+    def run():
+        history.most_played()
+        history.recently_played()
+    return run
+
+SCENARIOS = (
+    ('get_folders cold', get_folders_cold),
+    ('get_folders warm', get_folders_warm),
+    ('album scan warm', album_scan_warm),
+    ('open_folder', open_folder),
+    ('player frame', player_frame),
+    ('spectrum frame', spectrum_frame),
+    ('menu frame', menu_frame),
+    ('config round trip', config_round_trip),
+    ('seen songs round trip', seen_songs_round_trip),
+    ('history query', history_query),
+)
@@ -1,28 +1,97 @@
 import os
 import configparser
 import json
+import sqlite3
+import tempfile
+import threading
 from pathlib import Path
+import profiler
 
 CONFIG_DIR = Path(os.path.expanduser("~/.config/PyTUI_Music"))
 CONFIG_FILE = CONFIG_DIR / "config.conf"
+SEEN_SONGS_DB = CONFIG_DIR / "seen_songs.db"
+SESSION_FILE = CONFIG_DIR / "session.json"
+# Written on exit when running with --profile
+PROFILE_FILE = CONFIG_DIR / "profile.txt"
+# Older versions kept every seen song in one JSON file
 SEEN_SONGS_FILE = CONFIG_DIR / "seen_songs.json"
 
-def load_seen_songs():
-    """Loads the dictionary of seen songs from the JSON file."""
-    if not SEEN_SONGS_FILE.is_file():
-        return {}
-    with open(SEEN_SONGS_FILE, 'r') as f:
-        try:
-            data = json.load(f)
-            return data if isinstance(data, dict) else {}
-        except json.JSONDecodeError:
-            return {}
+# Seconds to wait before writing changed settings, so that bursts of
+# changes (e.g. holding the volume keys) end up in one write.
+SAVE_DELAY = 2.0
+
+SEEN_SONGS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen_songs (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    PRIMARY KEY (folder, filename)
+) WITHOUT ROWID;
+"""
+
+_seen_songs_db = None
+_seen_songs_lock = threading.Lock()
+
+def _open_seen_songs_db():
+    """Opens the seen songs database, importing the old JSON file once."""
+    global _seen_songs_db
+    if _seen_songs_db is not None:
+        return _seen_songs_db
 
-def save_seen_songs(seen_songs_dict):
-    """Saves the dictionary of seen songs to the JSON file."""
     CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-    with open(SEEN_SONGS_FILE, 'w') as f:
-        json.dump(seen_songs_dict, f, indent=4)
+    db = sqlite3.connect(str(SEEN_SONGS_DB), check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(SEEN_SONGS_SCHEMA)
+
+    if SEEN_SONGS_FILE.is_file():
+        with open(SEEN_SONGS_FILE, 'r') as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                data = {}
+        if not isinstance(data, dict):
+            data = {}
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO seen_songs (folder, filename, first_seen) "
+                "VALUES (?, ?, ?)",
+                [
+                    (folder, filename, str(first_seen))
+                    for folder, songs in data.items() if isinstance(songs, dict)
+                    for filename, first_seen in songs.items()
+                ]
+            )
+        # Only moved aside once the import is committed, and importing
+        # twice is harmless, so a crash here loses nothing.
+        SEEN_SONGS_FILE.replace(SEEN_SONGS_FILE.with_suffix(".json.bak"))
+
+    _seen_songs_db = db
+    return db
+
+def load_seen_songs(folder_path):
+    """Loads the seen songs of one folder as {filename: first seen timestamp}."""
+    with _seen_songs_lock:
+        db = _open_seen_songs_db()
+        return dict(db.execute(
+            "SELECT filename, first_seen FROM seen_songs WHERE folder = ?",
+            (folder_path,)
+        ))
+
+def save_seen_songs(folder_path, new_songs):
+    """Records {filename: first seen timestamp} entries for one folder."""
+    if not new_songs:
+        return
+    with _seen_songs_lock:
+        db = _open_seen_songs_db()
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO seen_songs (folder, filename, first_seen) "
+                "VALUES (?, ?, ?)",
+                [
+                    (folder_path, filename, first_seen)
+                    for filename, first_seen in new_songs.items()
+                ]
+            )
 
 def load_config():
     """Loads the configuration from the config file, creating it if it doesn't exist."""
@@ -32,7 +101,17 @@ def load_config():
             'paths': [],
             'volume': 50,
             'audio_backend': 'auto',
-            'background': 'cava'
+            'visualizer': False,
+            'resume': True,
+            'keep_playing': False,
+            'prefetch_tracks': 2,
+            'prefetch_mb': 64,
+            'waveform_mb': 16,
+            'shuffle': False,
+            'repeat': 'all',
+            'normalize': True,
+            'watch': True,
+            'history': True
         }
         save_config(default_config_dict)
         return default_config_dict
@@ -70,49 +149,233 @@ def load_config():
     if 'Settings' in parser:
         settings = parser['Settings']
         config['volume'] = settings.getint('volume', 50)
-        config['background'] = settings.get('background')
+        if 'visualizer' not in settings and 'background' in settings:
+            # Files from before the spectrum pane name the program C ran
+            # instead; one that was set up means the user wanted a
+            # visualizer. Saving writes the new key in its place.
+            config['visualizer'] = settings['background'].strip().lower() \
+                not in ('', 'no', 'none', 'off', 'false')
+        else:
+            config['visualizer'] = settings.getboolean('visualizer', False)
         config['audio_backend'] = settings.get('audio_backend', 'auto')
+        config['resume'] = settings.getboolean('resume', True)
+        config['keep_playing'] = settings.getboolean('keep_playing', False)
+        config['prefetch_tracks'] = settings.getint('prefetch_tracks', 2)
+        config['prefetch_mb'] = settings.getint('prefetch_mb', 64)
+        config['waveform_mb'] = settings.getint('waveform_mb', 16)
+        config['shuffle'] = settings.getboolean('shuffle', False)
+        config['repeat'] = settings.get('repeat', 'all')
+        config['normalize'] = settings.getboolean('normalize', True)
+        config['watch'] = settings.getboolean('watch', True)
+        config['history'] = settings.getboolean('history', True)
 
     config['paths'] = paths
     
     # Set defaults and validate
     config.setdefault('volume', 50)
-    config.setdefault('background', 'cava')
+    config.setdefault('visualizer', False)
     config.setdefault('audio_backend', 'auto')
+    config.setdefault('resume', True)
+    config.setdefault('keep_playing', False)
+    config.setdefault('prefetch_tracks', 2)
+    config.setdefault('prefetch_mb', 64)
+    config.setdefault('waveform_mb', 16)
+    config.setdefault('shuffle', False)
+    config.setdefault('repeat', 'all')
+    config.setdefault('normalize', True)
+    config.setdefault('watch', True)
+    config.setdefault('history', True)
     config.setdefault('paths', [])
     
     config['paths'] = sorted(list(set(config['paths'])))
     config['volume'] = max(0, min(150, config['volume']))
+    if config['repeat'] not in ('all', 'one', 'off'):
+        config['repeat'] = 'all'
 
     return config
 
 
+def write_atomic(path, text):
+    """Writes text to path through a temporary file and a rename, so a crash
+    leaves either the old or the new file, never a truncated one."""
+    CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+    # A name of its own, so writers in other threads or processes never
+    # share or delete each other's temporary file
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent,
+        prefix=f".{path.name}.",
+        suffix=".tmp"
+    )
+    tmp_path = Path(tmp_name)
+    try:
+        with open(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
 def save_config(config_dict):
     """Saves the configuration dictionary to the config file."""
-    CONFIG_DIR.mkdir(parents=True, exist_ok=True)
-    
-    with open(CONFIG_FILE, 'w') as f:
-        f.write("# PyTUI_Music Configuration File\n")
-        f.write("#\n")
-        f.write("# 'paths' is a comma-separated list of directories where your"
-                "music is stored.\n"
-                )
-        f.write("# Example: paths = /home/user/Music,/mnt/storage/Music\n")
-        f.write("#\n")
-        f.write("# 'volume' is the default volume level (0-150).\n")
-        f.write("#\n")
-        
-        f.write("[Settings]\n")
-        
-        paths = config_dict.get('paths', [])
-        if paths:
-            f.write("paths = [\n")
-            for path in paths:
-                f.write(f"  {path},\n")
-            f.write("  ]\n\n")
-        else:
-            f.write("paths = []\n\n")
-            
-        f.write(f"volume = {int(config_dict.get('volume', 50))}\n")
-        f.write(f"audio_backend = {config_dict.get('audio_backend', 'auto')}\n")
-        f.write(f"background = {config_dict.get('background', 'cava')}\n")
+    lines = [
+        "# PyTUI_Music Configuration File",
+        "#",
+        "# 'paths' is a comma-separated list of directories where your"
+        "music is stored.",
+        "# Example: paths = /home/user/Music,/mnt/storage/Music",
+        "#",
+        "# 'volume' is the default volume level (0-150).",
+        "#",
+        "# 'visualizer' shows the spectrum pane in the player (yes/no), which",
+        "# can also be toggled there with C. It needs numpy and ffmpeg.",
+        "#",
+        "# 'resume' continues the last played track on start (yes/no).",
+        "#",
+        "# 'keep_playing' keeps the music going in the menus after 'q' (yes/no).",
+        "#",
+        "# 'prefetch_tracks' upcoming tracks are read ahead, up to 'prefetch_mb'",
+        "# megabytes in total, to avoid gaps on slow storage (0 disables it).",
+        "#",
+        "# 'waveform_mb' caps the cache of track waveforms shown in the seek",
+        "# bar; 4 KB each, the least recently played are dropped first.",
+        "#",
+        "# 'shuffle' plays folders in random order (yes/no), 'repeat' is 'all',",
+        "# 'one' or 'off'. Both can also be changed in the player with s and r.",
+        "#",
+        "# 'normalize' plays every track at the same loudness (yes/no). Tracks",
+        "# are measured beforehand with --analyze-loudness.",
+        "#",
+        "# 'watch' follows tracks being added to or deleted from the open",
+        "# folder while it plays (yes/no).",
+        "#",
+        "# 'history' logs every track played, skipped or finished for the",
+        "# History view (yes/no).",
+        "#",
+        "[Settings]",
+    ]
+
+    paths = config_dict.get('paths', [])
+    if paths:
+        lines.append("paths = [")
+        for path in paths:
+            lines.append(f"  {path},")
+        lines.append("  ]")
+    else:
+        lines.append("paths = []")
+    lines.append("")
+
+    lines.append(f"volume = {int(config_dict.get('volume', 50))}")
+    lines.append(f"audio_backend = {config_dict.get('audio_backend', 'auto')}")
+    lines.append(
+        f"visualizer = {'yes' if config_dict.get('visualizer') else 'no'}"
+    )
+    lines.append(f"resume = {'yes' if config_dict.get('resume', True) else 'no'}")
+    lines.append(
+        f"keep_playing = {'yes' if config_dict.get('keep_playing') else 'no'}"
+    )
+    lines.append(f"prefetch_tracks = {int(config_dict.get('prefetch_tracks', 2))}")
+    lines.append(f"prefetch_mb = {int(config_dict.get('prefetch_mb', 64))}")
+    lines.append(f"waveform_mb = {int(config_dict.get('waveform_mb', 16))}")
+    lines.append(f"shuffle = {'yes' if config_dict.get('shuffle') else 'no'}")
+    lines.append(f"repeat = {config_dict.get('repeat', 'all')}")
+    lines.append(
+        f"normalize = {'yes' if config_dict.get('normalize', True) else 'no'}"
+    )
+    lines.append(f"watch = {'yes' if config_dict.get('watch', True) else 'no'}")
+    lines.append(
+        f"history = {'yes' if config_dict.get('history', True) else 'no'}"
+    )
+
+    write_atomic(CONFIG_FILE, "\n".join(lines) + "\n")
+
+def load_session():
+    """Loads the last playback position, or an empty dict."""
+    if not SESSION_FILE.is_file():
+        return {}
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def save_session(session):
+    write_atomic(SESSION_FILE, json.dumps(session))
+
+class Settings:
+    """Settings and session state kept in memory with write-behind saving.
+
+    ``save`` only schedules a write; changes made within ``delay`` seconds
+    are written together from a timer thread. ``flush`` writes pending
+    changes right away and must be called before exiting.
+
+    With ``keys``, only those configuration keys are written, over the
+    file as it is on disk, so a process sharing the file with the player,
+    like the daemon, keeps the player's other changes.
+    """
+
+    def __init__(self, delay=SAVE_DELAY, keys=None):
+        self.delay = delay
+        self.keys = keys
+        self.config = load_config()
+        self.session = load_session()
+        self._lock = threading.Lock()
+        # Held from taking a snapshot until it is on disk, so the timer's
+        # flush and the exit flush never overlap and the newest snapshot
+        # is always written last
+        self._write_lock = threading.Lock()
+        self._timer = None
+        self._config_dirty = False
+        self._session_dirty = False
+
+    def save(self):
+        """Schedules writing the configuration."""
+        with self._lock:
+            self._config_dirty = True
+            self._schedule()
+
+    def update_session(self, **values):
+        """Updates the session snapshot and schedules writing it."""
+        with self._lock:
+            self.session.update(values)
+            self._session_dirty = True
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes pending changes now."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                config_dirty, self._config_dirty = self._config_dirty, False
+                session_dirty, self._session_dirty = self._session_dirty, False
+                config = dict(self.config, paths=list(self.config['paths']))
+                session = dict(self.session)
+
+            try:
+                with profiler.active().stage("disk write"):
+                    if config_dirty:
+                        if self.keys is not None:
+                            config = dict(
+                                load_config(),
+                                **{key: config[key] for key in self.keys}
+                            )
+                        save_config(config)
+                        config_dirty = False
+                    if session_dirty:
+                        save_session(session)
+                        session_dirty = False
+            except OSError:
+                # Keep playing; what was not written goes with the next save
+                with self._lock:
+                    self._config_dirty |= config_dirty
+                    self._session_dirty |= session_dirty
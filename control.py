@@ -0,0 +1,427 @@
+import asyncio
+import json
+import math
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import CONFIG_DIR, load_config
+from library import get_tracks, scan_library, ALL_MUSIC
+from order import REPEAT_MODES
+from tracktable import TrackTable
+
+CONTROL_SOCKET = CONFIG_DIR / "control.sock"
+
+# Longest request line accepted from a client
+MAX_LINE = 64 * 1024
+
+class CommandError(Exception):
+    """A request that cannot be carried out; sent back as the error."""
+
+def _number(request, key):
+    value = request.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) \
+            or not math.isfinite(value):
+        raise CommandError(f"'{key}' must be a number")
+    return value
+
+def _index(request, key, default=None):
+    value = request.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise CommandError(f"'{key}' must be a whole number")
+    return value
+
+def _flag(request, key):
+    """Returns the optional yes/no argument key, or None without it."""
+    value = request.get(key)
+    if value is not None and not isinstance(value, bool):
+        raise CommandError(f"'{key}' must be true or false")
+    return value
+
+class ControlServer:
+    """Line-delimited JSON control socket for a PlayerSession.
+
+    Every request is one JSON object per line with a ``command`` and an
+    optional ``id``, which the reply carries back::
+
+        {"id": 1, "command": "play", "index": 3}
+        {"id": 1, "ok": true, "result": {...status...}}
+
+    Commands: status, play (index), pause (optional paused), next, prev,
+    volume (value or step), lock, shuffle (optional shuffle), repeat
+    (optional mode, else the next one), seek (percent), enqueue (index)
+    and subscribe. After subscribe the client is also sent
+    ``{"event": "status", "status": {...}}`` whenever the status changes;
+    only the latest status is queued, so a slow client skips states
+    instead of holding anything up.
+
+    A client that shows the playlist itself uses open (folder, optional
+    path, index and position) to play a folder or the All Music playlist,
+    playlist (optional start) for the loaded tracks from index start on as
+    ``TrackTable.pack`` data and order for the play order as
+    ``PlaybackOrder.snapshot`` data. quit is only accepted when ``on_quit``
+    is given.
+
+    The server runs its own event loop on a thread, and commands run on one
+    worker thread, so neither the curses loop nor other clients wait for
+    mpv. ``session`` only needs the methods used here, so a stub stands in
+    for it in tests. ``on_change`` is called after commands that change
+    settings, e.g. to save them, and ``on_quit`` after a quit command.
+    """
+
+    def __init__(self, session, path=CONTROL_SOCKET, on_change=None,
+                 on_quit=None):
+        self.session = session
+        self.path = str(path)
+        self.on_change = on_change
+        self.on_quit = on_quit
+        self._loop = None
+        self._server = None
+        self._stopped = None
+        self._clients = set()
+        self._subscribers = set()
+        self._last_status = None
+        self._ready = threading.Event()
+        self._worker = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="control"
+        )
+        self._thread = None
+        self.error = None
+        self._commands = {
+            'status': self._status,
+            'play': self._play,
+            'pause': self._pause,
+            'next': self._next,
+            'prev': self._prev,
+            'volume': self._volume,
+            'lock': self._lock,
+            'shuffle': self._shuffle,
+            'repeat': self._repeat,
+            'seek': self._seek,
+            'enqueue': self._enqueue,
+            'open': self._open,
+            'playlist': self._playlist,
+            'order': self._order,
+        }
+        if on_quit is not None:
+            self._commands['quit'] = self._quit
+
+    def start(self):
+        """Starts serving; returns False if the socket could not be opened
+        (see ``error``), e.g. because another instance owns it."""
+        self._thread = threading.Thread(
+            target=self._run,
+            name="control-socket",
+            daemon=True
+        )
+        self._thread.start()
+        self._ready.wait()
+        if self.error is not None:
+            return False
+        self.session.listeners.append(self._on_session_change)
+        return True
+
+    def close(self):
+        try:
+            self.session.listeners.remove(self._on_session_change)
+        except ValueError:
+            pass
+        loop = self._loop
+        if loop is not None and self._stopped is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:  # It already stopped
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._worker.shutdown(wait=False)
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
+
+    def _claim_path(self):
+        """Removes a socket left behind by an instance that is gone."""
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.path)
+        else:
+            raise OSError(f"{self.path} is in use by another player")
+        finally:
+            probe.close()
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self._claim_path()
+        self._server = await asyncio.start_unix_server(
+            self._serve,
+            path=self.path,
+            limit=MAX_LINE
+        )
+        os.chmod(self.path, 0o600)
+        self._ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            self._server.close()
+            # Closing the connections ends their tasks before the loop goes
+            for client in list(self._clients):
+                client.close()
+            tasks = [client.task for client in self._clients]
+            await asyncio.gather(*tasks, return_exceptions=True)
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    # Called on whichever thread changed the session
+    def _on_session_change(self):
+        loop = self._loop
+        if loop is not None and self._subscribers:
+            try:
+                loop.call_soon_threadsafe(self._broadcast)
+            except RuntimeError:  # The loop is closed
+                pass
+
+    def _broadcast(self):
+        status = self.session.status()
+        if status == self._last_status:
+            return
+        self._last_status = status
+        for subscriber in self._subscribers:
+            subscriber.push(status)
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        self._clients.add(client)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    await client.send({'ok': False, 'error': "line too long"})
+                    break
+                if not line:
+                    break
+                reply = await self._handle(line, client)
+                if reply is not None:
+                    await client.send(reply)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(client)
+            self._subscribers.discard(client)
+            client.close()
+
+    async def _handle(self, line, client):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'ok': False, 'error': "invalid JSON"}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "a request must be an object"}
+
+        reply = {'ok': True}
+        if 'id' in request:
+            reply['id'] = request['id']
+        command = request.get('command')
+        try:
+            if command == 'subscribe':
+                self._subscribers.add(client)
+                client.start_pushing()
+                reply['result'] = self.session.status()
+                return reply
+            handler = self._commands.get(command)
+            if handler is None:
+                raise CommandError(f"unknown command {command!r}")
+            reply['result'] = await self._loop.run_in_executor(
+                self._worker, handler, request
+            )
+        except CommandError as e:
+            reply['ok'] = False
+            reply['error'] = str(e)
+        except Exception as e:
+            # A bug must not cost the client its connection, nor end up as
+            # a traceback on the player's screen
+            reply['ok'] = False
+            reply['error'] = f"{command!r} failed: {type(e).__name__}: {e}"
+        return reply
+
+    # Command handlers run on the worker thread and return the new status
+
+    def _status(self, request):
+        return self.session.status()
+
+    def _play(self, request):
+        index = _index(request, 'index')
+        if self.session.queue is None:
+            raise CommandError("nothing is loaded")
+        if not 0 <= index < len(self.session.playlist):
+            raise CommandError(f"no track {index}")
+        self.session.play(index)
+        return self.session.status()
+
+    def _pause(self, request):
+        paused = _flag(request, 'paused')
+        if paused is None or paused != bool(self.session.state.pause):
+            self.session.toggle_pause()
+        return self.session.status()
+
+    def _next(self, request):
+        self.session.next()
+        return self.session.status()
+
+    def _prev(self, request):
+        self.session.prev()
+        return self.session.status()
+
+    def _volume(self, request):
+        if 'value' in request:
+            # Unknown until mpv reported it
+            step = _number(request, 'value') - (self.session.state.volume or 0)
+        else:
+            step = _number(request, 'step')
+        self.session.change_volume(step)
+        self._saved()
+        return self.session.status()
+
+    def _lock(self, request):
+        self.session.toggle_lock()
+        self._saved()
+        return self.session.status()
+
+    def _shuffle(self, request):
+        shuffle = _flag(request, 'shuffle')
+        if shuffle is None or shuffle != self.session.shuffle:
+            self.session.toggle_shuffle()
+            self._saved()
+        return self.session.status()
+
+    def _repeat(self, request):
+        mode = request.get('mode')
+        if mode is None:
+            self.session.cycle_repeat()
+        elif isinstance(mode, str) and mode in REPEAT_MODES:
+            self.session.set_repeat(mode)
+        else:
+            raise CommandError(f"'mode' must be one of {', '.join(REPEAT_MODES)}")
+        self._saved()
+        return self.session.status()
+
+    def _seek(self, request):
+        self.session.seek(_number(request, 'percent'))
+        return self.session.status()
+
+    def _enqueue(self, request):
+        index = _index(request, 'index')
+        if not 0 <= index < len(self.session.playlist):
+            raise CommandError(f"no track {index}")
+        self.session.enqueue(index)
+        return self.session.status()
+
+    def _open(self, request):
+        folder = request.get('folder')
+        if not isinstance(folder, str):
+            raise CommandError("'folder' must be a string")
+        path = request.get('path')
+        if path is not None and not isinstance(path, str):
+            raise CommandError("'path' must be a string")
+        if folder == ALL_MUSIC:
+            # The paths may have been changed by a client since we started
+            playlist = scan_library(load_config()['paths'])
+        else:
+            playlist = TrackTable.from_paths(get_tracks(folder))
+        if not len(playlist):
+            raise CommandError(f"no audio files in {folder}")
+
+        # The path wins over the index, in case the folder changed since
+        # the client listed it
+        index = playlist.find(path or "")
+        if index < 0:
+            index = _index(request, 'index', 0)
+            if not 0 <= index < len(playlist):
+                index = 0
+        position = request.get('position')
+        if position is not None:
+            position = _number(request, 'position')
+        self.session.load(folder, playlist, index, position)
+        return self.session.status()
+
+    def _playlist(self, request):
+        session = self.session
+        start = _index(request, 'start', 0)
+        if start < 0:
+            raise CommandError("'start' must not be negative")
+        with session.lock:
+            folder, playlist = session.folder, session.playlist
+            if not isinstance(playlist, TrackTable):
+                playlist = TrackTable.from_paths(playlist)
+            # Under the lock, as the watcher may be adding tracks
+            data = playlist.pack(min(start, len(playlist)))
+        return dict(data, folder=folder)
+
+    def _order(self, request):
+        session = self.session
+        with session.lock:
+            if session.order is None:
+                return None
+            return dict(session.order.snapshot(), version=session.order_version)
+
+    def _quit(self, request):
+        self.on_quit()
+        return None
+
+    def _saved(self):
+        if self.on_change is not None:
+            self.on_change()
+
+class _Client:
+    """One connection. Pushed statuses go through a single slot that a
+    writer task empties, so a client that reads slowly only ever has the
+    newest status waiting."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self._lock = asyncio.Lock()
+        self._latest = None
+        self._pending = asyncio.Event()
+        self._pusher = None
+
+    async def send(self, message):
+        async with self._lock:
+            self.writer.write(json.dumps(message).encode() + b"\n")
+            await self.writer.drain()
+
+    def start_pushing(self):
+        if self._pusher is None:
+            self._pusher = asyncio.get_running_loop().create_task(self._push())
+
+    def push(self, status):
+        self._latest = status
+        self._pending.set()
+
+    async def _push(self):
+        try:
+            while True:
+                await self._pending.wait()
+                self._pending.clear()
+                await self.send({'event': 'status', 'status': self._latest})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def close(self):
+        if self._pusher is not None:
+            self._pusher.cancel()
+        self.writer.close()
@@ -0,0 +1,148 @@
+import json
+import os
+import signal
+import socket
+import threading
+from config import CONFIG_DIR, Settings
+from control import ControlServer, CONTROL_SOCKET
+from library import close_all, get_tracks, scan_library, ALL_MUSIC
+from session import PlayerSession
+from tracktable import TrackTable
+
+DAEMON_LOG = CONFIG_DIR / "daemon.log"
+
+# Seconds between saves of the playback position
+SESSION_INTERVAL = 5
+
+# The only settings the daemon changes; clients own the rest of the file
+DAEMON_KEYS = ('volume', 'repeat', 'shuffle')
+
+def daemonize():
+    """Detaches from the terminal, so the daemon outlives it.
+
+    Returns in the grandchild only; the original process exits. Output
+    goes to DAEMON_LOG.
+    """
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    # A second fork gives up the session lead, so no terminal comes back
+    if os.fork() > 0:
+        os._exit(0)
+    os.chdir("/")
+    CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+    null = os.open(os.devnull, os.O_RDWR)
+    log = os.open(DAEMON_LOG, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(null, 0)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    os.close(null)
+    os.close(log)
+
+def _resume(session, last):
+    """Plays the last session's playlist from where it stopped."""
+    folder = last.get('folder')
+    if folder == ALL_MUSIC:
+        playlist = scan_library(session.config['paths'])
+    elif folder and os.path.isdir(folder):
+        playlist = TrackTable.from_paths(get_tracks(folder))
+    else:
+        return
+    if not len(playlist):
+        return
+    start_idx = playlist.find(last.get('path') or "")
+    if start_idx < 0:
+        start_idx = last.get('track', 0)
+        if not 0 <= start_idx < len(playlist):
+            start_idx = 0
+    session.load(folder, playlist, start_idx, last.get('position'))
+
+def run_daemon():
+    """Plays in the background until a client sends quit or the process is
+    terminated, serving the control socket. Returns the exit status."""
+    settings = Settings(keys=DAEMON_KEYS)
+    session = PlayerSession(settings.config)
+    stopped = threading.Event()
+    control = ControlServer(
+        session,
+        on_change=settings.save,
+        on_quit=stopped.set
+    )
+    if not control.start():
+        print(f"Could not open the control socket: {control.error}")
+        session.close()
+        return 1
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: stopped.set())
+    try:
+        if settings.config.get('resume'):
+            _resume(session, settings.session)
+        print(f"Daemon {os.getpid()} listening on {control.path}", flush=True)
+        while not stopped.wait(SESSION_INTERVAL):
+            _save_position(session, settings)
+        _save_position(session, settings)
+    finally:
+        control.close()
+        session.close()
+        settings.flush()
+        close_all()
+    return 0
+
+def _save_position(session, settings):
+    status = session.status()
+    if status['path'] is not None:
+        settings.update_session(
+            folder=status['folder'],
+            path=status['path'],
+            track=status['index'],
+            position=session.state.time_pos or 0
+        )
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def is_running(path=CONTROL_SOCKET):
+    """True if a player or daemon serves the control socket at path."""
+    sock = _connect(path)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+def stop_daemon(path=CONTROL_SOCKET, timeout=5):
+    """Asks the daemon listening on path to quit and waits until it has.
+
+    Returns False if nothing listens on path, if what listens is a player
+    rather than a daemon (it refuses quit), or if it has not stopped after
+    timeout seconds.
+    """
+    sock = _connect(path)
+    if sock is None:
+        return False
+    try:
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps({'command': 'quit', 'id': 1}).encode() + b"\n")
+        with sock.makefile('rb') as lines:
+            line = lines.readline()
+            # The daemon may be gone before its reply goes out, but a
+            # player always answers, with an error
+            if line:
+                reply = json.loads(line)
+                if not isinstance(reply, dict) or not reply.get('ok'):
+                    return False
+            # The daemon closes every connection on its way out
+            while lines.readline():
+                pass
+    except (OSError, ValueError):
+        # Including socket.timeout: a daemon that did not stop is running
+        return False
+    finally:
+        sock.close()
+    return not is_running(path)
@@ -0,0 +1,238 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import CONFIG_DIR
+
+HASHES_DB = CONFIG_DIR / "hashes.db"
+
+# Bytes of the map passed to the hash at a time
+CHUNK = 1 << 20
+
+# Niceness of the hashing workers, so playback and the UI come first
+WORKER_NICENESS = 10
+
+# Paths with the same contents: size is that of one copy and files the
+# number of copies on disk, which is less than len(paths) for hard links
+Duplicates = namedtuple('Duplicates', 'size files paths')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    PRIMARY KEY (dev, inode)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS copies (
+    path TEXT PRIMARY KEY,
+    grp INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+def file_digest(path):
+    """Returns the BLAKE2b digest of the contents of path and the stat it
+    was taken with. Raises OSError if it cannot be read."""
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        digest = hashlib.blake2b(digest_size=16)
+        if st.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if hasattr(data, 'madvise'):
+                    data.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(data)
+                try:
+                    for start in range(0, len(view), CHUNK):
+                        digest.update(view[start:start + CHUNK])
+                finally:
+                    view.release()
+    return digest.digest(), st
+
+class HashCache:
+    """SQLite cache of file digests keyed by (device, inode), valid while
+    the size and mtime match, plus the last duplicate report.
+
+    Keying by inode lets a renamed or moved file keep its digest and hashes
+    hard links only once.
+    """
+
+    def __init__(self, db_file=HASHES_DB):
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def lookup(self, st):
+        """Returns the digest of the file st is for, if hashed as it is now."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM hashes "
+                "WHERE dev = ? AND inode = ? AND size = ? AND mtime = ?",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def store(self, rows):
+        """Stores a batch of (dev, inode, size, mtime, digest) rows."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO hashes (dev, inode, size, mtime, digest) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def save_report(self, groups):
+        """Replaces the stored report with groups as returned by
+        find_duplicates."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM copies")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO copies (path, grp) VALUES (?, ?)",
+                (
+                    (path, number)
+                    for number, group in enumerate(groups)
+                    for path in group.paths
+                )
+            )
+
+    def report(self):
+        """Returns the paths of the last report, which all have a copy."""
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT path FROM copies")}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def load_report():
+    """Returns the paths found to have copies by the last search, or an
+    empty set if there was none."""
+    if not HASHES_DB.exists():
+        return set()
+    try:
+        cache = HashCache()
+    except sqlite3.Error:
+        return set()
+    try:
+        return cache.report()
+    finally:
+        cache.close()
+
+def _lower_priority():
+    try:
+        os.nice(WORKER_NICENESS)
+    except OSError:
+        pass
+
+def _hash_job(path):
+    try:
+        digest, st = file_digest(path)
+    except (OSError, ValueError):
+        return path, None
+    return path, (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest)
+
+def find_duplicates(paths, cache=None, workers=1, on_progress=None):
+    """Finds the paths whose contents are the same.
+
+    Only files that share their size with another file are hashed, and
+    only once per inode. Empty files are left out. Digests not in the cache are computed by a pool
+    of niced processes and stored as they come in, so an interrupted run
+    resumes where it stopped. on_progress(done, total, failed) is called
+    after every hashed file. The groups are saved as the report shown in
+    the player.
+
+    Returns (groups, failed): groups are Duplicates with sorted paths,
+    ordered by path, and failed counts the files that could not be read.
+    """
+    own_cache = cache is None
+    if own_cache:
+        cache = HashCache()
+
+    by_size = {}
+    failed = 0
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            failed += 1
+            continue
+        by_size.setdefault(st.st_size, []).append((path, st))
+
+    # Hard links are one file, so one path per inode is hashed for all
+    digests = {}
+    links = {}
+    sizes = {}
+    todo = []
+    for size, files in by_size.items():
+        if len(files) < 2 or size == 0:
+            continue
+        for path, st in files:
+            inode = (st.st_dev, st.st_ino)
+            if inode in links:
+                links[inode].append(path)
+                continue
+            links[inode] = [path]
+            sizes[inode] = size
+            digest = cache.lookup(st)
+            if digest is None:
+                todo.append(path)
+            else:
+                digests[inode] = digest
+
+    done = 0
+    batch = []
+    try:
+        if todo:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_lower_priority
+            ) as pool:
+                futures = [pool.submit(_hash_job, path) for path in todo]
+                try:
+                    for future in as_completed(futures):
+                        path, result = future.result()
+                        if result is None:
+                            failed += 1
+                        else:
+                            batch.append(result)
+                            digests[result[0], result[1]] = result[4]
+                        done += 1
+                        if len(batch) >= 100:
+                            cache.store(batch)
+                            batch = []
+                        if on_progress is not None:
+                            on_progress(done, len(todo), failed)
+                finally:
+                    for future in futures:
+                        future.cancel()
+                    if batch:
+                        cache.store(batch)
+
+        by_digest = {}
+        for inode, digest in digests.items():
+            # A file replaced while it was hashed is under a new inode
+            if inode in links:
+                by_digest.setdefault(digest, []).append(inode)
+        groups = sorted(
+            (
+                Duplicates(
+                    sizes[inodes[0]],
+                    len(inodes),
+                    sorted(path for inode in inodes for path in links[inode])
+                )
+                for inodes in by_digest.values()
+                if len(inodes) > 1
+            ),
+            key=lambda group: group.paths
+        )
+        cache.save_report(groups)
+    finally:
+        if own_cache:
+            cache.close()
+    return groups, failed
@@ -0,0 +1,77 @@
+import os
+import sys
+import curses
+import select
+import signal
+
+_wakers = set()
+
+def _on_resize(signum, frame):
+    """Resizes curses to the new terminal size and wakes every waiting loop."""
+    try:
+        columns, lines = os.get_terminal_size(sys.__stdout__.fileno())
+        curses.resizeterm(lines, columns)
+    except (OSError, ValueError, curses.error):
+        pass
+    for waker in list(_wakers):
+        waker.wake()
+
+class Waker:
+    """Self-pipe that lets other threads interrupt a wait for keyboard input.
+
+    ``wait`` blocks on stdin and the pipe together, so the UI loop sleeps
+    until a key is pressed, ``wake`` is called (e.g. from an mpv property
+    observer) or the timeout expires.
+    """
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._read_fd, False)
+        os.set_blocking(self._write_fd, False)
+        self._stdin_fd = sys.stdin.fileno()
+        self.woken = False
+        _wakers.add(self)
+
+        # select() does not see curses' own SIGWINCH handling, so resizes
+        # have to wake the loop themselves.
+        if hasattr(signal, 'SIGWINCH') \
+                and signal.getsignal(signal.SIGWINCH) is not _on_resize:
+            signal.signal(signal.SIGWINCH, _on_resize)
+
+    def wake(self):
+        """Interrupts the current or next wait. Safe to call from any thread."""
+        write_fd = self._write_fd
+        if write_fd is None:
+            return
+        try:
+            os.write(write_fd, b'\0')
+        except (BlockingIOError, OSError):
+            pass  # The pipe is full or closed, a wake-up is pending anyway
+
+    def wait(self, timeout=None):
+        """Waits for a key, a wake-up or the timeout (in seconds, None = forever).
+
+        Sets ``woken`` when the wait ended because of ``wake``.
+        """
+        try:
+            readable, _, _ = select.select(
+                [self._stdin_fd, self._read_fd], [], [], timeout
+            )
+        except (OSError, ValueError):
+            readable = []
+        self.woken = self._read_fd in readable
+        if self.woken:
+            try:
+                while os.read(self._read_fd, 4096):
+                    pass
+            except (BlockingIOError, OSError):
+                pass
+
+    def close(self):
+        _wakers.discard(self)
+        write_fd, self._write_fd = self._write_fd, None
+        for fd in (self._read_fd, write_fd):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
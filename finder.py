@@ -0,0 +1,224 @@
+import os
+import re
+import heapq
+from bisect import bisect_right
+import threading
+from config import CONFIG_DIR, write_atomic
+
+DIRS_CACHE_FILE = CONFIG_DIR / "dirs.cache"
+
+# Characters after which a match counts as the start of a word
+WORD_BOUNDARIES = "/ _-."
+
+# Matches scored in detail per search; broad queries stop scanning there
+SCORE_LIMIT = 2000
+
+class DirectoryTree:
+    """All directories below a root, kept on disk between runs.
+
+    The cached list from the last run is available immediately, while a
+    background thread walks the tree again and replaces it. Like ``fd -L``
+    hidden directories are skipped and symlinks are followed, with loops
+    detected by device and inode.
+    """
+
+    def __init__(self, root, cache_file=DIRS_CACHE_FILE, on_update=None):
+        self.root = root
+        self.cache_file = cache_file
+        self.on_update = on_update
+        self.version = 0
+        self.scanning = True
+        self._dirs = self._load_cache()
+        self._cancelled = False
+        self._thread = threading.Thread(
+            target=self._scan,
+            name="finder-scan",
+            daemon=True
+        )
+        self._thread.start()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return []
+        # The first line records which root the cache belongs to
+        if not lines or lines[0] != self.root:
+            return []
+        return lines[1:]
+
+    def dirs(self):
+        return self._dirs
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _scan(self):
+        found = []
+        visited = set()
+        stack = [self.root]
+        while stack and not self._cancelled:
+            path = stack.pop()
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            found.append(path)
+
+            children = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        try:
+                            if entry.is_dir():
+                                children.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            # Reversed so that the stack pops them in name order
+            stack.extend(sorted(children, reverse=True))
+
+        self.scanning = False
+        if self._cancelled:
+            return
+
+        self._dirs = found
+        self.version += 1
+        try:
+            write_atomic(
+                self.cache_file,
+                "\n".join([self.root] + found) + "\n"
+            )
+        except (OSError, UnicodeEncodeError):
+            pass
+        if self.on_update is not None:
+            self.on_update()
+
+def _score(path, query):
+    """Scores how well query matches path as a subsequence (higher is better).
+
+    Matches inside the last path component, at word starts and in runs of
+    consecutive characters are preferred, as are shorter paths.
+    """
+    base_start = path.rfind('/', 0, len(path) - 1) + 1
+    best = None
+    for start in (base_start, 0):
+        score = 0
+        pos = start
+        last = -2
+        for char in query:
+            pos = path.find(char, pos)
+            if pos < 0:
+                break
+            if pos == last + 1:
+                score += 8
+            if pos == 0 or path[pos - 1] in WORD_BOUNDARIES:
+                score += 6
+            last = pos
+            pos += 1
+        else:
+            if start == base_start:
+                score += 30
+            if best is None or score > best:
+                best = score
+    if best is None:
+        return None
+    return best - len(path) / 20
+
+class FuzzyIndex:
+    """Incremental subsequence matcher over a list of paths.
+
+    Candidates are kept shortest first and joined into one string, so the
+    regex engine does the scanning. Broad queries stop after the first
+    ``SCORE_LIMIT`` matches; narrow ones remember all their matches, and a
+    query that only grew filters those instead of the whole list.
+    """
+
+    def __init__(self, candidates):
+        # Among equally good matches the shorter path is the likelier pick
+        self.candidates = sorted(candidates, key=len)
+        self._lower = [c.lower() for c in self.candidates]
+        self._base = [
+            c[c.rfind('/', 0, len(c) - 1) + 1:] for c in self._lower
+        ]
+        self._text, self._starts = _join(self._lower)
+        self._base_text, self._base_starts = _join(self._base)
+        self._last_query = ""
+        self._last_matches = None
+
+    def search(self, query, limit=200):
+        """Returns up to limit candidates matching query, best first."""
+        query = query.lower()
+        if not query:
+            self._last_query = ""
+            self._last_matches = None
+            return self.candidates[:limit]
+
+        pattern = _pattern(query)
+        if self._last_matches is not None \
+                and query.startswith(self._last_query):
+            matches = [i for i in self._last_matches
+                       if pattern.match("\n" + self._lower[i])]
+            complete = True
+        else:
+            matches, complete = _scan(self._text, self._starts, pattern)
+        if complete:
+            # A name only matches where its full path does
+            in_base = [i for i in matches if pattern.match("\n" + self._base[i])]
+        else:
+            in_base, _ = _scan(self._base_text, self._base_starts, pattern)
+
+        self._last_query = query
+        self._last_matches = matches if complete else None
+
+        scored = []
+        for i in set(in_base[:SCORE_LIMIT]) | set(matches[:SCORE_LIMIT]):
+            score = _score(self._lower[i], query)
+            if score is not None:
+                scored.append((score, -i))
+        best = heapq.nlargest(limit, scored)
+        return [self.candidates[-i] for _, i in best]
+
+def _pattern(query):
+    """Compiles a regex matching query as a subsequence within one line.
+
+    It starts at the newline before a line, which the engine finds as a
+    literal, and every gap stops at the first occurrence of the next query
+    character, so each line is tried once and one that does not match
+    fails without backtracking.
+    """
+    parts = ["\n"]
+    for char in query:
+        char = re.escape(char)
+        parts.append(f"[^{char}\n]*{char}")
+    return re.compile("".join(parts))
+
+def _join(lines):
+    """Puts a newline before every line and returns the text and the offset
+    of each line's newline."""
+    starts = []
+    offset = 0
+    for line in lines:
+        starts.append(offset)
+        offset += len(line) + 1
+    return "".join("\n" + line for line in lines), starts
+
+def _scan(text, starts, pattern):
+    """Returns (indices of the lines pattern matches, whether all were found)."""
+    found = []
+    last = -1
+    for match in pattern.finditer(text):
+        i = bisect_right(starts, match.start()) - 1
+        if i != last:
+            found.append(i)
+            last = i
+            if len(found) >= SCORE_LIMIT:
+                return found, False
+    return found, True
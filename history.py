@@ -0,0 +1,335 @@
+import fcntl
+import hashlib
+import os
+import queue
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from config import CONFIG_DIR
+
+HISTORY_LOG = CONFIG_DIR / "history.log"
+HISTORY_DB = CONFIG_DIR / "history.db"
+
+# Menu entry of the history view
+HISTORY = "[ History ]"
+
+# Events recorded for a track
+START = 1     # began playing
+SKIP = 2      # left before its end
+COMPLETE = 3  # played to its end
+# Names the track id that events refer to; written once per process
+PATH = 0
+
+# Start of the log, followed by 8 random bytes telling logs apart
+MAGIC = b"PTMHIST1"
+LOG_HEADER = len(MAGIC) + 8
+
+# Every record is (CRC-32 of the body, body length) and the body. The body
+# is (kind, track id) followed by (unix time, seconds played) for events
+# and by the UTF-8 path for PATH records.
+RECORD = struct.Struct('<IH')
+BODY = struct.Struct('<Bq')
+EVENT = struct.Struct('<IH')
+
+# Records written before the aggregates are brought up to date
+ROLLUP_RECORDS = 256
+
+# Rows shown by the most and recently played lists
+TOP_ROWS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    starts INTEGER NOT NULL DEFAULT 0,
+    completions INTEGER NOT NULL DEFAULT 0,
+    skips INTEGER NOT NULL DEFAULT 0,
+    seconds INTEGER NOT NULL DEFAULT 0,
+    last_start INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tracks_completions ON tracks (completions, starts);
+CREATE INDEX IF NOT EXISTS tracks_last_start ON tracks (last_start);
+CREATE TABLE IF NOT EXISTS rollup (
+    log BLOB NOT NULL,
+    position INTEGER NOT NULL
+);
+"""
+
+# Aggregates of one track; last is the unix time it last started
+TrackStats = namedtuple(
+    'TrackStats',
+    'path starts completions skips seconds last'
+)
+
+def track_id(path):
+    """Returns the 64-bit id path is logged under."""
+    digest = hashlib.blake2b(os.fsencode(path), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+def _record(body):
+    return RECORD.pack(zlib.crc32(body), len(body)) + body
+
+def read_records(data, offset):
+    """Yields (end offset, kind, track id, rest of the body) for the records
+    of log contents data from offset on. Stops at the first record that is
+    cut short or fails its CRC, as a crash may leave one at the end."""
+    while offset + RECORD.size <= len(data):
+        crc, size = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        body = data[start:start + size]
+        if len(body) < BODY.size or len(body) < size or zlib.crc32(body) != crc:
+            return
+        kind, track = BODY.unpack_from(body)
+        offset = start + size
+        yield offset, kind, track, body[BODY.size:]
+
+class PlayHistory:
+    """Append-only log of the tracks played, with aggregates per track.
+
+    ``record`` only queues an event; a writer thread appends it to the log
+    with a CRC per record and syncs it to disk, so a crash loses at most
+    the event being written and never garbles earlier ones. A torn record
+    at the end is cut off before the next append.
+
+    The per-track counts live in SQLite and are brought up to date from
+    the log every ``ROLLUP_RECORDS`` records and before every query, so
+    queries read a few rows however long the history is. The aggregates
+    can always be rebuilt from the log. Several processes may share both
+    files: appends and rollups take a lock on the log.
+    """
+
+    def __init__(self, log_file=HISTORY_LOG, db_file=HISTORY_DB):
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self.log_file = log_file
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(db_file),
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._fd = os.open(
+            log_file,
+            os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC,
+            0o644
+        )
+        self._queue = queue.SimpleQueue()
+        # Track ids whose path this process has logged
+        self._named = set()
+        self._unrolled = 0
+        self._closed = False
+        # Started here rather than on the first record, which may come
+        # from mpv's event thread and the main thread at once
+        self._writer = threading.Thread(
+            target=self._write,
+            name="history",
+            daemon=True
+        )
+        self._writer.start()
+
+    def record(self, event, path, seconds=0):
+        """Queues event (START, SKIP or COMPLETE) for path, with the seconds
+        of it that were played. Never blocks."""
+        if self._closed:
+            return
+        self._queue.put((event, path, int(time.time()), seconds))
+
+    # Runs on the writer thread
+    def _write(self):
+        while True:
+            items = [self._queue.get()]
+            # Whatever else came in meanwhile goes out in the same write
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in items
+            chunks = []
+            for item in items:
+                if item is None:
+                    continue
+                event, path, when, seconds = item
+                track = track_id(path)
+                if track not in self._named:
+                    self._named.add(track)
+                    chunks.append(_record(BODY.pack(PATH, track) + os.fsencode(path)))
+                chunks.append(_record(
+                    BODY.pack(event, track)
+                    + EVENT.pack(when, max(0, min(0xFFFF, int(seconds))))
+                ))
+            if chunks:
+                try:
+                    self._append(b''.join(chunks))
+                except OSError:
+                    pass  # Disk full or gone: history is not worth a crash
+                self._unrolled += len(chunks)
+                if self._unrolled >= ROLLUP_RECORDS:
+                    try:
+                        self.rollup()
+                    except (OSError, sqlite3.Error):
+                        pass  # Tried again before the next query
+            if stop:
+                return
+
+    def _append(self, data):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(self._fd).st_size
+                if size < LOG_HEADER or os.pread(self._fd, len(MAGIC), 0) != MAGIC:
+                    # New, or not a log at all
+                    os.ftruncate(self._fd, 0)
+                    os.write(self._fd, MAGIC + os.urandom(8))
+                    self._named.clear()
+                else:
+                    self._repair(size)
+                # One write, so other readers see whole records or none
+                os.write(self._fd, data)
+                os.fsync(self._fd)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _repair(self, size):
+        """Cuts off a record torn by a crash at the end of the log. Only
+        called with the log locked, when no record is half written."""
+        offset = self._rolled_offset()
+        if offset is None or offset > size:
+            offset = LOG_HEADER
+        valid = 0
+        for valid, kind, track, rest in read_records(
+                os.pread(self._fd, size - offset, offset), 0):
+            pass
+        if offset + valid < size:
+            os.ftruncate(self._fd, offset + valid)
+
+    def _rolled_offset(self):
+        """Returns how far the aggregates have read the log, or None if they
+        were built from another log."""
+        row = self._db.execute("SELECT log, position FROM rollup").fetchone()
+        if row is None or row[0] != self._log_id():
+            return None
+        return row[1]
+
+    def _log_id(self):
+        return os.pread(self._fd, 8, len(MAGIC))
+
+    def rollup(self):
+        """Folds the records logged since the last rollup into the
+        aggregates."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._fold()
+                    self._db.execute("COMMIT")
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._unrolled = 0
+
+    def _fold(self):
+        size = os.fstat(self._fd).st_size
+        if size < LOG_HEADER or os.pread(self._fd, len(MAGIC), 0) != MAGIC:
+            return
+        offset = self._rolled_offset()
+        if offset is None or offset > size:
+            # A new log: start over from its first record
+            self._db.execute("DELETE FROM tracks")
+            self._db.execute("DELETE FROM rollup")
+            offset = LOG_HEADER
+        data = os.pread(self._fd, size - offset, offset)
+
+        paths = {}
+        # Track id -> [starts, completions, skips, seconds, last]
+        counts = {}
+        end = 0
+        for end, kind, track, rest in read_records(data, 0):
+            if kind == PATH:
+                paths[track] = os.fsdecode(rest)
+                continue
+            if len(rest) != EVENT.size:
+                continue
+            when, seconds = EVENT.unpack(rest)
+            entry = counts.setdefault(track, [0, 0, 0, 0, 0])
+            if kind == START:
+                entry[0] += 1
+                entry[4] = max(entry[4], when)
+            elif kind == COMPLETE:
+                entry[1] += 1
+            elif kind == SKIP:
+                entry[2] += 1
+            entry[3] += seconds
+
+        self._db.executemany(
+            "INSERT INTO tracks (id, path) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET path = excluded.path",
+            paths.items()
+        )
+        self._db.executemany(
+            "UPDATE tracks SET starts = starts + ?, "
+            "completions = completions + ?, skips = skips + ?, "
+            "seconds = seconds + ?, last_start = max(last_start, ?) "
+            "WHERE id = ?",
+            (entry + [track] for track, entry in counts.items())
+        )
+        self._db.execute("DELETE FROM rollup")
+        self._db.execute(
+            "INSERT INTO rollup (log, position) VALUES (?, ?)",
+            (self._log_id(), offset + end)
+        )
+
+    def _query(self, sql, args=()):
+        self.rollup()
+        with self._lock:
+            return [
+                TrackStats(*row)
+                for row in self._db.execute(sql, args)
+            ]
+
+    def most_played(self, limit=TOP_ROWS):
+        """Returns the tracks played to their end most often first."""
+        return self._query(
+            "SELECT path, starts, completions, skips, seconds, last_start "
+            "FROM tracks WHERE starts > 0 "
+            "ORDER BY completions DESC, starts DESC LIMIT ?",
+            (limit,)
+        )
+
+    def recently_played(self, limit=TOP_ROWS):
+        """Returns the tracks that started last first."""
+        return self._query(
+            "SELECT path, starts, completions, skips, seconds, last_start "
+            "FROM tracks WHERE starts > 0 ORDER BY last_start DESC LIMIT ?",
+            (limit,)
+        )
+
+    def played_paths(self):
+        """Returns the set of paths that ever started playing."""
+        self.rollup()
+        with self._lock:
+            return {
+                row[0] for row in
+                self._db.execute("SELECT path FROM tracks WHERE starts > 0")
+            }
+
+    def close(self):
+        """Writes the queued events and the aggregates, then closes."""
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        try:
+            self.rollup()
+        except (OSError, sqlite3.Error):
+            pass
+        with self._lock:
+            self._db.close()
+            os.close(self._fd)
@@ -0,0 +1,315 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import CONFIG_DIR
+from utils import supported_exts
+from tracktable import TrackTable
+
+# Session key of the playlist holding every track of every base path
+ALL_MUSIC = "[ All Music ]"
+
+LIBRARY_DIR = CONFIG_DIR / "library"
+
+# Directories modified this recently are rescanned on the next visit, since
+# coarse mtimes (FAT on SD cards, some network mounts) could hide a change.
+RACY_MTIME_NS = 2_000_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    PRIMARY KEY (dir, name)
+) WITHOUT ROWID;
+"""
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+class LibraryIndex:
+    """On-disk index of the folders and tracks below one base path.
+
+    A directory is only listed again when its mtime differs from the one
+    recorded in the index, so reopening an unchanged folder costs one stat.
+    """
+
+    def __init__(self, base_path):
+        self.base_path = os.path.normpath(base_path)
+        LIBRARY_DIR.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha1(
+            self.base_path.encode('utf-8', 'surrogateescape')
+        ).hexdigest()[:16]
+        self.db_path = LIBRARY_DIR / f"{digest}.db"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def scan_dir(self, path, stat_result=None):
+        """Returns (sub-folder names, track names) of path, both sorted.
+
+        stat_result saves a stat when the caller already has one for path.
+        """
+        path = os.path.normpath(path)
+        try:
+            mtime = (stat_result or os.stat(path)).st_mtime_ns
+        except OSError:
+            self.forget(path)
+            return [], []
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mtime FROM dirs WHERE path = ?", (path,)
+            ).fetchone()
+            if row is not None and row[0] == mtime:
+                return self._cached_entries(path)
+
+        subdirs, tracks = _list_dir(path)
+        if time.time_ns() - mtime < RACY_MTIME_NS:
+            mtime = -1
+        self._store(path, mtime, subdirs, tracks)
+        return subdirs, tracks
+
+    def folders(self, path=None):
+        """Returns the sorted sub-folder names of path (default: the base)."""
+        return self.scan_dir(path or self.base_path)[0]
+
+    def tracks(self, path):
+        """Returns the sorted full paths of the audio files in path."""
+        return [os.path.join(path, name) for name in self.scan_dir(path)[1]]
+
+    def forget(self, path):
+        """Drops path and everything indexed below it."""
+        path = os.path.normpath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock, self._db:
+            for table, column in (("dirs", "path"), ("entries", "dir")):
+                self._db.execute(
+                    f"DELETE FROM {table} WHERE {column} = ? "
+                    f"OR substr({column}, 1, ?) = ?",
+                    (path, len(prefix), prefix)
+                )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _cached_entries(self, path):
+        subdirs = []
+        tracks = []
+        for name, is_dir in self._db.execute(
+            "SELECT name, is_dir FROM entries WHERE dir = ?", (path,)
+        ):
+            (subdirs if is_dir else tracks).append(name)
+        subdirs.sort()
+        tracks.sort()
+        return subdirs, tracks
+
+    def _store(self, path, mtime, subdirs, tracks):
+        rows = [(path, name, 1) for name in subdirs]
+        rows += [(path, name, 0) for name in tracks]
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE dir = ?", (path,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries (dir, name, is_dir) "
+                "VALUES (?, ?, ?)",
+                rows
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)",
+                (path, mtime)
+            )
+
+class AlbumScanner:
+    """Finds every folder below a base path that contains tracks.
+
+    Folders are walked on a thread pool through the library index, so
+    unchanged folders cost a single stat. Symlinked folders are followed,
+    with loops detected by device and inode, and hidden folders are
+    skipped. Found albums are collected for ``drain`` as they turn up, and
+    ``on_found`` is called so a UI can show them before the walk is done.
+    """
+
+    def __init__(self, base_path, on_found=None, workers=8):
+        self.base_path = os.path.normpath(base_path)
+        self.index = open_index(self.base_path)
+        self.on_found = on_found
+        self.done = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._found = []
+        self._visited = set()
+        self._pending = 0
+        self._cancelled = False
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="scan"
+        )
+        self._submit(self.base_path)
+
+    def _submit(self, path):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._pending += 1
+        try:
+            self._pool.submit(self._visit, path)
+        except RuntimeError:  # Shut down by cancel()
+            self._finish_one()
+
+    def _finish_one(self):
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self.done = True
+                self._done.set()
+        if self.done and self.on_found is not None:
+            self.on_found()
+
+    def _visit(self, path):
+        try:
+            if self._cancelled:
+                return
+            try:
+                st = os.stat(path)
+            except OSError:
+                return
+            with self._lock:
+                if (st.st_dev, st.st_ino) in self._visited:
+                    return
+                self._visited.add((st.st_dev, st.st_ino))
+
+            subdirs, tracks = self.index.scan_dir(path, st)
+            for name in subdirs:
+                if not name.startswith('.'):
+                    self._submit(os.path.join(path, name))
+
+            if tracks and path != self.base_path:
+                with self._lock:
+                    self._found.append(os.path.relpath(path, self.base_path))
+                if self.on_found is not None:
+                    self.on_found()
+        finally:
+            self._finish_one()
+
+    def wait(self, timeout=None):
+        """Waits until the walk is done; returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def drain(self):
+        """Returns the albums found since the last call, as paths relative
+        to the base path."""
+        with self._lock:
+            found, self._found = self._found, []
+        return found
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def _list_dir(path):
+    """Lists path once, splitting it into sub-folders and audio files."""
+    subdirs = []
+    tracks = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                # Names that cannot be encoded can't be stored in the index
+                # or passed on to mpv reliably, so skip them.
+                try:
+                    entry.name.encode('utf-8')
+                except UnicodeEncodeError:
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif entry.name.lower().endswith(supported_exts):
+                        tracks.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        return [], []
+    subdirs.sort()
+    tracks.sort()
+    return subdirs, tracks
+
+def open_index(base_path):
+    """Returns the shared LibraryIndex for base_path, opening it if needed."""
+    base_path = os.path.normpath(base_path)
+    with _indexes_lock:
+        index = _indexes.get(base_path)
+        if index is None:
+            index = LibraryIndex(base_path)
+            _indexes[base_path] = index
+        return index
+
+def index_for(path):
+    """Returns the index of the deepest open base path containing path.
+
+    Falls back to an index rooted at the parent folder of path.
+    """
+    path = os.path.normpath(path)
+    with _indexes_lock:
+        candidates = [
+            base for base in _indexes
+            if path == base or path.startswith(base.rstrip(os.sep) + os.sep)
+        ]
+    if candidates:
+        return open_index(max(candidates, key=len))
+    return open_index(os.path.dirname(path) or path)
+
+def fill_track_table(table, base_path, albums):
+    """Appends the tracks of base_path and of albums (paths relative to it,
+    as found by AlbumScanner) to a TrackTable, in path order.
+
+    Folders the table already holds, e.g. from an enclosing base path, are
+    skipped.
+    """
+    index = open_index(base_path)
+    folders = [index.base_path] + [
+        os.path.join(index.base_path, album) for album in sorted(albums)
+    ]
+    for folder in folders:
+        if table.has_folder(folder):
+            continue
+        names = index.scan_dir(folder)[1]
+        if names:
+            table.add_folder(folder, names)
+
+def scan_library(base_paths):
+    """Returns a TrackTable of every track below base_paths, in the order
+    of the All Music playlist."""
+    table = TrackTable()
+    for base_path in base_paths:
+        scanner = AlbumScanner(base_path)
+        try:
+            scanner.wait()
+            albums = scanner.drain()
+        finally:
+            scanner.cancel()
+        fill_track_table(table, base_path, albums)
+    return table
+
+def get_folders(path):
+    if not os.path.isdir(path):
+        return []
+    return open_index(path).folders()
+
+def get_tracks(folder_path):
+    """Returns the sorted audio files of folder_path as full paths."""
+    return index_for(folder_path).tracks(folder_path)
+
+def close_all():
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.close()
+        _indexes.clear()
@@ -0,0 +1,279 @@
+import math
+import os
+import sqlite3
+import struct
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import CONFIG_DIR
+
+try:
+    import numpy
+except ImportError:  # Needed for analysing only; cached gains still apply
+    numpy = None
+
+LOUDNESS_DB = CONFIG_DIR / "loudness.db"
+
+# Loudness every track is brought to, in LUFS (the ReplayGain 2 reference)
+TARGET_LUFS = -18.0
+
+# Range of gains mpv accepts by default (volume-gain-min/-max); a track
+# quieter than the target by more than 12 dB stays that much quieter
+MIN_GAIN_DB = -96.0
+MAX_GAIN_DB = 12.0
+
+# Tracks are decoded at this rate, which the K-weighting filters are for
+RATE = 48000
+
+# Gating works on 400 ms blocks overlapping by 75%, built from 100 ms steps
+STEP = RATE // 10
+
+# Frames decoded per read, a whole number of steps (10 s)
+READ_FRAMES = STEP * 100
+
+# Niceness of the analysis workers, so playback and the UI come first
+WORKER_NICENESS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loudness (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    lufs REAL,
+    peak REAL
+);
+"""
+
+# BS.1770 K-weighting at 48 kHz: a high shelf followed by a high-pass
+K_WEIGHTING = (
+    ((1.53512485958697, -2.69169618940638, 1.19839281085285),
+     (1.0, -1.69065929318241, 0.73248077421585)),
+    ((1.0, -2.0, 1.0),
+     (1.0, -1.99004745483398, 0.99007225036621)),
+)
+
+def k_weighting_power(size):
+    """Squared magnitude of the K-weighting filter at the rfft bins of a
+    size-sample block."""
+    z = numpy.exp(-1j * numpy.pi * numpy.arange(size // 2 + 1) / (size // 2))
+    response = numpy.ones_like(z)
+    for b, a in K_WEIGHTING:
+        response *= (b[0] + b[1] * z + b[2] * z * z) \
+            / (a[0] + a[1] * z + a[2] * z * z)
+    return numpy.abs(response) ** 2
+
+class LoudnessMeter:
+    """Integrated loudness (BS.1770 / EBU R128) and sample peak of PCM.
+
+    Samples are fed in any number of ``add`` calls as float arrays of shape
+    (frames, channels). Each 100 ms step is weighted in the frequency
+    domain with one FFT for all steps of a chunk, instead of running the
+    recursive filters sample by sample. Channels are summed with equal
+    weights, which is exact for mono and stereo.
+    """
+
+    def __init__(self):
+        self._weights = k_weighting_power(STEP)
+        # The rfft bins other than DC and Nyquist stand for two bins each
+        self._weights[1:-1] *= 2
+        self._powers = []
+        self._pending = None
+        self.peak = 0.0
+
+    def add(self, samples):
+        if samples.size == 0:
+            return
+        self.peak = max(self.peak, float(numpy.abs(samples).max()))
+        if self._pending is not None:
+            samples = numpy.concatenate((self._pending, samples))
+        steps = len(samples) // STEP
+        self._pending = samples[steps * STEP:]
+        if not steps:
+            return
+        blocks = samples[:steps * STEP].reshape(steps, STEP, -1)
+        spectrum = numpy.fft.rfft(blocks, axis=1)
+        energy = (numpy.abs(spectrum) ** 2
+                  * self._weights[None, :, None]).sum(axis=(1, 2))
+        self._powers.append(energy / (STEP * STEP))
+
+    def integrated(self):
+        """Returns the gated loudness in LUFS, or None for silence."""
+        if not self._powers:
+            return None
+        steps = numpy.concatenate(self._powers)
+        if len(steps) < 4:
+            blocks = steps[None].mean(axis=1)
+        else:
+            # Mean power of every 400 ms block, one block per 100 ms step
+            cumulative = numpy.concatenate(([0.0], numpy.cumsum(steps)))
+            blocks = (cumulative[4:] - cumulative[:-4]) / 4
+
+        with numpy.errstate(divide='ignore'):
+            loudness = -0.691 + 10 * numpy.log10(blocks)
+        gated = blocks[loudness > -70.0]
+        if not len(gated):
+            return None
+        relative = -0.691 + 10 * numpy.log10(gated.mean()) - 10.0
+        with numpy.errstate(divide='ignore'):
+            gated = gated[-0.691 + 10 * numpy.log10(gated) > relative]
+        return float(-0.691 + 10 * numpy.log10(gated.mean()))
+
+def _wav_channels(stream):
+    """Reads a WAV header from stream and returns its channel count."""
+    header = stream.read(12)
+    if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    channels = None
+    while True:
+        chunk = stream.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = struct.unpack("<4sI", chunk)
+        if chunk_id == b"data":
+            return channels
+        body = stream.read(size + (size & 1))
+        if chunk_id == b"fmt " and len(body) >= 4:
+            channels = struct.unpack("<H", body[2:4])[0]
+
+def analyze(path):
+    """Decodes path with ffmpeg and returns (loudness in LUFS, peak).
+
+    Loudness is None for silent tracks. Raises OSError if the file cannot
+    be decoded.
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-nostdin", "-v", "error", "-i", path,
+            "-vn", "-ar", str(RATE), "-c:a", "pcm_f32le", "-f", "wav", "-"
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    meter = LoudnessMeter()
+    try:
+        channels = _wav_channels(process.stdout)
+        if not channels:
+            raise OSError(f"cannot decode {path}")
+        frame_size = 4 * channels
+        while True:
+            data = process.stdout.read(READ_FRAMES * frame_size)
+            if not data:
+                break
+            usable = len(data) - len(data) % frame_size
+            meter.add(numpy.frombuffer(data[:usable], dtype='<f4')
+                      .reshape(-1, channels))
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise OSError(f"ffmpeg failed on {path}")
+    return meter.integrated(), meter.peak
+
+def gain_db(lufs, peak, target=TARGET_LUFS):
+    """Returns the gain that brings a track to target without clipping,
+    within the range mpv accepts."""
+    if lufs is None:
+        return 0.0
+    gain = target - lufs
+    if peak and peak > 0:
+        gain = min(gain, -20 * math.log10(peak))
+    return max(MIN_GAIN_DB, min(MAX_GAIN_DB, gain))
+
+class LoudnessCache:
+    """SQLite cache of (loudness, peak) per file, keyed by (size, mtime)."""
+
+    def __init__(self, db_file=LOUDNESS_DB):
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def lookup(self, path, stat_result=None):
+        """Returns (lufs, peak) if path was analysed as it is now, else None."""
+        try:
+            st = stat_result or os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT lufs, peak FROM loudness "
+                "WHERE path = ? AND size = ? AND mtime = ?",
+                (path, st.st_size, st.st_mtime_ns)
+            ).fetchone()
+        return row
+
+    def gain(self, path):
+        """Returns the gain in dB for path, or None if it was not analysed."""
+        row = self.lookup(path)
+        if row is None:
+            return None
+        return gain_db(*row)
+
+    def store(self, rows):
+        """Stores a batch of (path, size, mtime, lufs, peak) rows."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO loudness (path, size, mtime, lufs, peak) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def _lower_priority():
+    try:
+        os.nice(WORKER_NICENESS)
+    except OSError:
+        pass
+
+def _analyze_job(path):
+    try:
+        st = os.stat(path)
+        lufs, peak = analyze(path)
+    except OSError:
+        return path, None
+    return path, (st.st_size, st.st_mtime_ns, lufs, peak)
+
+def analyze_all(paths, cache=None, workers=1, on_progress=None):
+    """Analyses every path that is not cached as it is now.
+
+    Work is spread over a pool of niced processes. Results are stored as
+    they come in, so an interrupted run resumes where it stopped.
+    on_progress(done, total, failed) is called after every file. Returns
+    (analysed, failed).
+    """
+    own_cache = cache is None
+    if own_cache:
+        cache = LoudnessCache()
+    todo = [path for path in paths if cache.lookup(path) is None]
+    done = failed = 0
+    batch = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_lower_priority
+    ) as pool:
+        futures = [pool.submit(_analyze_job, path) for path in todo]
+        try:
+            for future in as_completed(futures):
+                path, result = future.result()
+                if result is None:
+                    failed += 1
+                else:
+                    batch.append((path, *result))
+                done += 1
+                if len(batch) >= 20:
+                    cache.store(batch)
+                    batch = []
+                if on_progress is not None:
+                    on_progress(done, len(todo), failed)
+        finally:
+            for future in futures:
+                future.cancel()
+            if batch:
+                cache.store(batch)
+            if own_cache:
+                cache.close()
+    return done - failed, failed
@@ -1,11 +1,27 @@
 #!/usr/bin/env python3
 
 import os
+import bisect
 import curses
-from config import load_config, save_config
+import argparse
+import time
+import shutil
+import sys
+from config import Settings, PROFILE_FILE, write_atomic, load_config
 from tui import draw_menu, browse_path_tui, draw_message_box
 from player import player_tui
-from utils import get_folders
+from session import PlayerSession
+from remote import RemoteSession
+from control import ControlServer
+from library import (
+    AlbumScanner, close_all, fill_track_table, scan_library, ALL_MUSIC
+)
+from tracktable import TrackTable
+from history import PlayHistory, HISTORY
+import daemon
+import duplicates
+import loudness
+import profiler
 
 def choose_base_path_tui(stdscr, available_paths):
     curses.curs_set(0)
@@ -16,7 +32,7 @@ def choose_base_path_tui(stdscr, available_paths):
         if not available_paths:
             menu_items = ["[ Add New Path ]"]  
         else:
-            menu_items = available_paths + ["[ Add New Path ]"]
+            menu_items = [ALL_MUSIC, HISTORY] + available_paths + ["[ Add New Path ]"]
 
         current_row = 0
 
@@ -39,6 +55,10 @@ def choose_base_path_tui(stdscr, available_paths):
                 selected_option = menu_items[current_row]
                 if selected_option == "[ Add New Path ]":
                     return "__ADD_NEW_PATH__"  
+                elif selected_option == ALL_MUSIC:
+                    return "__ALL_MUSIC__"
+                elif selected_option == HISTORY:
+                    return "__HISTORY__"
                 else:
                     return selected_option  
             elif key == ord('q'):
@@ -48,37 +68,241 @@ def choose_folder_tui(stdscr, base_path):
     curses.curs_set(0)
     curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_WHITE)
 
-    folders = get_folders(base_path)
-    if not folders:
-        draw_message_box(stdscr, f"No sub-folders found in {base_path}.")
+    # Albums are listed as the scan finds them, so the menu is usable
+    # before a large library has been walked completely
+    scanner = AlbumScanner(base_path)
+    folders = []
+    current_row = 0
+
+    try:
+        while True:
+            for folder in scanner.drain():
+                position = bisect.bisect(folders, folder)
+                folders.insert(position, folder)
+                # Keep the highlighted folder under the cursor
+                if position <= current_row and len(folders) > 1:
+                    current_row += 1
+
+            if scanner.done and not folders:
+                draw_message_box(stdscr, f"No music folders found in {base_path}.")
+                return None
+
+            title = f"Select Folder in {os.path.basename(base_path)}"
+            if not scanner.done:
+                title += f" (scanning, {len(folders)} found)"
+
+            draw_menu(
+                stdscr,
+                current_row,
+                folders,
+                title,
+                "↑/↓: Select | Enter: Open | q: Back"
+            )
+
+            curses.doupdate()
+            # Poll while scanning so new folders show up, then block
+            stdscr.timeout(-1 if scanner.done else 100)
+            key = stdscr.getch()
+
+            if key == -1 or not folders:
+                if key == ord('q'):
+                    return None
+                continue
+
+            if key == curses.KEY_UP:
+                current_row = (current_row - 1) % len(folders)
+            elif key == curses.KEY_DOWN:
+                current_row = (current_row + 1) % len(folders)
+            elif key == curses.KEY_ENTER or key in [10, 13]:
+                return os.path.join(base_path, folders[current_row])
+            elif key == ord('q'):
+                return None
+    finally:
+        scanner.cancel()
+        stdscr.timeout(-1)
+
+def load_library_tui(stdscr, base_paths):
+    """Collects the tracks below every base path into one TrackTable.
+
+    Returns None if the scan is cancelled with q or nothing is found.
+    """
+    curses.curs_set(0)
+    table = TrackTable()
+    for base_path in base_paths:
+        scanner = AlbumScanner(base_path)
+        albums = []
+        try:
+            while not scanner.done:
+                albums.extend(scanner.drain())
+                draw_menu(
+                    stdscr,
+                    0,
+                    [],
+                    f"{ALL_MUSIC} (scanning {os.path.basename(base_path)}, "
+                    f"{len(table.dirs) + len(albums)} folders found)",
+                    "q: Back"
+                )
+                curses.doupdate()
+                stdscr.timeout(100)
+                if stdscr.getch() == ord('q'):
+                    return None
+            albums.extend(scanner.drain())
+        finally:
+            scanner.cancel()
+            stdscr.timeout(-1)
+        fill_track_table(table, base_path, albums)
+
+    if not len(table):
+        draw_message_box(stdscr, "No audio files found in your music paths.")
         return None
+    return table
+
+def _track_label(path):
+    """Shows a track as its folder and file name."""
+    return os.path.join(
+        os.path.basename(os.path.dirname(path)),
+        os.path.basename(path)
+    )
+
+class _NeverPlayed:
+    """Menu rows of the library tracks that never started playing, labelled
+    only when drawn."""
+
+    def __init__(self, table, played):
+        self.table = table
+        self.indices = [
+            idx for idx in range(len(table)) if table[idx] not in played
+        ]
+
+    def __len__(self):
+        return len(self.indices)
 
+    def __getitem__(self, row):
+        return _track_label(self.path(row))
+
+    def path(self, row):
+        return self.table[self.indices[row]]
+
+def history_tui(stdscr, session, settings):
+    """Lists the most played, recently played and never played tracks.
+    Enter plays the selected track in its folder."""
+    curses.curs_set(0)
+    if not settings.config['history']:
+        # Opening the log would create it
+        draw_message_box(stdscr, "Play history is off (history = no in the config file).")
+        return
+    history = getattr(session, 'history', None)
+    own_history = history is None
+    if own_history:
+        history = PlayHistory()
+    views = ("Most Played", "Recently Played", "Never Played")
+    view = 0
+    rows = path_of = None
+    library = None
     current_row = 0
+    try:
+        while True:
+            if rows is None:
+                if view == 0:
+                    found = history.most_played()
+                    rows = [
+                        f"{stats.completions:>5} played {stats.skips:>4} skipped  "
+                        f"{_track_label(stats.path)}"
+                        for stats in found
+                    ]
+                    path_of = [stats.path for stats in found].__getitem__
+                elif view == 1:
+                    found = history.recently_played()
+                    rows = [
+                        time.strftime('%Y-%m-%d %H:%M  ', time.localtime(stats.last))
+                        + _track_label(stats.path)
+                        for stats in found
+                    ]
+                    path_of = [stats.path for stats in found].__getitem__
+                else:
+                    if library is None:
+                        library = load_library_tui(stdscr, settings.config['paths'])
+                    if library is None:
+                        view, rows = 0, None
+                        continue
+                    rows = _NeverPlayed(library, history.played_paths())
+                    path_of = rows.path
+                current_row = min(current_row, max(0, len(rows) - 1))
 
-    while True:
-        draw_menu(
-            stdscr,
-            current_row, 
-            folders,
-            f"Select Folder in {os.path.basename(base_path)}",
-            "↑/↓: Select | Enter: Open | q: Back"
-        )
+            title = f"{HISTORY} {views[view]}"
+            if not rows:
+                title += " (nothing yet)"
+            draw_menu(
+                stdscr,
+                current_row,
+                rows,
+                title,
+                "←/→: Most/Recent/Never | Enter: Play | q: Back"
+            )
+            curses.doupdate()
+            key = stdscr.getch()
 
-        curses.doupdate()
-        key = stdscr.getch()
+            if key == curses.KEY_LEFT or key == curses.KEY_RIGHT:
+                step = 1 if key == curses.KEY_RIGHT else -1
+                view = (view + step) % len(views)
+                rows, current_row = None, 0
+            elif key == ord('q'):
+                return
+            elif not rows:
+                continue
+            elif key == curses.KEY_UP:
+                current_row = (current_row - 1) % len(rows)
+            elif key == curses.KEY_DOWN:
+                current_row = (current_row + 1) % len(rows)
+            elif key == curses.KEY_ENTER or key in [10, 13]:
+                path = path_of(current_row)
+                if not os.path.isfile(path):
+                    draw_message_box(stdscr, f"'{_track_label(path)}' is gone.")
+                    continue
+                folder = os.path.dirname(path)
+                if session.is_playing(folder):
+                    # The player reattaches, so jump to the track first
+                    idx = session.playlist.find(path)
+                    if idx >= 0:
+                        session.play(idx)
+                player_tui(stdscr, session, folder, settings, resume={'path': path})
+                # The counts changed while it played
+                rows = None
+    finally:
+        if own_history:
+            history.close()
 
-        if key == curses.KEY_UP:
-            current_row = (current_row - 1) % len(folders)
-        elif key == curses.KEY_DOWN:
-            current_row = (current_row + 1) % len(folders)
-        elif key == curses.KEY_ENTER or key in [10, 13]:
-            return os.path.join(base_path, folders[current_row])
-        elif key == ord('q'):
-            return None
+def run_app_tui(stdscr, settings):
+    session = PlayerSession(settings.config)
+    # Lets other programs control playback; skipped when another
+    # instance already serves the socket
+    control = ControlServer(session, on_change=settings.save)
+    control.start()
+    try:
+        browse_app_tui(stdscr, session, settings)
+    finally:
+        control.close()
+        session.close()
+
+def attach_app_tui(stdscr, session, settings):
+    """Runs the menus and the player on the daemon's RemoteSession."""
+    try:
+        browse_app_tui(stdscr, session, settings)
+    finally:
+        session.close()
+
+def browse_app_tui(stdscr, session, settings):
+    config = settings.config
+
+    last = settings.session
+    if session.folder is not None:
+        # Attached to a daemon that is already playing
+        player_tui(stdscr, session, session.folder, settings)
+    elif config.get('resume') and os.path.isdir(last.get('folder') or ''):
+        # Go straight back to the last played track
+        player_tui(stdscr, session, last['folder'], settings, resume=last)
 
-def run_app_tui(stdscr):
     while True:
-        config = load_config()
         available_base_paths = config['paths']
         selected_base_path = None
         
@@ -90,7 +314,7 @@ def run_app_tui(stdscr):
                 if os.path.isdir(new_path) and new_path not in config['paths']:
                     config['paths'].append(new_path)
                     config['paths'].sort()
-                    save_config(config)
+                    settings.save()
                     draw_message_box(
                         stdscr,
                         f"Path '{new_path}' successfully saved."
@@ -110,6 +334,20 @@ def run_app_tui(stdscr):
         elif chosen_option is None:
             return
 
+        elif chosen_option == "__HISTORY__":
+            history_tui(stdscr, session, settings)
+            continue
+
+        elif chosen_option == "__ALL_MUSIC__":
+            # Go back to the library playlist if it is still playing
+            table = None
+            if not session.is_playing(ALL_MUSIC):
+                table = load_library_tui(stdscr, config['paths'])
+                if table is None:
+                    continue
+            player_tui(stdscr, session, ALL_MUSIC, settings, playlist=table)
+            continue
+
         else:
             selected_base_path = chosen_option
         
@@ -118,20 +356,172 @@ def run_app_tui(stdscr):
             if folder_to_play:
                 player_tui(
                     stdscr,
+                    session,
                     folder_to_play,
-                    config['volume'],
-                    config
+                    settings
                 )
             else: 
                 continue
         else:
             continue
 
+def dump_profile(prof):
+    """Writes the profiler summary to PROFILE_FILE and returns the path."""
+    header = f"# PyTUI_Music profile, {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    write_atomic(PROFILE_FILE, header + prof.summary())
+    return PROFILE_FILE
+
+def analyze_loudness(base_paths, workers):
+    """Measures the loudness of every track below base_paths that has not
+    been measured yet, printing the progress. Returns the exit status."""
+    if loudness.numpy is None:
+        print("Loudness analysis needs numpy (pip install numpy).")
+        return 1
+    if shutil.which('ffmpeg') is None:
+        print("Loudness analysis needs ffmpeg to decode the tracks.")
+        return 1
+    print(f"Scanning {', '.join(base_paths)}...")
+    table = scan_library(base_paths)
+
+    def show(done, total, failed):
+        sys.stdout.write(f"\rAnalysed {done}/{total} new or changed tracks"
+                         + (f", {failed} failed" if failed else ""))
+        sys.stdout.flush()
+
+    print(f"{len(table)} tracks found.")
+    try:
+        analysed, failed = loudness.analyze_all(
+            table,
+            workers=workers,
+            on_progress=show
+        )
+    except KeyboardInterrupt:
+        print("\nStopped; the next run continues where this one left off.")
+        return 130
+    finally:
+        close_all()
+    print(f"\nDone: {analysed} analysed, {failed} could not be decoded.")
+    return 0
+
+def find_duplicates(base_paths, workers):
+    """Lists the tracks below base_paths that have the same contents,
+    printing the progress. Returns the exit status."""
+    print(f"Scanning {', '.join(base_paths)}...")
+    table = scan_library(base_paths)
+    close_all()
+
+    def show(done, total, failed):
+        sys.stdout.write(f"\rHashed {done}/{total} new or changed tracks"
+                         + (f", {failed} failed" if failed else ""))
+        sys.stdout.flush()
+
+    print(f"{len(table)} tracks found.")
+    try:
+        groups, failed = duplicates.find_duplicates(
+            table,
+            workers=workers,
+            on_progress=show
+        )
+    except KeyboardInterrupt:
+        print("\nStopped; the next run continues where this one left off.")
+        return 130
+    print()
+    wasted = copies = 0
+    for group in groups:
+        # Hard links share one copy on disk
+        wasted += group.size * (group.files - 1)
+        copies += len(group.paths) - 1
+        print(f"\n{group.size / 2**20:.1f} MB, {len(group.paths)} copies:")
+        for path in group.paths:
+            print(f"  {path}")
+    print(f"\n{len(groups)} tracks have {copies} extra copies "
+          f"({wasted / 2**20:.1f} MB), marked with = in the player.")
+    if failed:
+        print(f"{failed} tracks could not be read.")
+    return 0
+
 def main():
 
     MIN_H = 10
     MIN_W = 40
 
+    parser = argparse.ArgumentParser(description="Terminal music player")
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="time the player's frames and key presses; 'S' shows the "
+             f"numbers and a summary is written to {PROFILE_FILE} on exit"
+    )
+    parser.add_argument(
+        '--analyze-loudness',
+        action='store_true',
+        help="measure the loudness of new or changed tracks in the music "
+             "paths, so they play at the same volume, and exit"
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help="processes used by --analyze-loudness and --find-duplicates "
+             "(default: 1)"
+    )
+    parser.add_argument(
+        '--find-duplicates',
+        action='store_true',
+        help="list the tracks in the music paths that have the same "
+             "contents, mark them in the player and exit"
+    )
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help="play in the background, detached from the terminal, until "
+             "--stop-daemon; use --attach to control it"
+    )
+    parser.add_argument(
+        '--attach',
+        action='store_true',
+        help="open the player on the running daemon; quitting leaves the "
+             "music playing"
+    )
+    parser.add_argument(
+        '--stop-daemon',
+        action='store_true',
+        help="stop the running daemon and its playback"
+    )
+    args = parser.parse_args()
+    if args.analyze_loudness:
+        sys.exit(analyze_loudness(load_config()['paths'], max(1, args.workers)))
+    if args.find_duplicates:
+        sys.exit(find_duplicates(load_config()['paths'], max(1, args.workers)))
+    if args.stop_daemon:
+        if not daemon.is_running():
+            sys.exit("No daemon is running.")
+        if not daemon.stop_daemon():
+            sys.exit(
+                "The instance on the control socket did not stop. A player "
+                "started without --daemon cannot be stopped this way; quit "
+                "it with q."
+            )
+        return
+    if args.daemon:
+        # Checked before detaching, while errors can still be seen
+        if daemon.is_running():
+            sys.exit("A daemon or player is already running.")
+        print(f"Starting the daemon; its output goes to {daemon.DAEMON_LOG}")
+        daemon.daemonize()
+        sys.exit(daemon.run_daemon())
+    if args.profile:
+        profiler.enable()
+
+    settings = Settings()
+    remote = None
+    if args.attach:
+        try:
+            remote = RemoteSession(settings.config)
+        except OSError:
+            sys.exit("No daemon is running; start one with --daemon.")
+
     try:
         def start_app(stdscr):
             h, w = stdscr.getmaxyx()
@@ -149,7 +539,14 @@ def main():
                 stdscr.getch() 
                 return 
 
-            run_app_tui(stdscr)
+            try:
+                if remote is not None:
+                    attach_app_tui(stdscr, remote, settings)
+                else:
+                    run_app_tui(stdscr, settings)
+            finally:
+                settings.flush()
+                close_all()
 
         curses.wrapper(start_app)
     except curses.error as e:
@@ -157,6 +554,13 @@ def main():
         print("Ensure your terminal supports Curses and is large enough.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+    finally:
+        prof = profiler.active()
+        if prof.enabled:
+            try:
+                print(f"Profile written to {dump_profile(prof)}")
+            except OSError as e:
+                print(f"Could not write the profile: {e}")
 
 if __name__ == "__main__":
     main()
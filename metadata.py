@@ -0,0 +1,276 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from config import CONFIG_DIR
+
+try:
+    import mutagen
+except ImportError:  # Tags are optional, file names are shown instead
+    mutagen = None
+
+TAGS_DB = CONFIG_DIR / "tags.db"
+
+# Number of files each worker task handles before results are published
+CHUNK_SIZE = 32
+
+# Longer playlists only load info for the tracks that are shown
+LAZY_TRACKS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tags (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    track INTEGER,
+    length REAL
+);
+CREATE INDEX IF NOT EXISTS tags_dir ON tags (dir);
+"""
+
+TrackInfo = namedtuple('TrackInfo', 'title artist album track length')
+
+EMPTY_INFO = TrackInfo(None, None, None, None, None)
+
+def _first(tags, key):
+    value = tags.get(key) if tags else None
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def _track_number(value):
+    # Track numbers are often stored as "3/12"
+    try:
+        return int(str(value).split('/')[0])
+    except (TypeError, ValueError):
+        return None
+
+def read_info(path):
+    """Reads the tags and length of one audio file."""
+    if mutagen is None:
+        return EMPTY_INFO
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception:
+        return EMPTY_INFO
+    if audio is None:
+        return EMPTY_INFO
+    tags = audio.tags
+    length = getattr(audio.info, 'length', None)
+    return TrackInfo(
+        _first(tags, 'title'),
+        _first(tags, 'artist'),
+        _first(tags, 'album'),
+        _track_number(_first(tags, 'tracknumber')),
+        float(length) if length else None
+    )
+
+def display_name(info, path):
+    """Returns "Artist - Title" when tagged, otherwise the file name."""
+    if info is None or not info.title:
+        return os.path.basename(path)
+    if info.artist:
+        return f"{info.artist} - {info.title}"
+    return info.title
+
+def format_length(seconds):
+    if not seconds:
+        return ""
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+class TagCache:
+    """SQLite cache of track info keyed by (path, size, mtime)."""
+
+    def __init__(self, db_file=TAGS_DB):
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def load_dirs(self, dirs):
+        """Returns {path: ((size, mtime), TrackInfo)} for every cached file in dirs."""
+        entries = {}
+        with self._lock:
+            for d in dirs:
+                for row in self._db.execute(
+                    "SELECT path, size, mtime, title, artist, album, track, "
+                    "length FROM tags WHERE dir = ?", (d,)
+                ):
+                    entries[row[0]] = ((row[1], row[2]), TrackInfo(*row[3:]))
+        return entries
+
+    def store(self, rows):
+        """Stores a batch of (path, size, mtime, TrackInfo) rows."""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tags (path, dir, size, mtime, title, "
+                "artist, album, track, length) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (path, os.path.dirname(path), size, mtime, *info)
+                    for path, size, mtime, info in rows
+                ]
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class MetadataLoader:
+    """Fills in track info for a playlist on a background worker pool.
+
+    Cached entries are available as soon as the loader is created. Workers
+    then stat every file and only read the tags of files whose size or mtime
+    no longer match the cache. ``drain_updates`` hands the indices that
+    changed since the last call to the UI loop.
+
+    Playlists longer than ``LAZY_TRACKS`` (whole libraries) are loaded
+    lazily instead: only the tracks passed to ``want`` are looked up, so
+    memory and work follow what is on screen. Track lengths are copied to
+    the playlist's ``durations`` array when it has one (a TrackTable).
+    """
+
+    def __init__(self, playlist, cache=None, workers=4, on_update=None,
+                 lazy=None):
+        self.playlist = playlist
+        self.on_update = on_update
+        self.lazy = len(playlist) > LAZY_TRACKS if lazy is None else lazy
+        self._durations = getattr(playlist, 'durations', None)
+        self._cache = cache or TagCache()
+        self._owns_cache = cache is None
+        self._lock = threading.Lock()
+        self._updated = []
+        self._wanted = set()
+        self._closed = False
+        self.info = {}
+        self._keys = {}
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="metadata"
+        )
+        if self.lazy:
+            return
+
+        self._use_cached(self._cache.load_dirs(
+            {os.path.dirname(p) for p in playlist}
+        ), range(len(playlist)))
+        if mutagen is not None:
+            for start in range(0, len(playlist), CHUNK_SIZE):
+                self._pool.submit(
+                    self._load,
+                    range(start, min(start + CHUNK_SIZE, len(playlist)))
+                )
+
+    def _use_cached(self, cached, indices):
+        for idx in indices:
+            path = self.playlist[idx]
+            entry = cached.get(path)
+            if entry is not None:
+                self._keys[path], info = entry
+                self._set_info(idx, path, info)
+
+    def _set_info(self, idx, path, info):
+        self.info[path] = info
+        if self._durations is not None:
+            self._durations[idx] = info.length or 0
+
+    def want(self, indices):
+        """Asks a lazy loader for the info of the given track indices."""
+        if not self.lazy or self._closed:
+            return
+        indices = [idx for idx in indices if idx not in self._wanted]
+        if not indices:
+            return
+        self._wanted.update(indices)
+        try:
+            self._pool.submit(self._load_wanted, indices)
+        except RuntimeError:  # Closed meanwhile
+            pass
+
+    def extend(self, indices):
+        """Loads the info of tracks appended to the playlist since. A lazy
+        loader waits until they are wanted."""
+        if self.lazy or self._closed:
+            return
+        try:
+            self._pool.submit(self._load_wanted, list(indices))
+        except RuntimeError:  # Closed meanwhile
+            pass
+
+    def get(self, idx):
+        return self.info.get(self.playlist[idx])
+
+    def name(self, idx):
+        path = self.playlist[idx]
+        return display_name(self.info.get(path), path)
+
+    def drain_updates(self):
+        """Returns the playlist indices whose info changed since the last call."""
+        with self._lock:
+            updated, self._updated = self._updated, []
+        return updated
+
+    def close(self):
+        self._closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._owns_cache:
+            self._pool.shutdown(wait=True)
+            self._cache.close()
+
+    def _load_wanted(self, indices):
+        cached = self._cache.load_dirs(
+            {os.path.dirname(self.playlist[idx]) for idx in indices}
+        )
+        self._use_cached(cached, indices)
+        found = [idx for idx in indices if self.playlist[idx] in self.info]
+        if found:
+            with self._lock:
+                self._updated.extend(found)
+            if self.on_update is not None:
+                self.on_update()
+        if mutagen is not None:
+            self._load(indices)
+
+    def _load(self, indices):
+        rows = []
+        updated = []
+        for idx in indices:
+            if self._closed:
+                return
+            path = self.playlist[idx]
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if self._keys.get(path) == key:
+                continue
+            info = read_info(path)
+            rows.append((path, key[0], key[1], info))
+            self._set_info(idx, path, info)
+            updated.append(idx)
+
+        if not rows:
+            return
+        try:
+            self._cache.store(rows)
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._updated.extend(updated)
+        if self.on_update is not None:
+            self.on_update()
@@ -0,0 +1,320 @@
+import base64
+import random
+from array import array
+from collections import deque
+from itertools import filterfalse
+
+REPEAT_MODES = ('all', 'one', 'off')
+
+# Tracks remembered for going back with prev
+HISTORY_SIZE = 1000
+
+# Row of a track that is not in the order
+GONE = 0xFFFFFFFF
+
+class PlaybackOrder:
+    """Decides which track of a playlist plays next.
+
+    The order is either the playlist order or a stored permutation of it,
+    together with its inverse, so the neighbours of any track are found in
+    O(1). Tracks added with ``enqueue`` play before the order continues
+    from the last track it played (the cursor). ``history`` records what
+    actually played, so prev goes back through it even after jumps.
+    ``repeat`` is 'all' (wrap around), 'one' (mpv loops the file) or 'off'
+    (stop after the last track).
+
+    ``size`` is the number of tracks in the order and ``tracks`` the
+    length of the playlist, which differ once ``update`` took tracks out.
+    """
+
+    def __init__(self, size, shuffle=False, repeat='all', current=0):
+        self.size = size
+        self.tracks = size
+        self.repeat = repeat if repeat in REPEAT_MODES else 'all'
+        self.queue = deque()
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.cursor = current
+        self.current = current
+        self.shuffled = False
+        self._order = None
+        self._rows = None
+        # The playlist order once tracks were added or removed; until then
+        # it is simply range(size)
+        self._plain = None
+        # A removed track that is still playing, taken out when it ends
+        self._leaving = None
+        self.set_shuffle(shuffle)
+
+    def __len__(self):
+        return self.size
+
+    def _plain_order(self):
+        if self._plain is not None:
+            return array('I', self._plain)
+        return array('I', range(self.size))
+
+    def _index(self, order):
+        """Sets order and builds its inverse; tracks not in it get GONE."""
+        rows = array('I', [GONE]) * self.tracks
+        for row, idx in enumerate(order):
+            rows[idx] = row
+        self._order, self._rows = order, rows
+        self.size = len(order)
+
+    def set_shuffle(self, shuffle):
+        """Switches between playlist order and a new random order.
+
+        A new random order starts with the current track, so everything
+        else follows it before any track comes around again.
+        """
+        self.shuffled = shuffle
+        if not shuffle:
+            if self._plain is None:
+                self._order = self._rows = None
+            else:
+                self._index(self._plain)
+            return
+        # Typed arrays keep a shuffled library at 8 bytes per track
+        order = self._plain_order()
+        random.shuffle(order)
+        self._index(order)
+        rows = self._rows
+        if 0 <= self.current < self.tracks and rows[self.current] != GONE:
+            # Swap the current track to the front
+            row = rows[self.current]
+            first = order[0]
+            order[0], order[row] = self.current, first
+            rows[first], rows[self.current] = row, 0
+        self.cursor = self.current
+
+    def update(self, tracks, added=(), removed=()):
+        """Follows tracks added to and removed from the playlist, which now
+        has tracks entries.
+
+        added holds (idx, after) pairs, after being the track idx comes
+        after in playlist order, or -1 for the first place. In a shuffled
+        order new tracks get a random place among those still to play.
+        Removed tracks leave the order, the queue and the history, except
+        the one playing, which stays until another one plays.
+        """
+        plain_rows = None
+        if self._plain is None:
+            plain_rows = range(self.size)
+            self._plain = array('I', plain_rows)
+        elif not self.shuffled:
+            plain_rows = self._rows
+        if added:
+            self._plain = self._add_plain(added, plain_rows)
+            if self.shuffled:
+                self._order = self._add_shuffled([idx for idx, after in added])
+        self.tracks = tracks
+        order = self._order if self.shuffled else self._plain
+
+        removed = set(removed)
+        if self.current in removed:
+            removed.discard(self.current)
+            self._leaving = self.current
+        if removed:
+            self._drop(removed)
+        else:
+            self._index(order if self.shuffled else self._plain)
+
+    def _add_plain(self, added, rows):
+        """Returns the playlist order with the (idx, after) pairs added in
+        one copy. rows is its inverse, or None to look up the rows needed."""
+        plain = self._plain
+        following = {}
+        for idx, after in added:
+            following.setdefault(after, []).append(idx)
+        # The new tracks that go right after each track already in the
+        # order (or -1), with those that follow new tracks in their place
+        runs = {}
+        new = {idx for idx, after in added}
+        for after in [after for after in following if after not in new]:
+            run = runs[after] = []
+            stack = following[after][::-1]
+            while stack:
+                idx = stack.pop()
+                run.append(idx)
+                stack.extend(following.get(idx, ())[::-1])
+        if rows is None:
+            wanted = runs.keys() - {-1}
+            found = {idx: row for row, idx in enumerate(plain) if idx in wanted}
+        else:
+            found = {
+                idx: rows[idx] for idx in runs
+                if 0 <= idx < len(rows) and rows[idx] != GONE
+            }
+        places = []
+        for after, run in runs.items():
+            if after < 0:
+                places.append((0, run))
+            else:
+                # After a track that is not in the order: at the end
+                places.append((found.get(after, len(plain) - 1) + 1, run))
+        return _splice(plain, places)
+
+    def _add_shuffled(self, tracks):
+        """Returns the shuffled order with tracks at random places after
+        the cursor, so they play in this round."""
+        order = self._order
+        start = 0
+        if 0 <= self.cursor < len(self._rows) and self._rows[self.cursor] != GONE:
+            start = self._rows[self.cursor] + 1
+        places = {}
+        for idx in tracks:
+            places.setdefault(random.randint(start, len(order)), []).append(idx)
+        return _splice(order, places.items())
+
+    def _drop(self, removed):
+        """Takes the tracks in the set removed out of the order."""
+        order = self._order if self.shuffled else self._plain
+        if self.cursor in removed and len(order) > len(removed):
+            # The tracks after it still follow. Looked up, as the order
+            # may have grown since its inverse was built
+            row = order.index(self.cursor)
+            while order[row] in removed:
+                row -= 1
+            self.cursor = order[row]
+        keep = array('I', filterfalse(removed.__contains__, order))
+        self._plain = array('I', filterfalse(removed.__contains__, self._plain)) \
+            if self.shuffled else keep
+        self._index(keep)
+        self.queue = deque(idx for idx in self.queue if idx not in removed)
+        self.history = deque(
+            (idx for idx in self.history if idx not in removed),
+            maxlen=HISTORY_SIZE
+        )
+
+    def snapshot(self):
+        """Returns the play order and the queue as JSON-friendly data, for
+        ``restore`` in another process on this machine. The order and its
+        inverse go as base64 of their bytes, so restoring copies them
+        instead of building them a track at a time."""
+        if self._order is None:
+            order = rows = None
+        else:
+            order = base64.b64encode(self._order).decode('ascii')
+            rows = base64.b64encode(self._rows).decode('ascii')
+        return {
+            'order': order,
+            'rows': rows,
+            'shuffled': self.shuffled,
+            'tracks': self.tracks,
+            'queue': list(self.queue),
+            'current': self.current
+        }
+
+    def restore(self, snapshot):
+        """Takes over an order made by ``snapshot``."""
+        order = snapshot['order']
+        self.tracks = snapshot['tracks']
+        self.shuffled = snapshot['shuffled']
+        if order is None:
+            self._order = self._rows = None
+            self.size = self.tracks
+        else:
+            self._order, self._rows = array('I'), array('I')
+            self._order.frombytes(base64.b64decode(order))
+            self._rows.frombytes(base64.b64decode(snapshot['rows']))
+            self.size = len(self._order)
+        self.queue = deque(snapshot['queue'])
+        self.current = self.cursor = snapshot['current']
+
+    def track_at(self, row):
+        """Returns the track shown in row row of the play order."""
+        return self._order[row] if self._order is not None else row
+
+    def row_of(self, idx):
+        return self._rows[idx] if self._rows is not None else idx
+
+    def after(self, idx):
+        """Returns the track following idx in the order, or None at the end
+        when repeat is off."""
+        if not self.size:
+            return None
+        row = self.row_of(idx) + 1
+        if row >= self.size:
+            if self.repeat == 'off':
+                return None
+            row = 0
+        return self.track_at(row)
+
+    def before(self, idx):
+        if not self.size:
+            return None
+        row = self.row_of(idx) - 1
+        if row < 0:
+            if self.repeat == 'off':
+                return None
+            row = self.size - 1
+        return self.track_at(row)
+
+    def upcoming(self, count):
+        """Returns up to count tracks in the order they will play."""
+        tracks = list(self.queue)[:count]
+        idx = self.cursor
+        while len(tracks) < count:
+            idx = self.after(idx)
+            if idx is None:
+                break
+            tracks.append(idx)
+        return tracks
+
+    def queue_position(self, idx):
+        """Returns the 1-based place of idx in the play-next queue, or None."""
+        try:
+            return self.queue.index(idx) + 1
+        except ValueError:
+            return None
+
+    def enqueue(self, idx):
+        """Plays idx after the current track and anything queued before."""
+        if idx not in self.queue:
+            self.queue.append(idx)
+
+    def advance(self, idx, remember=True):
+        """Records that idx is playing now.
+
+        A track from the front of the queue leaves the cursor where it was;
+        any other track moves the cursor to itself.
+        """
+        if remember and self.current != idx and 0 <= self.current < self.tracks:
+            self.history.append(self.current)
+        self.current = idx
+        if self.queue and self.queue[0] == idx:
+            self.queue.popleft()
+        else:
+            try:
+                self.queue.remove(idx)
+            except ValueError:
+                pass
+            self.cursor = idx
+        leaving = self._leaving
+        if leaving is not None and leaving != idx:
+            self._leaving = None
+            self._drop({leaving})
+
+    def next(self):
+        """Returns the track to skip to, or None at the end with repeat off."""
+        upcoming = self.upcoming(1)
+        return upcoming[0] if upcoming else None
+
+    def previous(self):
+        """Returns the track that played before, or the one before the
+        current track in the order."""
+        if self.history:
+            return self.history.pop()
+        return self.before(self.current)
+
+def _splice(order, places):
+    """Returns order with the tracks of every (row, tracks) pair in places
+    inserted before row, in one copy."""
+    spliced = array('I')
+    last = 0
+    for row, tracks in sorted(places, key=lambda place: place[0]):
+        spliced += order[last:row]
+        spliced += array('I', tracks)
+        last = row
+    spliced += order[last:]
+    return spliced
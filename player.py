@@ -1,20 +1,51 @@
-import os
 import curses
 import time
 import sys
-import mpv
-import subprocess
 from datetime import datetime
-from wcwidth import wcswidth
-from utils import truncate_string_to_width, get_scrolling_display_string
-from config import save_config, load_seen_songs, save_seen_songs
-from tui import draw_message_box
+from bisect import bisect_right
+from utils import (
+    truncate_string_to_width,
+    get_scrolling_display_string,
+    string_width
+)
+from config import load_seen_songs, save_seen_songs
+from tui import draw_message_box, draw_stats_overlay, read_line_tui
+from library import get_tracks, ALL_MUSIC
+from duplicates import load_report
+from metadata import MetadataLoader
+from playlist_view import PlaylistView
+from tracktable import TrackTable, FLAG_NEW, FLAG_COPY
+import visualizer
+import profiler
+
+# Seconds between two steps of the scrolling (marquee) text
+SCROLL_INTERVAL = 0.3
+
+# Seconds between two snapshots of the playback position for resuming
+SESSION_INTERVAL = 5
+
+# Share of the track's length that Left and Right seek by
+SEEK_PERCENT = 5
+
+# Rows of the spectrum pane, which takes at most a third of the playlist
+SPECTRUM_ROWS = 8
+
+def pane_heights(h, spectrum):
+    """Returns the rows of the playlist and of the spectrum pane (0 when
+    it is closed or does not fit)."""
+    playlist_h = h - 7
+    spectrum_h = min(SPECTRUM_ROWS, playlist_h // 3) if spectrum else 0
+    if spectrum_h < 2:
+        return playlist_h, 0
+    return playlist_h - spectrum_h - 1, spectrum_h
 
-supported_exts = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+def spectrum_bars(w):
+    """Returns how many bars, a space apart, fit across the screen."""
+    return max(1, (w - 3) // 2)
 
 def draw_player_tui(
         stdscr,
-        player,
+        state,
         playlist,
         selected_idx,
         playing_idx,
@@ -23,318 +54,510 @@ def draw_player_tui(
         selected_song_text_scroll_offset,
         song_lock,
         config,
-        new_songs_indices
+        view,
+        shuffle=False,
+        repeat='all',
+        spectrum=None,
+        waveform=None
 ):
 
+    prof = profiler.active()
     h, w = stdscr.getmaxyx()
     max_width = w - 4
 
-    stdscr.erase()
-    stdscr.box()
-
-    # Now Playing section
-    if player.playlist_pos is not None and 0 <= player.playlist_pos < len(playlist):
-        title = player.media_title or os.path.basename(playlist[player.playlist_pos])
-    else:
-        title = "Nothing playing"
-    display_title = get_scrolling_display_string(title, max_width, now_playing_text_scroll_offset)
-    stdscr.addstr(1, 2, "Now Playing:", curses.A_BOLD)
-    stdscr.addstr(2, 2, display_title)
-
-    # Progress bar
-    pos = player.playback_time or 0
-    dur = player.duration or 0
-    time_str_base = f"{time.strftime('%M:%S',
-                       time.gmtime(pos))} / {time.strftime('%M:%S',
-                       time.gmtime(dur))}"
-
-    bar_length_calc = min(30, w - wcswidth(time_str_base) - 10) 
-    bar_str = ""
-    if dur > 0 and bar_length_calc > 5:
-        progress = (pos / dur)
-        filled_length = int(bar_length_calc * progress)
-        bar_str = '█' * filled_length + '.' * (bar_length_calc - filled_length)
-
-    full_time_str = f"{time_str_base} [{bar_str}];" if bar_str else time_str_base
+    with prof.stage("header"):
+        stdscr.erase()
+        stdscr.box()
+
+        # Now Playing section
+        if 0 <= playing_idx < len(playlist):
+            title = state.media_title or view.name(playing_idx)
+        else:
+            title = "Nothing playing"
+        display_title = get_scrolling_display_string(title, max_width, now_playing_text_scroll_offset)
+        scrolling = string_width(title) > max_width
+        stdscr.addstr(1, 2, "Now Playing:", curses.A_BOLD)
+        stdscr.addstr(2, 2, display_title)
+
+        # Progress bar
+        pos = state.time_pos or 0
+        dur = state.duration or 0
+        pos_str = time.strftime('%M:%S', time.gmtime(pos))
+        dur_str = time.strftime('%M:%S', time.gmtime(dur))
+        time_str_base = f"{pos_str} / {dur_str}"
+
+        bar_length_calc = min(30, w - string_width(time_str_base) - 10) 
+        bar_str = ""
+        filled_length = 0
+        if dur > 0 and bar_length_calc > 5:
+            progress = min(1, pos / dur)
+            filled_length = int(bar_length_calc * progress)
+            if waveform is not None:
+                # The part still to play is dimmed below
+                bar_str = waveform.columns(bar_length_calc)
+            else:
+                bar_str = '█' * filled_length + '.' * (bar_length_calc - filled_length)
+
+        full_time_str = f"{time_str_base} [{bar_str}];" if bar_str else time_str_base
     
-    # Truncate full_time_str before adding to screen
-    truncated_full_time_str = truncate_string_to_width(full_time_str, w - 4) # w - 4 for padding
-    stdscr.addstr(3, 2, truncated_full_time_str)
-
-    if player.pause:
-        paused_text = "[PAUSED]"
-        paused_x = w - wcswidth(paused_text) - 2 
-        if paused_x < 2:
-            paused_x = 2 # Ensure it doesn't go off screen to the left
-        stdscr.addstr(1, paused_x, paused_text, curses.A_REVERSE)
-
-    if song_lock:
-        lock_text = "[LOCKED]"
-        lock_x = w - wcswidth(lock_text) - 2
-        if lock_x < 2:
-            lock_x = 2
-        stdscr.addstr(2, lock_x, lock_text, curses.A_REVERSE)
-
-    stdscr.hline(4, 1, curses.ACS_HLINE, w - 2)
-
-    # Playlist display
-    playlist_h = h - 7
-    start_line = 5
+        # Truncate full_time_str before adding to screen
+        truncated_full_time_str = truncate_string_to_width(full_time_str, w - 4) # w - 4 for padding
+        stdscr.addstr(3, 2, truncated_full_time_str)
+        if waveform is not None and filled_length < len(bar_str) \
+                and truncated_full_time_str == full_time_str:
+            rest_x = 2 + string_width(time_str_base) + 2 + filled_length
+            stdscr.addstr(3, rest_x, bar_str[filled_length:], curses.A_DIM)
+
+        if state.pause:
+            paused_text = "[PAUSED]"
+            paused_x = w - string_width(paused_text) - 2 
+            if paused_x < 2:
+                paused_x = 2 # Ensure it doesn't go off screen to the left
+            stdscr.addstr(1, paused_x, paused_text, curses.A_REVERSE)
+
+        if song_lock:
+            lock_text = "[LOCKED]"
+            lock_x = w - string_width(lock_text) - 2
+            if lock_x < 2:
+                lock_x = 2
+            stdscr.addstr(2, lock_x, lock_text, curses.A_REVERSE)
+
+        mode_text = " ".join(
+            text for text, on in (
+                ("[SHUFFLE]", shuffle),
+                ("[NO REPEAT]", repeat == 'off')
+            ) if on
+        )
+        mode_x = w - string_width(mode_text) - 2
+        if mode_text and mode_x > 2 + string_width(truncated_full_time_str):
+            stdscr.addstr(3, mode_x, mode_text, curses.A_REVERSE)
 
+        stdscr.hline(4, 1, curses.ACS_HLINE, w - 2)
 
+    # Playlist display, with the spectrum pane below it when open
+    playlist_h, spectrum_h = pane_heights(h, spectrum is not None)
+    start_line = 5
 
-    for i in range(playlist_h):
-        song_idx = i + playlist_view_offset
-        if song_idx < len(playlist):
-            song_name = os.path.basename(playlist[song_idx])
-            
-            indicator_char = "*" if song_idx in new_songs_indices else " "
-            selection_char = "> " if song_idx == playing_idx else " "
-            
-            prefix = f"{indicator_char}{selection_char} " 
-            
-            item_number = f"{song_idx + 1}."
-
-            max_song_width = max_width - len(prefix) - len(item_number) - 1
-            if song_idx == selected_idx:
-                display_text = get_scrolling_display_string(
-                    song_name,
-                    max_song_width,
-                    selected_song_text_scroll_offset
-                )
-
-                stdscr.addstr(
-                    start_line + i,
-                    2,
-                    f"{prefix}{item_number} {display_text}",
-                    curses.A_REVERSE
-                )
+    with prof.stage("playlist"):
+        scrolling = view.draw(
+            stdscr,
+            start_line,
+            2,
+            playlist_h,
+            max_width,
+            playlist_view_offset,
+            selected_idx,
+            playing_idx,
+            selected_song_text_scroll_offset
+        ) or scrolling
+
+    if spectrum_h:
+        with prof.stage("spectrum"):
+            top = start_line + playlist_h
+            stdscr.hline(top, 1, curses.ACS_HLINE, w - 2)
+            rows = visualizer.spectrum_rows(spectrum, spectrum_h)
+            for row, text in enumerate(rows, top + 1):
+                stdscr.addstr(row, 2, text)
 
-            else:
-                display_text = truncate_string_to_width(
-                    song_name,
-                    max_song_width
-                )
+    # Footer
+    with prof.stage("footer"):
+        help1 = f"Volume: {state.volume or 0:.0f}% (9/0)"
+        help2 = "↑/↓: Select | Enter: Play | /: Find | a: Play next | p: Pause | l: Lock | s: Shuffle | r: Repeat | ←/→: Seek | b/n: Prev/Next | C: Spectrum | q: Exit"
 
-                stdscr.addstr(
-                    start_line + i,
-                    2,
-                    f"{prefix}{item_number} {display_text}"
-                )
+        # Truncate help texts to fit within screen width
+        max_footer_width = w - 4 # 2 chars padding on each side
+        truncated_help1 = truncate_string_to_width(help1, max_footer_width)
+        truncated_help2 = truncate_string_to_width(help2, max_footer_width)
 
-    # Footer
-    vol = player.volume
-    help1 = f"Volume: {vol:.0f}% (9/0)"
-    cava_help = " | C : cava" if config.get('cava', False) else ""
-    help2 = f"↑/↓: Select | Enter: Play | p: Pause | l: Lock | b/n: Prev/Next{cava_help} | q: Exit"
-
-    # Truncate help texts to fit within screen width
-    max_footer_width = w - 4 # 2 chars padding on each side
-    truncated_help1 = truncate_string_to_width(help1, max_footer_width)
-    truncated_help2 = truncate_string_to_width(help2, max_footer_width)
-
-    stdscr.addstr(h - 2, 2, truncated_help1)
-    stdscr.addstr(h - 2, w - wcswidth(truncated_help2) - 2, truncated_help2)
+        stdscr.addstr(h - 2, 2, truncated_help1)
+        stdscr.addstr(h - 2, w - string_width(truncated_help2) - 2, truncated_help2)
+
+    if prof.overlay:
+        draw_stats_overlay(stdscr, prof.stats())
     stdscr.noutrefresh()
 
+    # Tells the caller whether any text needs the marquee to keep moving
+    return scrolling
+
+def mark_new_tracks(playlist, folder, indices, record_seen=True):
+    """Flags the tracks of folder among indices that were not seen there
+    before and returns their indices.
+
+    On the first visit of a folder everything is recorded without markers.
+    Without record_seen, folders are only compared with earlier visits.
+    """
+    first_seen = datetime.now().isoformat()
+    seen_songs = load_seen_songs(folder)
+    new_songs = {}
+    new_indices = []
+    for i in indices:
+        playlist.flags[i] &= ~(FLAG_NEW | FLAG_COPY)
+        filename = playlist.name(i)
+        if filename not in seen_songs:
+            new_songs[filename] = first_seen
+            if seen_songs:
+                playlist.flags[i] |= FLAG_NEW
+                new_indices.append(i)
+    if record_seen:
+        save_seen_songs(folder, new_songs)
+    return new_indices
+
+def open_folder(folder_path, playlist=None, on_update=None, record_seen=True):
+    """Builds the playlist, metadata loader and row model of a folder.
+
+    The playlist is a TrackTable. One can be passed in instead of listing
+    folder_path, e.g. for the whole library. Returns None when there are
+    no audio files.
+    """
+    if playlist is None:
+        playlist = get_tracks(folder_path)
+    if not playlist:
+        return None
+    if not isinstance(playlist, TrackTable):
+        playlist = TrackTable.from_paths(playlist)
+
+    metadata = MetadataLoader(playlist, on_update=on_update)
+
+    new_songs_indices = []
+    for dir_id, folder in enumerate(playlist.dirs):
+        new_songs_indices += mark_new_tracks(
+            playlist,
+            folder,
+            playlist.folder_range(dir_id),
+            record_seen
+        )
+
+    # Marks the tracks the last --find-duplicates found copies of
+    copy_indices = playlist.find_all(load_report())
+    for idx in copy_indices:
+        playlist.flags[idx] |= FLAG_COPY
+
+    return playlist, metadata, PlaylistView(
+        playlist,
+        metadata,
+        new_songs_indices,
+        copy_indices
+    )
+
 def player_tui(
         stdscr,
-        folder_path, 
-        initial_volume, 
-        config
+        session,
+        folder_path,
+        settings,
+        resume=None,
+        playlist=None
     ):
 
     curses.curs_set(0)
-    stdscr.timeout(100)  # Faster response
-
-    playlist = sorted([
-        os.path.join(folder_path, f)
-        for f in os.listdir(folder_path)
-        if f.lower().endswith(supported_exts)
-    ])
-
-    if not playlist:
+    config = settings.config
+    prof = profiler.active()
+
+    # Reattach to the playlist that is still playing from the last visit.
+    # The session's own playlist is shown rather than a fresh scan, whose
+    # indices could differ from the ones mpv and the order play by.
+    reattach = session.is_playing(folder_path)
+    waker = session.waker
+    opened = open_folder(
+        folder_path,
+        session.playlist if reattach else playlist,
+        on_update=waker.wake,
+        record_seen=folder_path != ALL_MUSIC
+    )
+    if opened is None:
         draw_message_box(stdscr, "No audio files found in this folder.")
         return
+    playlist, metadata, view = opened
 
-    seen_songs_data = load_seen_songs()
-    new_songs_indices = []
-    now = datetime.now()
-
-    # Check if the folder path is a key in our data.
-    if folder_path not in seen_songs_data:
-        # This is a new folder.
-        # 1. Don't show any asterisks for this run.
-        new_songs_indices = []
-        
-        # 2. Create a new dictionary for this folder's songs.
-        new_folder_data = {}
-        for song_full_path in playlist:
-            filename = os.path.basename(song_full_path)
-            new_folder_data[filename] = now.isoformat()
-            
-        # 3. Add this new folder's data to the main structure.
-        seen_songs_data[folder_path] = new_folder_data
-    else:
-        # This is an existing folder. Check for new songs.
-        current_folder_data = seen_songs_data[folder_path]
-        for i, song_full_path in enumerate(playlist):
-            filename = os.path.basename(song_full_path)
-            if filename not in current_folder_data:
-                # It's a new song in an old folder. Mark it as new.
-                new_songs_indices.append(i)
-                # Add the new song to the data for saving.
-                current_folder_data[filename] = now.isoformat()
+    stdscr.nodelay(True)
+    spectrum = None
+    if config.get('visualizer') and visualizer.missing() is None:
+        spectrum = visualizer.Visualizer()
 
     try:
-        player = mpv.MPV(
-            video=False,
-            input_default_bindings=False,
-            input_vo_keyboard=False,
-            osc=False,
-            audio_device=config.get('audio_backend', 'auto'),
-            vo='null'
-        )
-            
-        player.volume = initial_volume
-        player.loop_playlist = 'inf' # Loop the playlist indefinitely
-
-        for f in playlist:
-            player.playlist_append(f)
-
-        player.playlist_pos = 0
-        player.pause = False
-        selected_idx = 0
+        state = session.state
+
+        if reattach:
+            start_idx = session.current()
+        else:
+            # Continue where the last session stopped, matching the track
+            # by path in case files were added or removed since.
+            start_idx = 0
+            start_position = None
+            if resume:
+                if resume.get('path') in playlist:
+                    start_idx = playlist.index(resume['path'])
+                elif 0 <= resume.get('track', -1) < len(playlist):
+                    start_idx = resume['track']
+                start_position = resume.get('position')
+            session.load(folder_path, playlist, start_idx, start_position)
+
+        view.order = session.order
+        selected_idx = view.row_of(start_idx)
+        selected_track = start_idx
+        order_version = session.order_version
+        known_tracks = len(playlist)
+        last_snapshot = 0
         playlist_view_offset = 0
         now_playing_text_scroll_offset = 0
         selected_song_text_scroll_offset = 0
-        now_playing_scroll_counter = 0
         current_playing_id = None
+        waveform = None
         last_selected_idx = -1
-        song_lock = False
+        needs_redraw = True
+        scrolling = False
+        next_scroll_tick = 0
+        next_frame_tick = 0
 
         while True:
             try:
+                with prof.stage("session"):
+                    playing_idx = session.current()
+
+                if session.order_version != order_version \
+                        and session.playlist is playlist:
+                    # Reshuffled elsewhere, or tracks came or went: keep
+                    # the same track selected
+                    order_version = session.order_version
+                    view.order = session.order
+                    if len(playlist) > known_tracks:
+                        added = range(known_tracks, len(playlist))
+                        known_tracks = len(playlist)
+                        for folder in {playlist.folder(idx) for idx in added}:
+                            view.new_indices.update(mark_new_tracks(
+                                playlist,
+                                folder,
+                                [idx for idx in added if playlist.folder(idx) == folder],
+                                folder_path != ALL_MUSIC
+                            ))
+                        metadata.extend(added)
+                    row = view.row_of(selected_track)
+                    selected_idx = row if row < len(view) \
+                        else max(0, min(selected_idx, len(view) - 1))
+                    needs_redraw = True
+
                 # Adjust playlist_view_offset (scrolling logic)
-                h, _ = stdscr.getmaxyx()
-                playlist_h = h - 7
+                h, w = stdscr.getmaxyx()
+                playlist_h = pane_heights(h, spectrum is not None)[0]
                 if selected_idx >= playlist_h + playlist_view_offset:
                     playlist_view_offset = selected_idx - playlist_h + 1
                 elif selected_idx < playlist_view_offset:
                     playlist_view_offset = selected_idx
 
-                playing_idx = player.playlist_pos \
-                if player.playlist_pos is not None else -1
-
                 if playing_idx != current_playing_id:
                     current_playing_id = playing_idx
+                    waveform = None
                     now_playing_text_scroll_offset = 0
-                    now_playing_scroll_counter = 0
+                    needs_redraw = True
+                    last_snapshot = 0
+
+                if playing_idx >= 0 and \
+                        time.monotonic() - last_snapshot >= SESSION_INTERVAL:
+                    settings.update_session(
+                        folder=folder_path,
+                        path=playlist[playing_idx],
+                        track=playing_idx,
+                        position=state.time_pos or 0
+                    )
+                    last_snapshot = time.monotonic()
 
                 if selected_idx != last_selected_idx:
                     selected_song_text_scroll_offset = 0
                     last_selected_idx = selected_idx
-
-                draw_player_tui(
-                    stdscr,
-                    player,
-                    playlist,
-                    selected_idx,
-                    playing_idx,
-                    playlist_view_offset,
-                    now_playing_text_scroll_offset,
-                    selected_song_text_scroll_offset,
-                    song_lock, 
-                    config,
-                    new_songs_indices
-                )
-
-                now_playing_scroll_counter += 1
-                if now_playing_scroll_counter >= 3:  # Scroll faster
-                    now_playing_text_scroll_offset += 1
-                    selected_song_text_scroll_offset += 1
-                    now_playing_scroll_counter = 0
-
-                curses.doupdate()
+                    selected_track = view.track_at(selected_idx)
+                    needs_redraw = True
+
+                with prof.stage("metadata"):
+                    updated = metadata.drain_updates()
+                    if updated:
+                        view.refresh(updated)
+                        needs_redraw = True
+
+                if needs_redraw:
+                    # Looked up until the background summary is ready
+                    if waveform is None and playing_idx >= 0 \
+                            and session.waveforms is not None:
+                        waveform = session.waveforms.get(playlist[playing_idx])
+                    levels = None
+                    if spectrum is not None:
+                        with prof.stage("spectrum analysis"):
+                            levels = spectrum.levels(
+                                playlist[playing_idx] if playing_idx >= 0 else None,
+                                state.time_pos,
+                                spectrum_bars(w)
+                            )
+                    with prof.stage("draw"):
+                        scrolling = draw_player_tui(
+                            stdscr,
+                            state,
+                            playlist,
+                            selected_idx,
+                            playing_idx,
+                            playlist_view_offset,
+                            now_playing_text_scroll_offset,
+                            selected_song_text_scroll_offset,
+                            session.song_lock,
+                            config,
+                            view,
+                            session.shuffle,
+                            session.repeat,
+                            levels,
+                            waveform
+                        )
+                    with prof.stage("curses output"):
+                        curses.doupdate()
+                    prof.frame_shown()
+                    needs_redraw = False
 
             except Exception as e:
                 sys.stderr.write(f"Error in player loop: {e}\n")
                 sys.stderr.flush()
-                continue
-
-            key = stdscr.getch()
-
-            if key == -1:
-                continue
-
-            if key == ord('C'):
-                exe = config.get('background')
-                if exe:
-                    curses.endwin()
-                    try:
-                        subprocess.run([exe])
-                    except FileNotFoundError:
-                        stdscr.clear()
-                        draw_message_box(
-                            stdscr,
-                            f"'{exe}' command not found. Please install it."
-                        )
-
-                    except Exception as e:
-                        stdscr.clear()
-                        draw_message_box(
-                            stdscr,
-                            f"Error running {exe}: {e}"
-                        )
 
-                    stdscr.refresh()
-                    continue
-            elif key == curses.KEY_UP:
-                selected_idx = max(0, selected_idx - 1)
-
-            elif key == curses.KEY_DOWN:
-                selected_idx = min(len(playlist) - 1, selected_idx + 1)
-
-            elif key == curses.KEY_ENTER or key in [10, 13]:
-                player.playlist_pos = selected_idx
-                player.pause = False
-
-            elif key == ord('p'):
-                player.pause = not player.pause
-
-            elif key == ord('l'):
-                song_lock = not song_lock
-                player.loop_file = 'inf' if song_lock else False
-
-            elif key == ord('b'):
-                if len(playlist) > 0:
-                    if player.playlist_pos == 0:
-                        player.playlist_pos = len(playlist) - 1
-                    else:
-                        player.playlist_prev()
-
-            elif key == ord('n'):
-                if len(playlist) > 0:
-                    if player.playlist_pos == len(playlist) - 1:
-                        player.playlist_pos = 0
+            # Sleep until a key, an mpv event, the next marquee step or the
+            # next spectrum frame
+            timeout = None
+            if scrolling:
+                if next_scroll_tick == 0:
+                    next_scroll_tick = time.monotonic() + SCROLL_INTERVAL
+                timeout = max(0, next_scroll_tick - time.monotonic())
+            else:
+                next_scroll_tick = 0
+            animating = spectrum is not None and playing_idx >= 0 \
+                and not state.pause
+            if animating:
+                if next_frame_tick == 0:
+                    next_frame_tick = time.monotonic() + 1 / visualizer.FPS
+                frame_timeout = max(0, next_frame_tick - time.monotonic())
+                timeout = frame_timeout if timeout is None \
+                    else min(timeout, frame_timeout)
+            else:
+                next_frame_tick = 0
+            waker.wait(timeout)
+            woke_at = time.perf_counter()
+
+            if waker.woken:
+                needs_redraw = True
+            if scrolling and time.monotonic() >= next_scroll_tick:
+                now_playing_text_scroll_offset += 1
+                selected_song_text_scroll_offset += 1
+                next_scroll_tick += SCROLL_INTERVAL
+                needs_redraw = True
+            if animating and time.monotonic() >= next_frame_tick:
+                next_frame_tick += 1 / visualizer.FPS
+                if next_frame_tick < time.monotonic():
+                    # Drop the frames that were missed
+                    next_frame_tick = time.monotonic() + 1 / visualizer.FPS
+                needs_redraw = True
+
+            # Handle every key that arrived while we were waiting
+            quit_player = False
+            while True:
+                key = stdscr.getch()
+                if key == -1:
+                    break
+                needs_redraw = True
+                prof.input_at(woke_at)
+
+                if key == ord('C'):
+                    if spectrum is not None:
+                        spectrum.close()
+                        spectrum = None
                     else:
-                        player.playlist_next()
-
-            elif key == ord('9'):
-                player.volume = max(0, player.volume - 2)
-                config['volume'] = player.volume
-                save_config(config)
-
-            elif key == ord('0'):
-                player.volume = min(150, player.volume + 2)
-                config['volume'] = player.volume
-                save_config(config)
+                        missing = visualizer.missing()
+                        if missing:
+                            draw_message_box(
+                                stdscr,
+                                f"The spectrum needs {missing}. Please install it."
+                            )
+                            continue
+                        spectrum = visualizer.Visualizer()
+                    config['visualizer'] = spectrum is not None
+                    settings.save()
+
+                elif key == curses.KEY_UP:
+                    selected_idx = max(0, selected_idx - 1)
+
+                elif key == curses.KEY_DOWN:
+                    selected_idx = min(len(view) - 1, selected_idx + 1)
+
+                elif key == curses.KEY_ENTER or key in [10, 13]:
+                    session.play(view.track_at(selected_idx))
+
+                elif key == ord('a'):
+                    session.enqueue(view.track_at(selected_idx))
+
+                elif key == ord('/'):
+                    # Jump to the next track whose file name matches
+                    query = read_line_tui(stdscr, "Find: ")
+                    matches = playlist.search(query) if query else []
+                    # Tracks that left the order have no row
+                    rows = sorted(
+                        row for row in map(view.row_of, matches)
+                        if row < len(view)
+                    )
+                    if rows:
+                        selected_idx = rows[
+                            bisect_right(rows, selected_idx) % len(rows)
+                        ]
+
+                elif key == ord('p'):
+                    session.toggle_pause()
+
+                elif key == ord('l'):
+                    session.toggle_lock()
+                    settings.save()
+
+                elif key == ord('s'):
+                    # Keep the same track selected in the new order
+                    selected_track = view.track_at(selected_idx)
+                    session.toggle_shuffle()
+                    selected_idx = view.row_of(selected_track)
+                    settings.save()
+
+                elif key == ord('r'):
+                    session.cycle_repeat()
+                    settings.save()
+
+                elif key == curses.KEY_LEFT:
+                    session.seek(-SEEK_PERCENT)
+
+                elif key == curses.KEY_RIGHT:
+                    session.seek(SEEK_PERCENT)
+
+                elif key == ord('b'):
+                    session.prev()
+
+                elif key == ord('n'):
+                    session.next()
+
+                elif key == ord('9'):
+                    session.change_volume(-2)
+                    settings.save()
+
+                elif key == ord('0'):
+                    session.change_volume(2)
+                    settings.save()
+
+                elif key == ord('S'):
+                    prof.toggle_overlay()
+
+                elif key == ord('q'):
+                    if playing_idx >= 0:
+                        settings.update_session(
+                            position=state.time_pos or 0
+                        )
+                    if not config.get('keep_playing'):
+                        session.stop()
+                    quit_player = True
+                    break
 
-            elif key == ord('q'):
-                save_seen_songs(seen_songs_data)
-                player.quit()
+            if quit_player:
                 break
 
     except Exception as e:
         draw_message_box(stdscr, f"An error occurred: {e}")
         curses.endwin()
+    finally:
+        stdscr.nodelay(False)
+        if spectrum is not None:
+            spectrum.close()
+        metadata.close()
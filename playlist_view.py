@@ -0,0 +1,154 @@
+import curses
+from utils import (
+    truncate_string_to_width,
+    get_scrolling_display_string,
+    string_width
+)
+from metadata import format_length
+
+# Formatted rows kept around before the row cache is cleared
+MAX_CACHED_ROWS = 1024
+
+class PlaylistView:
+    """Windowed row model for the playlist pane.
+
+    Display names are only computed for rows that are drawn, and formatted
+    rows are cached by everything that affects them, so drawing a frame
+    only touches the rows that are on screen, whatever the length of the
+    playlist. A lazy metadata loader is asked for just those rows.
+
+    Rows list the tracks in the order they play. Without an ``order`` that
+    is the playlist order; with a PlaybackOrder it follows its shuffle,
+    and tracks in its play-next queue are marked with their place.
+    New tracks are marked with *, and tracks found to have a copy with =.
+    """
+
+    def __init__(self, playlist, metadata, new_indices=(), copy_indices=()):
+        self.playlist = playlist
+        self.metadata = metadata
+        self.new_indices = set(new_indices)
+        self.copy_indices = set(copy_indices)
+        self.order = None
+        self._rows = {}
+
+    def __len__(self):
+        # Tracks deleted since the playlist was opened are not in the order
+        return len(self.order) if self.order is not None else len(self.playlist)
+
+    def name(self, idx):
+        return self.metadata.name(idx)
+
+    def track_at(self, row):
+        """Returns the playlist index of the track shown in row."""
+        return self.order.track_at(row) if self.order is not None else row
+
+    def row_of(self, idx):
+        return self.order.row_of(idx) if self.order is not None else idx
+
+    def _queued(self, idx):
+        if self.order is None or not self.order.queue:
+            return None
+        return self.order.queue_position(idx)
+
+    def refresh(self, indices):
+        """Picks up new metadata for the given track indices."""
+        for idx in indices:
+            self._rows.pop(idx, None)
+
+    def _indicator(self, idx):
+        if idx in self.new_indices:
+            return "*"
+        return "=" if idx in self.copy_indices else " "
+
+    def _layout(self, idx, width, playing, queued):
+        """Returns (prefix, name width, length text) of a row."""
+        info = self.metadata.get(idx)
+        length_text = format_length(info.length) if info else ""
+
+        indicator_char = self._indicator(idx)
+        selection_char = "> " if playing else " "
+        prefix = f"{indicator_char}{selection_char} {idx + 1}. "
+        if queued:
+            prefix += f"+{queued} "
+
+        name_width = width - len(prefix)
+        if length_text:
+            name_width -= len(length_text) + 1
+        return prefix, name_width, length_text
+
+    def _row(self, idx, width, playing, queued):
+        key = (width, playing, queued, self._indicator(idx))
+        cached = self._rows.get(idx)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        prefix, name_width, length_text = self._layout(
+            idx,
+            width,
+            playing,
+            queued
+        )
+        text = prefix + truncate_string_to_width(self.name(idx), name_width)
+
+        if len(self._rows) >= MAX_CACHED_ROWS:
+            self._rows.clear()
+        self._rows[idx] = (key, (text, length_text))
+        return text, length_text
+
+    def draw(
+            self,
+            stdscr,
+            y,
+            x,
+            height,
+            width,
+            offset,
+            selected_row,
+            playing_idx,
+            scroll_offset
+    ):
+        """Draws the visible rows and returns True if the selection scrolls.
+
+        offset and selected_row count rows, playing_idx is a track index.
+        """
+        scrolling = False
+        end = min(len(self), offset + height)
+        self.metadata.want(self.track_at(row) for row in range(offset, end))
+
+        for row_y, row in enumerate(range(offset, end), start=y):
+            idx = self.track_at(row)
+            queued = self._queued(idx)
+            if row == selected_row:
+                prefix, name_width, length_text = self._layout(
+                    idx,
+                    width,
+                    idx == playing_idx,
+                    queued
+                )
+                name = self.name(idx)
+                scrolling = string_width(name) > name_width
+                text = prefix + get_scrolling_display_string(
+                    name,
+                    name_width,
+                    scroll_offset
+                )
+                attr = curses.A_REVERSE
+            else:
+                text, length_text = self._row(
+                    idx,
+                    width,
+                    idx == playing_idx,
+                    queued
+                )
+                attr = 0
+
+            stdscr.addstr(row_y, x, text, attr)
+            if length_text:
+                stdscr.addstr(
+                    row_y,
+                    x + width - len(length_text),
+                    length_text,
+                    attr
+                )
+
+        return scrolling
@@ -0,0 +1,140 @@
+# Tracks kept in mpv's playlist before and after the current one
+WINDOW_BEHIND = 2
+WINDOW_AHEAD = 3
+
+class PlayQueue:
+    """Keeps the full playlist in Python and feeds mpv a window of it.
+
+    ``window`` maps every entry of mpv's playlist to an index in
+    ``playlist``. Only a few tracks around the current one are handed to
+    mpv, so starting playback costs the same for any folder size. The
+    tracks ahead come from ``order``; when it changes (shuffle, repeat or
+    a queued track) only the entries after the current one are replaced,
+    and the track that is playing is never touched. Starting always
+    replaces whatever mpv was playing before.
+
+    ``file_options(idx)``, if given, returns per-file mpv options for track
+    idx, which apply while that track plays.
+    """
+
+    def __init__(self, player, playlist, order, file_options=None):
+        self.player = player
+        self.playlist = playlist
+        self.order = order
+        self.file_options = file_options
+        self.window = []
+        # Position in the window last reported to the order
+        self._pos = None
+
+    def start(self, idx=0, position=None, remember=True):
+        """Replaces mpv's playlist and starts playing track idx.
+
+        position (seconds) starts the track part way through.
+        """
+        options = self._options(idx)
+        if position:
+            # Per file, so the tracks after it start from their beginning
+            options = dict(options, start=f"{position:.3f}")
+
+        self.order.advance(idx, remember)
+        self.window = [idx]
+        self._pos = 0
+        self.player.loop_playlist = False
+        self.player.loadfile(self.playlist[idx], 'replace', **options)
+        self._top_up(0)
+
+    def _options(self, idx):
+        if self.file_options is None:
+            return {}
+        return self.file_options(idx)
+
+    def _position(self):
+        pos = self.player.playlist_pos
+        if pos is None or not 0 <= pos < len(self.window):
+            return None
+        return pos
+
+    def current(self):
+        """Returns the playlist index of the playing track, or -1."""
+        pos = self._position()
+        return self.window[pos] if pos is not None else -1
+
+    def upcoming(self, count):
+        """Returns the playlist indices of up to count tracks after the
+        current one, in the order they will play."""
+        if self.current() < 0:
+            return []
+        return self.order.upcoming(count)
+
+    def sync(self):
+        """Slides the window after mpv moved to another track."""
+        pos = self._position()
+        if pos is None:
+            return
+        if pos != self._pos:
+            self._pos = pos
+            self.order.advance(self.window[pos])
+
+        while pos > WINDOW_BEHIND:
+            self.player.playlist_remove(0)
+            self.window.pop(0)
+            pos -= 1
+            self._pos -= 1
+        self._top_up(pos)
+
+    def reorder(self):
+        """Brings the tracks after the current one in line with the order."""
+        pos = self._position()
+        if pos is not None:
+            self._top_up(pos)
+
+    def _top_up(self, pos):
+        wanted = self.order.upcoming(WINDOW_AHEAD)
+        ahead = self.window[pos + 1:]
+        keep = 0
+        while keep < min(len(ahead), len(wanted)) \
+                and ahead[keep] == wanted[keep]:
+            keep += 1
+
+        # Removed from the end so the entries before keep stay where they are
+        for entry in range(len(self.window) - 1, pos + keep, -1):
+            self.player.playlist_remove(entry)
+            self.window.pop()
+        for idx in wanted[keep:]:
+            self.player.playlist_append(self.playlist[idx], **self._options(idx))
+            self.window.append(idx)
+
+    def play(self, idx, remember=True):
+        """Plays track idx, reusing its mpv entry when it is in the window.
+
+        Returns idx, like ``next`` and ``prev`` return the track they chose.
+        remember=False keeps the track that was playing out of the history.
+        """
+        pos = self._position()
+        ahead = self.window[pos + 1:] if pos is not None else []
+        if idx in ahead:
+            target = pos + 1 + ahead.index(idx)
+        elif idx in self.window:
+            target = self.window.index(idx)
+        else:
+            self.start(idx, remember=remember)
+            return idx
+
+        self.order.advance(idx, remember)
+        self._pos = target
+        self.player.playlist_pos = target
+        self.sync()
+        return idx
+
+    def next(self):
+        """Skips to the next track of the order, if there is one."""
+        idx = self.order.next()
+        if idx is None:
+            return self.current()
+        return self.play(idx)
+
+    def prev(self):
+        idx = self.order.previous()
+        if idx is None:
+            return self.current()
+        return self.play(idx, remember=False)
@@ -0,0 +1,89 @@
+import os
+import threading
+
+# Bytes read per step; the generation is checked between steps so that a
+# cancelled prefetch stops quickly
+CHUNK_SIZE = 1 << 20
+
+class Prefetcher:
+    """Warms the page cache for upcoming tracks on a background thread.
+
+    Every ``schedule`` call replaces the previous request, so prefetches of
+    tracks that are no longer coming up are dropped. Reads stop once
+    ``byte_budget`` bytes have been requested for one schedule.
+    """
+
+    def __init__(self, byte_budget):
+        self.byte_budget = byte_budget
+        self._cond = threading.Condition()
+        self._paths = []
+        self._generation = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="prefetch",
+            daemon=True
+        )
+        self._thread.start()
+
+    def schedule(self, paths):
+        """Prefetches paths in order, cancelling any earlier request."""
+        with self._cond:
+            self._generation += 1
+            self._paths = list(paths)
+            self._cond.notify()
+
+    def cancel(self):
+        self.schedule([])
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._generation += 1
+            self._cond.notify()
+
+    def _current(self, generation):
+        return not self._closed and generation == self._generation
+
+    def _run(self):
+        buf = bytearray(CHUNK_SIZE)
+        while True:
+            with self._cond:
+                while not self._paths and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                paths, self._paths = self._paths, []
+                generation = self._generation
+
+            budget = self.byte_budget
+            for path in paths:
+                if budget <= 0 or not self._current(generation):
+                    break
+                budget -= self._warm(path, budget, generation, buf)
+
+    def _warm(self, path, limit, generation, buf):
+        """Pulls up to limit bytes of path into the page cache."""
+        try:
+            f = open(path, 'rb', buffering=0)
+        except OSError:
+            return 0
+        with f:
+            try:
+                size = min(os.fstat(f.fileno()).st_size, limit)
+                # Lets local disks start readahead at once. Network and FUSE
+                # mounts may ignore it, so the reads below do the real work.
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(
+                        f.fileno(), 0, size, os.POSIX_FADV_WILLNEED
+                    )
+                done = 0
+                view = memoryview(buf)
+                while done < size and self._current(generation):
+                    n = f.readinto(view[:min(CHUNK_SIZE, size - done)])
+                    if not n:
+                        break
+                    done += n
+                return done
+            except OSError:
+                return 0
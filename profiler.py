@@ -0,0 +1,156 @@
+import threading
+import time
+from array import array
+
+# Samples kept per stage; older ones are overwritten
+RING_SIZE = 1024
+
+# Stage recording the time from a key press until the screen shows its effect
+KEY_TO_SCREEN = "key-to-screen"
+
+class RingBuffer:
+    """Fixed-size buffer of the last ``size`` samples."""
+
+    def __init__(self, size=RING_SIZE):
+        self._samples = array('d', bytes(8 * size))
+        self._next = 0
+        self.count = 0
+
+    def add(self, value):
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+
+    def values(self):
+        return self._samples[:min(self.count, len(self._samples))]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted sequence."""
+    rank = max(0, min(len(sorted_values) - 1,
+                      round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+class _Stage:
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._profiler.record(self._name, time.perf_counter() - self._start)
+
+class Profiler:
+    """Rolling timings of named stages, in milliseconds.
+
+    Stages are timed with ``with profiler.stage(name):``. Key-to-screen
+    latency is measured from ``input_at`` to the next ``frame_shown``.
+    """
+
+    enabled = True
+
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.overlay = False
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._input_at = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            ring = self._stages.get(name)
+            if ring is None:
+                ring = self._stages[name] = RingBuffer(self.size)
+            ring.add(seconds * 1000)
+
+    def input_at(self, timestamp):
+        """Notes when input arrived, keeping the earliest unshown one."""
+        if self._input_at is None:
+            self._input_at = timestamp
+
+    def frame_shown(self):
+        if self._input_at is not None:
+            self.record(KEY_TO_SCREEN, time.perf_counter() - self._input_at)
+            self._input_at = None
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+
+    def stats(self):
+        """Returns (stage, samples, p50, p95, p99, max) rows sorted by stage."""
+        with self._lock:
+            rings = [(name, ring.count, ring.values())
+                     for name, ring in self._stages.items()]
+        rows = []
+        for name, count, values in sorted(rings):
+            values = sorted(values)
+            rows.append((
+                name, count,
+                percentile(values, 0.50),
+                percentile(values, 0.95),
+                percentile(values, 0.99),
+                values[-1]
+            ))
+        return rows
+
+    def summary(self):
+        lines = [
+            f"{'stage':<20}{'samples':>9}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'p99 ms':>10}{'max ms':>10}"
+        ]
+        for name, count, p50, p95, p99, worst in self.stats():
+            lines.append(
+                f"{name:<20}{count:>9}{p50:>10.3f}{p95:>10.3f}"
+                f"{p99:>10.3f}{worst:>10.3f}"
+            )
+        return "\n".join(lines) + "\n"
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class NullProfiler:
+    """Stand-in used unless profiling is enabled; every call does nothing."""
+
+    enabled = False
+    overlay = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def record(self, name, seconds):
+        pass
+
+    def input_at(self, timestamp):
+        pass
+
+    def frame_shown(self):
+        pass
+
+    def toggle_overlay(self):
+        pass
+
+_active = NullProfiler()
+
+def active():
+    """Returns the profiler in use, a NullProfiler unless enabled."""
+    return _active
+
+def enable(size=RING_SIZE):
+    global _active
+    if not _active.enabled:
+        _active = Profiler(size)
+    return _active
@@ -0,0 +1,339 @@
+import json
+import socket
+import threading
+import time
+from collections import deque
+from control import CONTROL_SOCKET
+from events import Waker
+from order import PlaybackOrder, REPEAT_MODES
+from tracktable import TrackTable
+import waveform
+
+# Seconds to wait for the daemon to answer a command
+REPLY_TIMEOUT = 10
+
+class RemoteState:
+    """PlayerState of a session running in the daemon, kept up to date by
+    its status pushes.
+
+    The daemon only sends the position when the displayed second changes,
+    so between pushes it is counted on from the moment the last one
+    arrived, keeping the progress bar and the spectrum moving smoothly.
+    """
+
+    def __init__(self):
+        self.current = -1
+        self.media_title = None
+        self.duration = None
+        self.pause = False
+        self.volume = 0
+        self._position = None
+        self._since = 0
+
+    @property
+    def time_pos(self):
+        if self._position is None:
+            return None
+        if self.pause:
+            return float(self._position)
+        position = self._position + time.monotonic() - self._since
+        if self.duration:
+            position = min(position, self.duration)
+        return position
+
+    def update(self, status):
+        # Other changes are pushed too; only a new second or a resume
+        # restarts the count
+        if status['position'] != self._position or status['index'] != self.current \
+                or (self.pause and not status['paused']):
+            self._position = status['position']
+            self._since = time.monotonic()
+        self.current = status['index']
+        self.media_title = status['title']
+        self.duration = status['duration'] or None
+        self.pause = status['paused']
+        self.volume = status['volume']
+
+class _Reply:
+    def __init__(self):
+        self.done = threading.Event()
+        self.message = None
+
+class RemoteSession:
+    """Stands in for a PlayerSession whose mpv runs in the daemon.
+
+    Commands go over the control socket and a reader thread applies the
+    pushed statuses to ``state`` and wakes the UI loop, so the player and
+    menus work unchanged. The playlist and the play order are fetched
+    once and then only when another client replaces or reshuffles them,
+    or just the tracks the daemon's watcher added since.
+
+    Commands that only change what is shown are updated locally right away
+    and sent without waiting; the daemon's answer follows as a push.
+    Leaving the player never stops the daemon's playback.
+
+    Raises OSError if no daemon is listening on path.
+    """
+
+    def __init__(self, config, path=CONTROL_SOCKET):
+        self.config = config
+        self.state = RemoteState()
+        self.waker = Waker()
+        self.folder = None
+        self.playlist = []
+        self.order = None
+        self.order_version = None
+        self.shuffle = config.get('shuffle', False)
+        self.repeat = config.get('repeat', 'all')
+        # The mode unlocking the song goes back to
+        self._unlocked_repeat = self.repeat if self.repeat != 'one' else 'all'
+        self.connected = True
+        self._daemon_order_version = None
+        self._daemon_playlist = None
+        self._playlist_key = None
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(str(path))
+        except OSError:
+            self._sock.close()
+            self.waker.close()
+            raise
+        self._lines = self._sock.makefile('rb')
+        self._send_lock = threading.Lock()
+        self._replies = {}
+        self._next_id = 0
+        self._reader = threading.Thread(
+            target=self._read,
+            name="remote-session",
+            daemon=True
+        )
+        self._reader.start()
+
+        # Read-only: the daemon summarizes the tracks it plays into the
+        # same cache
+        self.waveforms = None
+        if waveform.numpy is not None and config.get('waveform_mb', 16) > 0:
+            self.waveforms = waveform.WaveformCache(config.get('waveform_mb', 16) << 20)
+
+        status = self._request('subscribe')
+        if status is None:
+            self.close()
+            raise OSError("the daemon did not answer")
+        self._apply(status)
+        if status['folder'] is not None:
+            self._fetch_playlist()
+
+    # Runs on the reader thread
+    def _read(self):
+        try:
+            for line in self._lines:
+                message = json.loads(line)
+                if message.get('event') == 'status':
+                    self._apply(message['status'])
+                    continue
+                reply = self._replies.pop(message.get('id'), None)
+                if reply is not None:
+                    reply.message = message
+                    reply.done.set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.connected = False
+            self.state.current = -1
+            for reply in list(self._replies.values()):
+                reply.done.set()
+            self.waker.wake()
+
+    def _apply(self, status):
+        self.state.update(status)
+        self.shuffle = status['shuffle']
+        self.repeat = status['repeat']
+        if self.repeat != 'one':
+            self._unlocked_repeat = self.repeat
+        for key in ('volume', 'shuffle', 'repeat'):
+            self.config[key] = status[key]
+        self._daemon_playlist = (status['folder'], status['tracks'])
+        self._daemon_order_version = status['order_version']
+        order = self.order
+        if order is not None:
+            order.queue = deque(status['queue'])
+            order.repeat = status['repeat']
+        self.waker.wake()
+
+    def _request(self, command, wait=True, **args):
+        """Sends a command and returns its result, or None if it failed.
+        Without wait, returns None right away."""
+        if not self.connected:
+            return None
+        reply = _Reply()
+        with self._send_lock:
+            self._next_id += 1
+            request_id = self._next_id
+            if wait:
+                self._replies[request_id] = reply
+            message = dict(args, command=command, id=request_id)
+            try:
+                self._sock.sendall(json.dumps(message).encode() + b"\n")
+            except OSError:
+                self._replies.pop(request_id, None)
+                return None
+        if not wait:
+            return None
+        if not reply.done.wait(REPLY_TIMEOUT):
+            self._replies.pop(request_id, None)
+            return None
+        message = reply.message
+        if message is None or not message.get('ok'):
+            return None
+        return message.get('result')
+
+    def _fetch_playlist(self):
+        data = self._request('playlist')
+        if data is None:
+            return
+        self.folder = data['folder']
+        self.playlist = TrackTable.unpack(data)
+        self.order = None
+        self._playlist_key = (self.folder, len(self.playlist))
+        self._fetch_order()
+
+    def _fetch_added(self):
+        """Appends the tracks the daemon added to the playlist shown here
+        and flags the ones it removed."""
+        data = self._request('playlist', start=len(self.playlist))
+        if data is None or data['folder'] != self.folder:
+            return
+        try:
+            self.playlist.add_packed(data)
+        except ValueError:  # Replaced by a shorter one meanwhile
+            return
+        self._playlist_key = (self.folder, len(self.playlist))
+
+    def _fetch_order(self):
+        snapshot = self._request('order')
+        if snapshot is None:
+            # Nothing is loaded; asking again would not change that
+            self.order_version = self._daemon_order_version
+            return
+        if self.order is None:
+            self.order = PlaybackOrder(len(self.playlist), repeat=self.repeat)
+        # In place, so a view holding the order sees the new one
+        self.order.restore(snapshot)
+        self.order_version = snapshot['version']
+
+    def _showing_daemon_playlist(self):
+        return self._playlist_key == self._daemon_playlist
+
+    def is_playing(self, folder_path):
+        """True if the daemon plays folder_path; fetches its tracks if
+        another client opened it."""
+        if self._daemon_playlist is None or self._daemon_playlist[0] != folder_path:
+            return False
+        if not self._showing_daemon_playlist():
+            self._fetch_playlist()
+        return self.current() >= 0
+
+    def current(self):
+        """Returns the playlist index of the playing track, or -1 while the
+        daemon plays a playlist other than the one shown here."""
+        stale = self.order_version != self._daemon_order_version
+        if stale and isinstance(self.playlist, TrackTable) \
+                and self._daemon_playlist[0] == self.folder:
+            self._fetch_added()
+        if not self._showing_daemon_playlist():
+            return -1
+        if stale:
+            self._fetch_order()
+        return self.state.current
+
+    def load(self, folder_path, playlist, start_idx=0, position=None):
+        """Has the daemon open folder_path and play track start_idx."""
+        status = self._request(
+            'open',
+            folder=folder_path,
+            path=playlist[start_idx],
+            index=start_idx,
+            position=position
+        )
+        if status is None:
+            return
+        self._apply(status)
+        self.folder = folder_path
+        self.playlist = playlist
+        self.order = None
+        self._playlist_key = self._daemon_playlist
+        self._fetch_order()
+
+    def play(self, idx):
+        self.state.current = idx
+        self.state.pause = False
+        self._request('play', wait=False, index=idx)
+
+    def enqueue(self, idx):
+        if self.order is not None:
+            self.order.enqueue(idx)
+        self._request('enqueue', wait=False, index=idx)
+
+    def next(self):
+        self._request('next', wait=False)
+
+    def prev(self):
+        self._request('prev', wait=False)
+
+    def toggle_pause(self):
+        self.state.pause = not self.state.pause
+        self._request('pause', wait=False, paused=self.state.pause)
+
+    @property
+    def song_lock(self):
+        return self.repeat == 'one'
+
+    def toggle_lock(self):
+        self.set_repeat(self._unlocked_repeat if self.song_lock else 'one')
+
+    def cycle_repeat(self):
+        """Switches to the next repeat mode: all, one, off."""
+        modes = REPEAT_MODES
+        self.set_repeat(modes[(modes.index(self.repeat) + 1) % len(modes)])
+
+    def set_repeat(self, mode):
+        self.repeat = mode
+        if mode != 'one':
+            self._unlocked_repeat = mode
+        self.config['repeat'] = mode
+        self._request('repeat', wait=False, mode=mode)
+
+    def toggle_shuffle(self):
+        # Waits for the new order, which the caller looks tracks up in
+        status = self._request('shuffle', shuffle=not self.shuffle)
+        if status is not None:
+            self._apply(status)
+            self._fetch_order()
+
+    def seek(self, percent):
+        self._request('seek', wait=False, percent=percent)
+
+    def change_volume(self, step):
+        """Changes the volume by step, keeping it within 0-150."""
+        volume = max(0, min(150, self.state.volume + step))
+        self.state.volume = volume
+        self.config['volume'] = volume
+        self._request('volume', wait=False, value=volume)
+        return volume
+
+    def stop(self):
+        """Does nothing: the music plays on in the daemon."""
+
+    def close(self):
+        self.connected = False
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join(timeout=2)
+        self._lines.close()
+        self._sock.close()
+        if self.waveforms is not None:
+            self.waveforms.close()
+        self.waker.close()
@@ -0,0 +1,478 @@
+import os
+import threading
+import mpv
+from events import Waker
+from playqueue import PlayQueue
+from order import PlaybackOrder, REPEAT_MODES
+from prefetch import Prefetcher
+from loudness import LOUDNESS_DB, LoudnessCache
+from library import index_for, ALL_MUSIC
+from tracktable import TrackTable
+from watcher import FolderWatcher
+from history import PlayHistory, START, SKIP, COMPLETE
+import waveform
+
+# Properties whose changes trigger a redraw. time-pos is observed separately
+# so that playback only redraws once per displayed second.
+WATCHED_PROPERTIES = (
+    'playlist-pos',
+    'pause',
+    'volume',
+    'media-title',
+    'duration'
+)
+
+# A track left this close to its end, in seconds, was played to the end
+END_SECONDS = 3
+
+def _within(path, folder):
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+class PlayerState:
+    """Last known values of the mpv properties the UI shows.
+
+    Observers keep it up to date from mpv's event thread, so drawing a
+    frame never waits for mpv, even while it is busy opening a slow file.
+    ``current`` is the playlist index of the playing track, or -1.
+    """
+
+    def __init__(self, volume):
+        self.current = -1
+        self.media_title = None
+        self.time_pos = None
+        self.duration = None
+        self.pause = False
+        self.volume = volume
+
+class PlayerSession:
+    """One mpv instance kept warm for the whole run of the app.
+
+    The session survives going back to the menus. Opening another folder
+    only replaces the playlist, and with ``keep_playing`` the music goes on
+    while the menus are shown.
+
+    The folders of the playlist are watched, so tracks copied in, deleted
+    or renamed meanwhile come and go from the playlist without reloading
+    it. ``order_version`` changes when they do.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.player = mpv.MPV(
+            video=False,
+            input_default_bindings=False,
+            input_vo_keyboard=False,
+            osc=False,
+            audio_device=config.get('audio_backend', 'auto'),
+            vo='null'
+        )
+        self.player.volume = config['volume']
+
+        self.state = PlayerState(config['volume'])
+        self.waker = Waker()
+        self.lock = threading.RLock()
+        self.folder = None
+        self.playlist = []
+        self.queue = None
+        self.order = None
+        # Changes whenever the play order is replaced or reshuffled, or
+        # tracks come or go
+        self.order_version = 0
+        self.shuffle = config.get('shuffle', False)
+        self.repeat = config.get('repeat', 'all')
+        # The mode unlocking the song goes back to
+        self._unlocked_repeat = self.repeat if self.repeat != 'one' else 'all'
+        self.player.loop_file = 'inf' if self.repeat == 'one' else False
+        self._last_shown_second = None
+        self.prefetcher = Prefetcher(config.get('prefetch_mb', 64) << 20)
+        self._prefetched_for = None
+        # Called with no arguments whenever the state changes, from any
+        # thread, e.g. by the control socket
+        self.listeners = []
+        # Only opened once tracks have been analysed
+        self.loudness = None
+        if config.get('normalize', True) and LOUDNESS_DB.exists():
+            self.loudness = LoudnessCache()
+        self.waveforms = None
+        if waveform.numpy is not None and config.get('waveform_mb', 16) > 0:
+            self.waveforms = waveform.WaveformCache(
+                config.get('waveform_mb', 16) << 20,
+                on_ready=self.waker.wake
+            )
+        self.watcher = None
+        # Every track played is logged for the history view
+        self.history = None
+        if config.get('history', True):
+            self.history = PlayHistory()
+        # (playlist, index, path) of the track being listened to, the
+        # furthest position reached in it and its duration
+        self._listening = None
+        self._furthest = 0
+        self._length = 0
+
+        for prop in WATCHED_PROPERTIES:
+            self.player.observe_property(prop, self._on_property_change)
+        self.player.observe_property('time-pos', self._on_time_change)
+
+    # Observers run on mpv's event thread. They keep the window of the
+    # play queue filled, even while no player view is open, and wake the
+    # UI loop, which does all the drawing.
+    def _on_property_change(self, name, value):
+        if name == 'playlist-pos':
+            self.sync()
+        else:
+            setattr(self.state, name.replace('-', '_'), value)
+            if name == 'duration' and value:
+                # Kept, as it is gone or the next track's by the time
+                # playlist-pos says the track ended
+                self._length = value
+        self._changed()
+
+    def _on_time_change(self, name, value):
+        self.state.time_pos = value
+        if value is not None and self._listening is not None:
+            if self.repeat == 'one' and value < 1 and self._at_end():
+                # mpv looped the file, so it played once more
+                self._log_end()
+                self._log_start(*self._listening)
+            self._furthest = max(self._furthest, value)
+        # The clock only shows whole seconds
+        second = int(value) if value is not None else None
+        if second != self._last_shown_second:
+            self._last_shown_second = second
+            self._changed()
+
+    def _changed(self):
+        self.waker.wake()
+        for listener in self.listeners:
+            listener()
+
+    def status(self):
+        """Returns the state as a JSON-friendly dict, with the position in
+        whole seconds."""
+        state = self.state
+        current = state.current
+        playlist = self.playlist
+        return {
+            'folder': self.folder,
+            'index': current,
+            'path': playlist[current] if 0 <= current < len(playlist) else None,
+            'title': state.media_title,
+            'position': int(state.time_pos or 0),
+            'duration': int(state.duration or 0),
+            'paused': bool(state.pause),
+            'volume': state.volume,
+            'repeat': self.repeat,
+            'shuffle': self.shuffle,
+            'tracks': len(playlist),
+            'queue': list(self.order.queue) if self.order is not None else [],
+            'order_version': self.order_version
+        }
+
+    def is_playing(self, folder_path):
+        """True if folder_path is loaded and still has a current track."""
+        return self.folder == folder_path and self.current() >= 0
+
+    def load(self, folder_path, playlist, start_idx=0, position=None):
+        """Replaces the playlist and starts playing track start_idx."""
+        with self.lock:
+            replaced = self._watch(folder_path)
+            self.prefetcher.cancel()
+            self._prefetched_for = None
+            self.folder = folder_path
+            self.playlist = playlist
+            self.order = PlaybackOrder(
+                len(playlist),
+                self.shuffle,
+                self.repeat,
+                start_idx
+            )
+            self.queue = PlayQueue(
+                self.player,
+                playlist,
+                self.order,
+                self._file_options if self.loudness is not None else None
+            )
+            self.order_version += 1
+            self.queue.start(start_idx, position)
+            # Shown right away, while mpv may still be opening the file
+            self.state.current = start_idx
+            self._set_pause(False)
+        # Outside the lock, which its thread may be waiting for
+        if replaced is not None:
+            replaced.close()
+
+    def _watch(self, folder_path):
+        """Starts watching the folders of folder_path's playlist and returns
+        the watcher this one replaces, for the caller to close."""
+        replaced, self.watcher = self.watcher, None
+        if self.config.get('watch', True):
+            if folder_path == ALL_MUSIC:
+                folders, recursive = self.config['paths'], True
+            else:
+                folders, recursive = [folder_path], False
+            self.watcher = FolderWatcher(folders, recursive, self.refresh_folders)
+        return replaced
+
+    def refresh_folders(self, folders):
+        """Brings the playlist in line with the tracks now in folders.
+
+        New tracks are appended to the playlist and take their place in the
+        order, and tracks that are gone leave it; the track that is playing
+        plays on even if its file is gone. Called by the watcher.
+        """
+        with self.lock:
+            playlist = self.playlist
+            if self.queue is None or not isinstance(playlist, TrackTable):
+                return
+            folders = self._playlist_folders(folders)
+            added, removed = [], []
+            for folder in folders:
+                names = set(index_for(folder).scan_dir(folder)[1])
+                known = {
+                    playlist.name(idx): idx
+                    for idx in playlist.folder_tracks(folder)
+                }
+                removed.extend(
+                    idx for name, idx in known.items() if name not in names
+                )
+                new = sorted(names - known.keys())
+                if new:
+                    start = len(playlist)
+                    playlist.add_tracks(folder, new)
+                    added.extend(range(start, len(playlist)))
+            if not added and not removed:
+                return
+            # Placed before the removed tracks leave, which keeps new tracks
+            # after a removed one that is still playing
+            added = [(idx, playlist.before(idx)) for idx in added]
+            for idx in removed:
+                playlist.remove(idx)
+            self.order.update(len(playlist), added, removed)
+            self.order_version += 1
+            self._reorder()
+        self._changed()
+
+    def _playlist_folders(self, folders):
+        """Returns the folders among folders that the playlist draws from,
+        in path order, with the folders of the playlist below any that
+        were deleted."""
+        if self.folder != ALL_MUSIC:
+            # As the playlist spells it, which may differ from self.folder
+            return [
+                folder for folder in self.playlist.dirs
+                if os.path.normpath(folder) in folders
+            ]
+        bases = [os.path.normpath(base) for base in self.config['paths']]
+        wanted = {
+            folder for folder in folders
+            if any(_within(folder, base) for base in bases)
+        }
+        gone = [folder for folder in wanted if not os.path.isdir(folder)]
+        if gone:
+            wanted.update(
+                folder for folder in self.playlist.dirs
+                if any(_within(folder, below) for below in gone)
+            )
+        return sorted(wanted)
+
+    def _file_options(self, idx):
+        # A fixed gain per file costs mpv nothing, unlike a loudness filter
+        gain = self.loudness.gain(self.playlist[idx])
+        if gain is None:
+            return {}
+        return {'volume_gain': f"{gain:.2f}"}
+
+    def stop(self):
+        """Stops playback and forgets the playlist, keeping mpv running."""
+        with self.lock:
+            replaced, self.watcher = self.watcher, None
+            if self._listening is not None:
+                self._log_end(stopped=True)
+                self._listening = None
+            self.prefetcher.cancel()
+            self._prefetched_for = None
+            self.player.stop()
+            self.folder = None
+            self.playlist = []
+            self.queue = None
+            self.order = None
+            self.state.current = -1
+        if replaced is not None:
+            replaced.close()
+
+    def sync(self):
+        with self.lock:
+            if self.queue is not None:
+                self.queue.sync()
+                self.state.current = self.queue.current()
+                self._log_track(self.state.current)
+                self._prefetch()
+
+    def _prefetch(self, force=False):
+        """Warms the tracks that play after the current one."""
+        current = self.queue.current()
+        if current < 0 or (current == self._prefetched_for and not force):
+            return
+        self._prefetched_for = current
+        if self.waveforms is not None:
+            # The seek bar of the current track first, then the next one's
+            self.waveforms.request(
+                self.playlist[idx] for idx in [current] + self.queue.upcoming(1)
+            )
+        count = self.config.get('prefetch_tracks', 2)
+        if self.repeat == 'one' or count <= 0:
+            # A locked track repeats, and it is already cached
+            self.prefetcher.cancel()
+            return
+        self.prefetcher.schedule(
+            self.playlist[idx] for idx in self.queue.upcoming(count)
+        )
+
+    def _log_track(self, current):
+        """Logs how the track that was playing ended and that current
+        started, if it is another one."""
+        if self.history is None:
+            return
+        listening = self._listening
+        if listening is not None and listening[0] is self.playlist \
+                and listening[1] == current:
+            return
+        if listening is not None:
+            self._log_end()
+        self._listening = None
+        if 0 <= current < len(self.playlist):
+            self._log_start(self.playlist, current, self.playlist[current])
+
+    def _log_start(self, playlist, idx, path):
+        self._listening = (playlist, idx, path)
+        self._furthest = 0
+        # Until mpv reports this track's duration, if it has not yet
+        self._length = self.state.duration or 0
+        self.history.record(START, path)
+
+    def _log_end(self, stopped=False):
+        """Logs the end of the track being listened to. A track that was
+        stopped counts only if it got to its end."""
+        path = self._listening[2]
+        if self._at_end():
+            self.history.record(COMPLETE, path, self._furthest)
+        elif not stopped:
+            self.history.record(SKIP, path, self._furthest)
+
+    def _at_end(self):
+        return bool(self._length) and self._furthest >= self._length - END_SECONDS
+
+    def current(self):
+        """Returns the playlist index of the playing track, or -1.
+
+        Read from the snapshot without taking the lock, which mpv's event
+        thread may hold while mpv is slow to answer.
+        """
+        return self.state.current
+
+    def play(self, idx):
+        with self.lock:
+            if self.queue is not None:
+                # Whatever was being warmed is not coming up any more
+                self.prefetcher.cancel()
+                self._prefetched_for = None
+                self.state.current = self.queue.play(idx)
+                self._set_pause(False)
+
+    def next(self):
+        with self.lock:
+            if self.queue is not None:
+                self.state.current = self.queue.next()
+
+    def prev(self):
+        with self.lock:
+            if self.queue is not None:
+                self.state.current = self.queue.prev()
+
+    def _set_pause(self, pause):
+        self.state.pause = pause
+        self.player.pause = pause
+
+    def toggle_pause(self):
+        self._set_pause(not self.state.pause)
+
+    @property
+    def song_lock(self):
+        return self.repeat == 'one'
+
+    def toggle_lock(self):
+        self.set_repeat(self._unlocked_repeat if self.song_lock else 'one')
+
+    def cycle_repeat(self):
+        """Switches to the next repeat mode: all, one, off."""
+        modes = REPEAT_MODES
+        self.set_repeat(modes[(modes.index(self.repeat) + 1) % len(modes)])
+
+    def set_repeat(self, mode):
+        with self.lock:
+            self.repeat = mode
+            if mode != 'one':
+                self._unlocked_repeat = mode
+            self.config['repeat'] = mode
+            self.player.loop_file = 'inf' if mode == 'one' else False
+            if self.order is not None:
+                self.order.repeat = mode
+            self._reorder()
+        self._changed()
+
+    def toggle_shuffle(self):
+        with self.lock:
+            self.shuffle = not self.shuffle
+            self.config['shuffle'] = self.shuffle
+            if self.order is not None:
+                self.order.set_shuffle(self.shuffle)
+                self.order_version += 1
+            self._reorder()
+        self._changed()
+
+    def enqueue(self, idx):
+        """Plays track idx next, after anything queued before."""
+        with self.lock:
+            if self.order is not None:
+                self.order.enqueue(idx)
+                self._reorder()
+        self._changed()
+
+    def _reorder(self):
+        # Only the entries after the current track in mpv change
+        if self.queue is not None:
+            self.queue.reorder()
+            self._prefetch(force=True)
+
+    def seek(self, percent):
+        """Moves percent of the track's length forwards, or back when
+        negative."""
+        with self.lock:
+            if self.queue is not None and self.state.duration:
+                self.player.seek(percent, reference='relative-percent')
+
+    def change_volume(self, step):
+        """Changes the volume by step, keeping it within 0-150."""
+        volume = max(0, min(150, self.state.volume + step))
+        self.state.volume = volume
+        self.player.volume = volume
+        self.config['volume'] = volume
+        return volume
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.history is not None:
+            with self.lock:
+                if self._listening is not None:
+                    self._log_end(stopped=True)
+                    self._listening = None
+            self.history.close()
+        if self.loudness is not None:
+            self.loudness.close()
+        if self.waveforms is not None:
+            self.waveforms.close()
+        self.prefetcher.close()
+        self.waker.close()
+        self.player.terminate()
@@ -0,0 +1,324 @@
+import base64
+import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+
+# Bits of TrackTable.flags
+FLAG_NEW = 1
+# The same contents are elsewhere in the library (see duplicates.py)
+FLAG_COPY = 2
+# Deleted or renamed since it was added; kept so indices stay valid
+FLAG_GONE = 4
+
+# Maps flags to 1 for gone tracks and 0 for the rest, with bytes.translate
+_GONE_BYTES = bytes(1 if flags & FLAG_GONE else 0 for flags in range(256))
+
+def _encode(text):
+    return text.encode('utf-8', 'surrogateescape')
+
+def _decode(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+class TrackTable:
+    """Compact, append-only list of tracks.
+
+    Every folder is stored once and referred to by its id, file names share
+    one UTF-8 buffer addressed by offsets, and flags and durations live in
+    typed arrays. A track costs 17 bytes plus its file name, where a list
+    of path strings costs over 100 bytes per track. Indexing returns the
+    full path, so a table stands in for a list of paths.
+
+    Tracks are added a folder at a time, so the tracks of a folder are
+    contiguous and a path is found by looking only at its folder. Tracks
+    that turn up in a folder later are appended to the table and listed
+    per folder, and tracks that disappear are only flagged FLAG_GONE, so
+    an index always names the same track.
+    """
+
+    def __init__(self):
+        self.dirs = []
+        self._dir_ids = {}
+        self._dir_start = array('I')
+        self._dir_end = array('I')
+        self.dir_ids = array('I')
+        self._names = bytearray()
+        self._offsets = array('Q', [0])
+        self.flags = array('B')
+        # Seconds, 0 while unknown
+        self.durations = array('f')
+        # Folder id -> indices of tracks added after the folder's range
+        self._late = {}
+        self._sorted_dirs = None
+        self._folded = None
+
+    @classmethod
+    def from_paths(cls, paths):
+        """Builds a table from full paths, grouping runs of one folder."""
+        table = cls()
+        folder = None
+        names = []
+        for path in paths:
+            head, name = os.path.split(path)
+            if head != folder:
+                if names:
+                    table.add_folder(folder, names)
+                folder, names = head, []
+            names.append(name)
+        if names:
+            table.add_folder(folder, names)
+        return table
+
+    def add_folder(self, folder, names):
+        """Appends the tracks names of folder, which must not be in the
+        table yet."""
+        if folder in self._dir_ids:
+            raise ValueError(f"{folder} is already in the table")
+        self._add_names(names)
+        self._add_run(folder, len(names))
+
+    def add_tracks(self, folder, names):
+        """Appends tracks of folder, which may already be in the table."""
+        self._add_names(names)
+        self._add_run(folder, len(names))
+
+    def _add_names(self, names):
+        for name in names:
+            self._names += _encode(name)
+            self._offsets.append(len(self._names))
+
+    def _add_run(self, folder, count):
+        """Appends count tracks of folder, whose names were just added."""
+        start = len(self.dir_ids)
+        dir_id = self._dir_ids.get(folder)
+        if dir_id is None:
+            dir_id = len(self.dirs)
+            self.dirs.append(folder)
+            self._dir_ids[folder] = dir_id
+            self._dir_start.append(start)
+            self._dir_end.append(start)
+            self._sorted_dirs = None
+        self.dir_ids.extend(array('I', [dir_id]) * count)
+        self.flags.extend(bytes(count))
+        self.durations.frombytes(bytes(4 * count))
+        self._folded = None
+        if self._dir_end[dir_id] == start:
+            # Nothing was appended after the folder, so its range grows
+            self._dir_end[dir_id] = len(self.dir_ids)
+        else:
+            self._late.setdefault(dir_id, []).extend(range(start, len(self.dir_ids)))
+
+    def remove(self, idx):
+        """Flags track idx as gone."""
+        self.flags[idx] |= FLAG_GONE
+
+    def pack(self, start=0):
+        """Returns the tracks from index start on as JSON-friendly data,
+        for ``unpack`` or ``add_packed`` in another process on this machine.
+        Of the flags only FLAG_GONE is kept, for every track; durations are
+        left out.
+
+        The names go as one string, and where each ends in it as base64 of
+        the offset array, so neither end touches the names one at a time."""
+        runs = [
+            [dir_id, len(list(group))]
+            for dir_id, group in groupby(self.dir_ids[start:])
+        ]
+        base = self._offsets[start]
+        ends = self._offsets[start + 1:]
+        if base:
+            # Only the tracks added since an earlier pack
+            ends = array('Q', [end - base for end in ends])
+        marked = self.flags.tobytes().translate(_GONE_BYTES)
+        gone = []
+        idx = marked.find(1)
+        while idx >= 0:
+            gone.append(idx)
+            idx = marked.find(1, idx + 1)
+        return {
+            'start': start,
+            'dirs': self.dirs,
+            'runs': runs,
+            'names': _decode(self._names[base:]),
+            'ends': base64.b64encode(ends).decode('ascii'),
+            'gone': gone
+        }
+
+    @classmethod
+    def unpack(cls, data):
+        table = cls()
+        table.add_packed(data)
+        return table
+
+    def add_packed(self, data):
+        """Appends the tracks of ``pack`` data taken from where this table
+        ends, and flags the tracks gone there."""
+        if data['start'] != len(self):
+            raise ValueError(f"packed tracks start at {data['start']}, not {len(self)}")
+        names = _encode(data['names'])
+        ends = array('Q')
+        ends.frombytes(base64.b64decode(data['ends']))
+        if (ends[-1] if ends else 0) != len(names) \
+                or sum(count for dir_id, count in data['runs']) != len(ends):
+            raise ValueError("packed tracks do not match their names")
+        base = len(self._names)
+        if base:
+            ends = array('Q', [end + base for end in ends])
+        self._offsets.extend(ends)
+        self._names += names
+        for dir_id, count in data['runs']:
+            self._add_run(data['dirs'][dir_id], count)
+        for idx in data['gone']:
+            self.flags[idx] |= FLAG_GONE
+
+    def has_folder(self, folder):
+        return folder in self._dir_ids
+
+    def __len__(self):
+        return len(self.dir_ids)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self.dir_ids)
+        return os.path.join(self.dirs[self.dir_ids[idx]], self.name(idx))
+
+    def __iter__(self):
+        for idx in range(len(self.dir_ids)):
+            yield self[idx]
+
+    def __contains__(self, path):
+        return self.find(path) >= 0
+
+    def name(self, idx):
+        """Returns the file name of track idx."""
+        return _decode(self._names[self._offsets[idx]:self._offsets[idx + 1]])
+
+    def folder(self, idx):
+        return self.dirs[self.dir_ids[idx]]
+
+    def folder_range(self, dir_id):
+        """Returns the range of track indices in folder dir_id."""
+        return range(self._dir_start[dir_id], self._dir_end[dir_id])
+
+    def folder_tracks(self, folder):
+        """Returns the indices of the tracks in folder that are not gone."""
+        dir_id = self._dir_ids.get(folder)
+        if dir_id is None:
+            return []
+        indices = list(self.folder_range(dir_id)) + self._late.get(dir_id, [])
+        return [idx for idx in indices if not self.flags[idx] & FLAG_GONE]
+
+    def find(self, path):
+        """Returns the index of path, or -1. Gone tracks are not found."""
+        head, name = os.path.split(path)
+        dir_id = self._dir_ids.get(head)
+        if dir_id is None:
+            return -1
+        wanted = _encode(name)
+        offsets = self._offsets
+        for indices in (self.folder_range(dir_id), self._late.get(dir_id, ())):
+            for idx in indices:
+                if self._names[offsets[idx]:offsets[idx + 1]] == wanted \
+                        and not self.flags[idx] & FLAG_GONE:
+                    return idx
+        return -1
+
+    def find_all(self, paths):
+        """Returns the indices of those of paths that are in the table,
+        listing each folder once rather than once per path. Gone tracks
+        are not found."""
+        wanted = {}
+        for path in paths:
+            head, name = os.path.split(path)
+            if head in self._dir_ids:
+                wanted.setdefault(head, []).append(_encode(name))
+        found = []
+        offsets = self._offsets
+        for folder, names in wanted.items():
+            dir_id = self._dir_ids[folder]
+            by_name = {}
+            for indices in (self.folder_range(dir_id), self._late.get(dir_id, ())):
+                for idx in indices:
+                    if not self.flags[idx] & FLAG_GONE:
+                        by_name.setdefault(bytes(self._names[offsets[idx]:offsets[idx + 1]]), idx)
+            found.extend(by_name[name] for name in names if name in by_name)
+        return found
+
+    def before(self, idx):
+        """Returns the track that comes right before track idx in path
+        order, leaving out gone tracks, or -1 if idx comes first."""
+        folder = self.folder(idx)
+        name = self.name(idx)
+        earlier = [
+            (self.name(other), other) for other in self.folder_tracks(folder)
+            if self.name(other) < name
+        ]
+        if earlier:
+            return max(earlier)[1]
+        # The last track of the closest folder before this one
+        if self._sorted_dirs is None:
+            self._sorted_dirs = sorted(self.dirs)
+        dirs = self._sorted_dirs
+        for pos in range(bisect_left(dirs, folder) - 1, -1, -1):
+            tracks = self.folder_tracks(dirs[pos])
+            if tracks:
+                return max((self.name(other), other) for other in tracks)[1]
+        return -1
+
+    def index(self, path):
+        idx = self.find(path)
+        if idx < 0:
+            raise ValueError(f"{path} is not in the table")
+        return idx
+
+    def search(self, query):
+        """Returns the indices of tracks whose file name contains query.
+
+        Letters are compared ignoring case for ASCII and exactly otherwise,
+        since folding the shared buffer must keep every offset in place.
+        Gone tracks are left out.
+        """
+        # Folded like the buffer, so non-ASCII capitals stay as typed
+        needle = _encode(query).lower()
+        if not needle:
+            return [idx for idx in range(len(self)) if not self.flags[idx] & FLAG_GONE]
+        if self._folded is None:
+            self._folded = bytes(self._names).lower()
+        folded = self._folded
+        offsets = self._offsets
+        found = []
+        pos = folded.find(needle)
+        while pos >= 0:
+            idx = bisect_right(offsets, pos) - 1
+            end = offsets[idx + 1]
+            if pos + len(needle) <= end:
+                if not self.flags[idx] & FLAG_GONE:
+                    found.append(idx)
+                pos = end
+            else:
+                # The match runs into the next name
+                pos += 1
+            pos = folded.find(needle, pos)
+        return found
+
+    def sort_indices(self, key='path', reverse=False):
+        """Returns the track indices ordered by 'path', 'name' or 'duration'."""
+        if key == 'duration':
+            sort_key = self.durations.__getitem__
+        elif key == 'name':
+            sort_key = self.name
+        else:
+            sort_key = self.__getitem__
+        return array('I', sorted(range(len(self)), key=sort_key, reverse=reverse))
+
+    def nbytes(self):
+        """Approximate memory used by the table, in bytes."""
+        arrays = (
+            self._dir_start, self._dir_end, self.dir_ids, self._offsets,
+            self.flags, self.durations
+        )
+        total = len(self._names) + sum(a.itemsize * len(a) for a in arrays)
+        # Folder strings plus their list and dict entries, roughly
+        total += sum(sys.getsizeof(d) + 8 + 100 for d in self.dirs)
+        return total
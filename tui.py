@@ -1,9 +1,7 @@
 import curses
 import os
-import subprocess
-import shutil
-from wcwidth import wcswidth
-from utils import truncate_string_to_width
+from utils import truncate_string_to_width, string_width
+from finder import DirectoryTree, FuzzyIndex
 
 def draw_menu(
     stdscr,
@@ -20,7 +18,7 @@ def draw_menu(
     # Truncate and center the title
     max_line_width = max(1, w - 2) # Ensure min width of 1
     truncated_title = truncate_string_to_width(title_text, max_line_width)
-    title_x = (w - wcswidth(truncated_title)) // 2
+    title_x = (w - string_width(truncated_title)) // 2
     if title_x < 1:
         title_x = 1 # Ensure x position is at least 1
     stdscr.addstr(1, title_x, truncated_title, curses.A_BOLD)
@@ -65,7 +63,7 @@ def draw_menu(
 
     # Truncate and center the help text
     truncated_help = truncate_string_to_width(help_text, max_line_width)
-    help_x = (w - wcswidth(truncated_help)) // 2
+    help_x = (w - string_width(truncated_help)) // 2
     if help_x < 1:
         help_x = 1 # Ensure x position is at least 1
     
@@ -74,6 +72,28 @@ def draw_menu(
         stdscr.addstr(h - 2, help_x, truncated_help)
     stdscr.noutrefresh()
 
+def draw_stats_overlay(stdscr, rows):
+    """Draws profiler rows of (stage, samples, p50, p95, p99, max) in the
+    top right corner, on top of whatever is on screen."""
+    h, w = stdscr.getmaxyx()
+    lines = [f"{'stage':<16}{'p50':>7}{'p95':>7}{'p99':>7}{'max':>7} ms"]
+    for name, _, p50, p95, p99, worst in rows:
+        lines.append(
+            f"{name[:16]:<16}{p50:>7.2f}{p95:>7.2f}{p99:>7.2f}{worst:>7.2f}   "
+        )
+    if len(lines) == 1:
+        lines.append("no samples yet".ljust(len(lines[0])))
+
+    y = 1
+    x = max(1, w - len(lines[0]) - 2)
+    for i, line in enumerate(lines[:max(0, h - 2)]):
+        stdscr.addstr(
+            y + i,
+            x,
+            truncate_string_to_width(line, w - x - 1),
+            curses.A_REVERSE | (curses.A_BOLD if i == 0 else 0)
+        )
+
 def draw_message_box(stdscr, message):
     """Draws a centered box with a left-aligned message and waits for a key press."""
     h, w = stdscr.getmaxyx()
@@ -86,7 +106,7 @@ def draw_message_box(stdscr, message):
     truncated_message = truncate_string_to_width(message, max_msg_width)
     
     box_h = 5
-    box_w = wcswidth(truncated_message) + 4 # 2 for padding, 2 for borders
+    box_w = string_width(truncated_message) + 4 # 2 for padding, 2 for borders
     
     # Ensure box_w does not exceed terminal width
     if box_w > w:
@@ -116,44 +136,138 @@ def draw_message_box(stdscr, message):
     box_win.refresh()
     box_win.getch() # wait for user to press a key
 
-def check_dependencies():
-    """Check if fd and fzf are installed."""
-    return shutil.which("fd") is not None and shutil.which("fzf") is not None
+def draw_finder(stdscr, query, results, selected_row_idx, status_text):
+    """Draws the directory finder: a query line above the ranked results."""
+    h, w = stdscr.getmaxyx()
+    stdscr.erase()
+    stdscr.box()
+
+    max_line_width = max(1, w - 2)
+    title = truncate_string_to_width("Add New Path", max_line_width)
+    stdscr.addstr(1, max(1, (w - string_width(title)) // 2), title, curses.A_BOLD)
+    stdscr.hline(2, 1, curses.ACS_HLINE, max(1, w - 2))
+
+    x = 2
+    max_width = max(1, w - x - 2)
+    # Keep the end of the query (where the cursor is) visible
+    prompt = f"> {query}"
+    while string_width(prompt) > max_width and len(prompt) > 2:
+        prompt = "> " + prompt[3:]
+    stdscr.addstr(3, x, prompt)
+    status = truncate_string_to_width(status_text, max_width)
+    status_x = w - string_width(status) - 2
+    if status_x > x + string_width(prompt):
+        stdscr.addstr(3, status_x, status, curses.A_DIM)
+    stdscr.hline(4, 1, curses.ACS_HLINE, max(1, w - 2))
+
+    menu_h = h - 7
+    start_line = 5
+    scroll_offset = 0
+    if selected_row_idx >= menu_h:
+        scroll_offset = selected_row_idx - menu_h + 1
+
+    for i in range(max(0, menu_h)):
+        item_idx = i + scroll_offset
+        if item_idx >= len(results):
+            break
+        name = truncate_string_to_width(results[item_idx], max_width)
+        attr = curses.A_REVERSE if item_idx == selected_row_idx else 0
+        stdscr.addstr(start_line + i, x, name, attr)
+
+    help_text = truncate_string_to_width(
+        "Type to filter | ↑/↓: Select | Enter: Add | Esc: Cancel",
+        max_line_width
+    )
+    stdscr.addstr(h - 2, max(1, (w - string_width(help_text)) // 2), help_text)
+    stdscr.noutrefresh()
 
 def browse_path_tui(stdscr):
-    """A TUI for browsing the filesystem using fd and fzf."""
-    if not check_dependencies():
-        draw_message_box(
-            stdscr,
-            "Please install 'fd' and 'fzf' for path selection."
-        )
-        return None
+    """Picks a directory below the home directory with a fuzzy finder."""
+    curses.curs_set(0)
+    if hasattr(curses, 'set_escdelay'):
+        curses.set_escdelay(25)
 
-    # Exit curses mode to run fzf
-    curses.endwin()
+    home_dir = os.path.expanduser("~")
+    tree = DirectoryTree(home_dir)
+    index = FuzzyIndex(tree.dirs())
+    index_version = tree.version
+    query = ""
+    results = index.search(query)
+    current_row = 0
 
-    selected_path = None
     try:
-        home_dir = os.path.expanduser("~")
-        # We search for directories in the home directory.
-        command = f"fd -L --type d . '{home_dir}' | fzf"
-        
-        # Using shell=True is necessary for the pipe
-        process = subprocess.run(
-            command,
-            shell=True, 
-            capture_output=True,
-            text=True,
-            check=False
-        )
-        
-        if process.returncode == 0:
-            selected_path = process.stdout.strip()
+        while True:
+            # Pick up the fresh directory list once the scan finished
+            if tree.version != index_version:
+                index = FuzzyIndex(tree.dirs())
+                index_version = tree.version
+                results = index.search(query)
+                current_row = min(current_row, max(0, len(results) - 1))
+
+            status = f"{len(results)} shown"
+            if tree.scanning:
+                status += " | scanning..."
+            draw_finder(stdscr, query, results, current_row, status)
+            curses.doupdate()
 
+            # Poll while the scan runs so its result shows up, then block
+            stdscr.timeout(200 if tree.scanning else -1)
+            try:
+                key = stdscr.get_wch()
+            except curses.error:
+                continue
+
+            if key == curses.KEY_UP:
+                current_row = max(0, current_row - 1)
+            elif key == curses.KEY_DOWN:
+                current_row = min(max(0, len(results) - 1), current_row + 1)
+            elif key in (curses.KEY_ENTER, '\n', '\r'):
+                return results[current_row] if results else None
+            elif key == '\x1b':
+                return None
+            elif key in (curses.KEY_BACKSPACE, '\x7f', '\b'):
+                if query:
+                    query = query[:-1]
+                    results = index.search(query)
+                    current_row = 0
+            elif isinstance(key, str) and key.isprintable():
+                query += key
+                results = index.search(query)
+                current_row = 0
     finally:
-        stdscr.refresh()
+        tree.cancel()
+        stdscr.timeout(-1)
 
-    return selected_path if selected_path else None
+def read_line_tui(stdscr, prompt):
+    """Reads a line of text on the bottom row of the screen.
+
+    Returns the text on Enter, or None on Esc.
+    """
+    if hasattr(curses, 'set_escdelay'):
+        curses.set_escdelay(25)
+    h, w = stdscr.getmaxyx()
+    text = ""
+    stdscr.nodelay(False)
+    try:
+        while True:
+            line = truncate_string_to_width(f"{prompt}{text}", max(1, w - 4))
+            stdscr.addstr(h - 2, 2, line + " " * max(0, w - 4 - string_width(line)))
+            stdscr.refresh()
+            try:
+                key = stdscr.get_wch()
+            except curses.error:
+                continue
+
+            if key in (curses.KEY_ENTER, '\n', '\r'):
+                return text
+            elif key == '\x1b':
+                return None
+            elif key in (curses.KEY_BACKSPACE, '\x7f', '\b'):
+                text = text[:-1]
+            elif isinstance(key, str) and key.isprintable():
+                text += key
+    finally:
+        stdscr.nodelay(True)
 
 def get_text_input_tui(stdscr, prompt):
     input_text = ""
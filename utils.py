@@ -1,43 +1,52 @@
-import os
-from wcwidth import wcswidth
+from bisect import bisect_right
+from functools import lru_cache
+from wcwidth import wcwidth
+
+supported_exts = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+
+# Gap shown between the end and the restart of scrolling text
+SCROLL_PADDING = "   "
+
+@lru_cache(maxsize=4096)
+def _width_prefix(s):
+    """Returns the visual width of every prefix of s (len(s) + 1 entries).
+
+    Non-printable characters count as zero width so the sums never decrease,
+    which lets callers binary search them.
+    """
+    prefix = [0]
+    total = 0
+    for char in s:
+        char_width = wcwidth(char)
+        if char_width > 0:
+            total += char_width
+        prefix.append(total)
+    return prefix
+
+@lru_cache(maxsize=512)
+def _scroll_loop(s):
+    """Returns s repeated twice with padding, and its prefix widths."""
+    looped = (s + SCROLL_PADDING) * 2
+    return looped, _width_prefix(looped)
+
+def string_width(s):
+    """Visual width of s in terminal cells"""
+    return _width_prefix(s)[-1]
 
 def truncate_string_to_width(s, width):
     """Truncate string to fit visual width"""
-    current_width = 0
-    truncated_s = []
-    for char in s:
-        char_width = wcswidth(char)
-        if current_width + char_width > width:  # Check visual width
-            break
-        current_width += char_width
-        truncated_s.append(char)
-    return "".join(truncated_s)
+    prefix = _width_prefix(s)
+    if prefix[-1] <= width:
+        return s
+    # Longest prefix whose width still fits
+    return s[:max(0, bisect_right(prefix, width) - 1)]
 
 def get_scrolling_display_string(s, max_width, scroll_offset):
     """Returns the scrolling part of the string"""
-    visual_width = wcswidth(s)
-    if visual_width <= max_width:
+    if _width_prefix(s)[-1] <= max_width:
         return s
 
-    padding_chars = 3
-    padded_s = s + (" " * padding_chars)
-    start_char_idx = scroll_offset % len(padded_s)
-
-    current_visual_width = 0
-    display_chars = []
-    for i in range(len(padded_s)):
-        char_idx = (start_char_idx + i) % len(padded_s)
-        char = padded_s[char_idx]
-        char_visual_width = wcswidth(char)
-
-        if current_visual_width + char_visual_width > max_width:
-            break
-        current_visual_width += char_visual_width
-        display_chars.append(char)
-
-    return "".join(display_chars)
-
-def get_folders(path):
-    if not os.path.isdir(path):
-        return []
-    return sorted([f for f in os.listdir(path) if os.path.isdir(os.path.join(path, f))])
+    looped, prefix = _scroll_loop(s)
+    start = scroll_offset % (len(s) + len(SCROLL_PADDING))
+    end = bisect_right(prefix, prefix[start] + max_width) - 1
+    return looped[start:max(start, end)]
@@ -0,0 +1,308 @@
+import shutil
+import subprocess
+import threading
+
+try:
+    import numpy
+except ImportError:  # The spectrum pane is simply unavailable
+    numpy = None
+
+# Tracks are decoded to mono at this rate for the spectrum, which shows
+# frequencies up to half of it
+RATE = 22050
+
+# Samples per FFT (about 93 ms), the window the bars are computed over
+FFT_SIZE = 2048
+
+# Lowest frequency shown, in Hz
+MIN_FREQ = 40
+
+# Level shown as an empty bar, in dB below a full-scale sine
+FLOOR_DB = -70.0
+
+# Share of the pane height a bar may fall per frame, so drops look smooth
+FALL = 0.06
+
+# Frames drawn per second while the pane is open and music is playing
+FPS = 20
+
+# Seconds of PCM kept in the ring buffer, and decoded ahead of playback
+BUFFER_SECONDS = 2
+LEAD_SECONDS = 0.5
+
+# Jumps further ahead than this restart the decoder instead of reading on
+SEEK_SLACK = 1.0
+
+# Samples read from the decoder at once
+CHUNK = 2048
+
+BLOCKS = " ▁▂▃▄▅▆▇█"
+
+def missing():
+    """Returns what the spectrum pane needs but is not installed, or None."""
+    if numpy is None:
+        return "numpy"
+    if shutil.which("ffmpeg") is None:
+        return "ffmpeg"
+    return None
+
+class PcmRing:
+    """Fixed-size ring of the last ``capacity`` mono samples.
+
+    Samples are addressed by their absolute index since the last
+    ``clear``, so a reader can ask for the window ending at a given time.
+    Not locked; ``PcmTap`` guards it.
+    """
+
+    def __init__(self, capacity):
+        self._samples = numpy.zeros(capacity, dtype=numpy.float32)
+        self.written = 0
+
+    @property
+    def capacity(self):
+        return len(self._samples)
+
+    def clear(self):
+        self.written = 0
+
+    def write(self, samples):
+        capacity = len(self._samples)
+        if len(samples) >= capacity:
+            # Only the newest samples fit
+            self.written += len(samples) - capacity
+            samples = samples[-capacity:]
+        pos = self.written % capacity
+        first = min(len(samples), capacity - pos)
+        self._samples[pos:pos + first] = samples[:first]
+        self._samples[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read(self, start, stop):
+        """Returns samples start to stop, or None if they are not all in
+        the buffer."""
+        capacity = len(self._samples)
+        if start < max(0, self.written - capacity) or stop > self.written \
+                or stop - start > capacity:
+            return None
+        indices = numpy.arange(start, stop) % capacity
+        return self._samples[indices]
+
+class Spectrum:
+    """Turns PCM windows into bar heights between 0 and 1.
+
+    Bars split the range from MIN_FREQ to half the sample rate into
+    logarithmic bands, each showing its loudest FFT bin on a dB scale.
+    Band edges are worked out once per bar count. Bars rise at once and
+    fall by at most FALL per frame.
+    """
+
+    def __init__(self, rate=RATE, size=FFT_SIZE):
+        self.rate = rate
+        self.size = size
+        self._window = numpy.hanning(size).astype(numpy.float32)
+        # Makes a full-scale sine come out at 1
+        self._scale = 2 / self._window.sum()
+        self._edges = {}
+        self.levels = numpy.zeros(0)
+
+    def _band_edges(self, count):
+        edges = self._edges.get(count)
+        if edges is None:
+            bins = self.size // 2 + 1
+            freqs = numpy.geomspace(MIN_FREQ, self.rate / 2, count + 1)
+            edges = (freqs * self.size / self.rate).astype(numpy.int64)
+            # Every band gets at least one bin of its own
+            edges = numpy.maximum(edges, edges[0] + numpy.arange(count + 1))
+            edges = numpy.minimum(edges, bins)
+            self._edges[count] = edges
+        return edges
+
+    def bars(self, samples, count):
+        """Returns count levels for a window of FFT_SIZE samples; None
+        stands for silence."""
+        if samples is None:
+            target = numpy.zeros(count)
+        else:
+            magnitude = numpy.abs(numpy.fft.rfft(samples * self._window))
+            magnitude *= self._scale
+            edges = self._band_edges(count)
+            # Bands that ran out of bins at the top stay empty
+            usable = int(numpy.searchsorted(edges, len(magnitude), 'left'))
+            usable = min(usable, count)
+            peaks = numpy.zeros(count)
+            if usable:
+                peaks[:usable] = numpy.maximum.reduceat(
+                    magnitude, edges[:usable]
+                )
+            with numpy.errstate(divide='ignore'):
+                decibels = 20 * numpy.log10(peaks)
+            target = numpy.clip(1 - decibels / FLOOR_DB, 0, 1)
+
+        if len(self.levels) != count:
+            self.levels = target
+        else:
+            self.levels = numpy.maximum(target, self.levels - FALL)
+        return self.levels
+
+def spectrum_rows(levels, height):
+    """Returns the text rows (top first) drawing levels as bars height
+    rows tall, with a space between bars."""
+    eighths = (numpy.asarray(levels) * height * 8).astype(numpy.int64)
+    rows = []
+    for row in range(height - 1, -1, -1):
+        cells = numpy.clip(eighths - row * 8, 0, 8)
+        rows.append(" ".join(BLOCKS[cell] for cell in cells.tolist()))
+    return rows
+
+class PcmTap:
+    """Feeds the ring buffer with the PCM of the track mpv is playing.
+
+    mpv does not hand decoded audio to clients, so the tap decodes the
+    same file with ffmpeg, as mono at RATE, and keeps LEAD_SECONDS ahead
+    of the position passed to ``follow``. A track change or a seek
+    restarts the decoder at the new position. The pipe blocks the decoder
+    while the tap waits, so it never runs far ahead of playback.
+    """
+
+    def __init__(self, rate=RATE):
+        self.rate = rate
+        self.ring = PcmRing(rate * BUFFER_SECONDS)
+        self._cond = threading.Condition()
+        self._path = None
+        self._position = 0.0
+        # What the decoder is working on: file, start time, whether done
+        self._stream_path = None
+        self._start = 0.0
+        self._ended = False
+        self._failed = None
+        self._process = None
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="pcm-tap",
+            daemon=True
+        )
+        self._thread.start()
+
+    def follow(self, path, position):
+        """Tells the tap which track is playing and where."""
+        with self._cond:
+            if path != self._path or position != self._position:
+                self._path = path
+                self._position = position or 0.0
+                self._cond.notify()
+
+    def window(self, size=FFT_SIZE):
+        """Returns the size samples that end at the followed position, or
+        None while they are not decoded."""
+        with self._cond:
+            if self._stream_path != self._path:
+                return None
+            end = round((self._position - self._start) * self.rate)
+            return self.ring.read(end - size, end)
+
+    def _covers(self, position):
+        sample = (position - self._start) * self.rate
+        oldest = max(0, self.ring.written - self.ring.capacity)
+        # Going back past the buffer needs the decoder to start over, except
+        # during the first window of a track
+        lowest = oldest + FFT_SIZE // 2 if oldest or self._start else 0
+        return lowest <= sample \
+            <= self.ring.written + SEEK_SLACK * self.rate
+
+    def _ahead(self, position):
+        return self.ring.written / self.rate - (position - self._start)
+
+    def _next_step(self):
+        """Waits until there is something to do. Returns 'restart', 'read'
+        or None once closed."""
+        with self._cond:
+            while not self._closed:
+                path, position = self._path, self._position
+                if path is not None and path != self._failed:
+                    if path != self._stream_path or not self._covers(position):
+                        self._stream_path = path
+                        # Start early enough for a full window right away
+                        self._start = max(0.0, position - FFT_SIZE / self.rate)
+                        self._ended = False
+                        self.ring.clear()
+                        return 'restart'
+                    if not self._ended and self._ahead(position) < LEAD_SECONDS:
+                        return 'read'
+                self._cond.wait()
+            return None
+
+    def _run(self):
+        try:
+            while True:
+                step = self._next_step()
+                if step is None:
+                    return
+                if step == 'restart':
+                    self._stop_decoder()
+                    self._start_decoder()
+                    continue
+                data = self._process.stdout.read(CHUNK * 4)
+                with self._cond:
+                    if not data:
+                        self._ended = True
+                        continue
+                    usable = len(data) - len(data) % 4
+                    self.ring.write(
+                        numpy.frombuffer(data[:usable], dtype='<f4')
+                    )
+        finally:
+            self._stop_decoder()
+
+    def _start_decoder(self):
+        with self._cond:
+            path, start = self._stream_path, self._start
+        try:
+            self._process = subprocess.Popen(
+                [
+                    "ffmpeg", "-nostdin", "-v", "error",
+                    "-ss", f"{start:.3f}", "-i", path,
+                    "-vn", "-ac", "1", "-ar", str(self.rate),
+                    "-f", "f32le", "-"
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            with self._cond:
+                self._failed = path
+                self._ended = True
+
+    def _stop_decoder(self):
+        process, self._process = self._process, None
+        if process is not None:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            process = self._process
+        if process is not None:
+            # Unblocks a read in progress
+            process.kill()
+        self._thread.join(timeout=1)
+
+class Visualizer:
+    """The spectrum pane: a PCM tap plus the bars computed from it."""
+
+    def __init__(self):
+        self.tap = PcmTap()
+        self.spectrum = Spectrum()
+
+    def levels(self, path, position, count):
+        """Returns count bar levels for the track at path, playing at
+        position seconds."""
+        self.tap.follow(path, position)
+        return self.spectrum.bars(self.tap.window(FFT_SIZE), count)
+
+    def close(self):
+        self.tap.close()
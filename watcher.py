@@ -0,0 +1,285 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+# Seconds without events before changes are reported, so files copied in
+# together arrive as one change...
+QUIET = 0.5
+# ...but never held back longer than this
+MAX_DELAY = 3.0
+
+# Seconds between checks when inotify is not available
+POLL_INTERVAL = 5.0
+
+# inotify event bits, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# A file counts once it is written and closed or moved in, not while it
+# is still being copied
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE \
+    | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+# struct inotify_event without the name that follows it
+EVENT = struct.Struct('iIII')
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):  # Not Linux, or no inotify
+        return None
+    return libc
+
+_libc = _load_libc()
+
+def _folders_below(path):
+    """Yields path and every folder below it that is not hidden, following
+    symlinks but not loops."""
+    seen = set()
+    stack = [path]
+    while stack:
+        folder = stack.pop()
+        try:
+            st = os.stat(folder)
+        except OSError:
+            continue
+        if (st.st_dev, st.st_ino) in seen:
+            continue
+        seen.add((st.st_dev, st.st_ino))
+        yield folder
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir() and not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+class FolderWatcher:
+    """Reports changes to the files in some folders on a background thread.
+
+    ``on_change(folders)`` is called with the sorted folders whose files
+    were added, removed or renamed, once things have been quiet for
+    ``QUIET`` seconds. A folder that was deleted or moved away is reported
+    as well. With ``recursive`` the folders below are watched too,
+    including ones created later; hidden folders are skipped.
+
+    inotify is used through libc when it is available. Otherwise, or when
+    the system runs out of inotify watches, the folders' mtimes are
+    checked every ``POLL_INTERVAL`` seconds instead (``polling`` is then
+    True).
+    """
+
+    def __init__(self, folders, recursive, on_change):
+        self.folders = [os.path.normpath(folder) for folder in folders]
+        self.recursive = recursive
+        self.on_change = on_change
+        self.polling = _libc is None
+        self._fd = None
+        self._watches = {}
+        self._wake_r, self._wake_w = os.pipe()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="watcher",
+            daemon=True
+        )
+        self._thread.start()
+
+    def close(self):
+        self._closed = True
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass
+        self._thread.join(timeout=2)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _watched(self):
+        """Yields every folder to watch as it is now."""
+        for root in self.folders:
+            if self.recursive:
+                yield from _folders_below(root)
+            elif os.path.isdir(root):
+                yield root
+
+    def _run(self):
+        if not self.polling:
+            try:
+                self._start_inotify()
+            except OSError:
+                self._stop_inotify()
+                self.polling = True
+        try:
+            if self.polling:
+                self._poll()
+            else:
+                self._follow()
+        finally:
+            self._stop_inotify()
+
+    # inotify
+
+    def _start_inotify(self):
+        fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        for folder in self._watched():
+            if self._closed:
+                return
+            self._add_watch(folder)
+
+    def _add_watch(self, folder):
+        wd = _libc.inotify_add_watch(
+            self._fd,
+            os.fsencode(folder),
+            WATCH_MASK
+        )
+        if wd < 0:
+            error = ctypes.get_errno()
+            if not os.path.isdir(folder):
+                return  # Gone again already
+            raise OSError(error, f"cannot watch {folder}")
+        self._watches[wd] = folder
+
+    def _stop_inotify(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._watches = {}
+
+    def _follow(self):
+        dirty = set()
+        first = last = 0
+        while not self._closed:
+            timeout = None
+            if dirty:
+                now = time.monotonic()
+                timeout = max(0, min(last + QUIET, first + MAX_DELAY) - now)
+            ready = select.select([self._fd, self._wake_r], [], [], timeout)[0]
+            if self._closed:
+                return
+            if self._fd in ready:
+                if not dirty:
+                    first = time.monotonic()
+                last = time.monotonic()
+                try:
+                    self._read_events(dirty)
+                except OSError:
+                    # Out of watches for a new folder: poll from here on
+                    self._stop_inotify()
+                    self.polling = True
+                    dirty.update(self._watched())
+                    self.on_change(sorted(dirty))
+                    self._poll()
+                    return
+            elif dirty:
+                changed, dirty = sorted(dirty), set()
+                self.on_change(changed)
+
+    def _read_events(self, dirty):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + size].rstrip(b'\0')
+            pos += EVENT.size + size
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything may have changed
+                dirty.update(self._watches.values())
+                continue
+            folder = self._watches.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if mask & IN_DELETE_SELF:
+                dirty.add(folder)
+                continue
+
+            name = os.fsdecode(name)
+            if not mask & IN_ISDIR:
+                if not mask & IN_CREATE:
+                    dirty.add(folder)
+            elif self.recursive and not name.startswith('.'):
+                path = os.path.join(folder, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for below in _folders_below(path):
+                        self._add_watch(below)
+                        dirty.add(below)
+                else:
+                    dirty.add(path)
+
+    # Polling
+
+    def _poll(self):
+        mtimes = {}
+        for folder in self._watched():
+            try:
+                mtimes[folder] = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+        while True:
+            select.select([self._wake_r], [], [], POLL_INTERVAL)
+            if self._closed:
+                return
+            changed = []
+            for folder, mtime in list(mtimes.items()):
+                try:
+                    now = os.stat(folder).st_mtime_ns
+                except OSError:
+                    del mtimes[folder]
+                    changed.append(folder)
+                    continue
+                if now == mtime:
+                    continue
+                mtimes[folder] = now
+                changed.append(folder)
+                if self.recursive:
+                    # Folders created since are only seen by their parent
+                    for below in self._new_folders(folder, mtimes):
+                        changed.append(below)
+            if changed:
+                self.on_change(sorted(changed))
+
+    def _new_folders(self, folder, mtimes):
+        try:
+            with os.scandir(folder) as it:
+                paths = [
+                    entry.path for entry in it
+                    if not entry.name.startswith('.') and entry.is_dir()
+                    and entry.path not in mtimes
+                ]
+        except OSError:
+            return
+        for path in paths:
+            for below in _folders_below(path):
+                try:
+                    mtimes[below] = os.stat(below).st_mtime_ns
+                except OSError:
+                    continue
+                yield below
@@ -0,0 +1,336 @@
+import mmap
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from config import CONFIG_DIR
+
+try:
+    import numpy
+except ImportError:  # Without it the plain progress bar is shown
+    numpy = None
+
+WAVEFORM_DB = CONFIG_DIR / "waveforms.db"
+WAVEFORM_FILE = CONFIG_DIR / "waveforms.bin"
+
+# Buckets per track at each zoom level, finest first. Each level merges
+# four buckets of the one before it.
+LEVELS = (1024, 256, 64)
+BUCKETS = sum(LEVELS)
+
+# Min, max and RMS of every bucket of every level, one signed byte each,
+# padded to a page so slots never straddle one
+SLOT_SIZE = 4096
+
+# Tracks are decoded to mono at this rate to be summarized
+RATE = 8000
+
+# Samples per block (10 ms), the unit buckets are built from
+BLOCK = RATE // 100
+
+# Samples read from the decoder at once
+CHUNK = 1 << 16
+
+BLOCKS = " ▁▂▃▄▅▆▇█"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS waveforms (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    slot INTEGER NOT NULL UNIQUE,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS waveforms_used ON waveforms (used);
+"""
+
+def summarize(chunks):
+    """Summarizes mono float PCM at RATE, given as chunks of any length.
+
+    Returns an int8 array of shape (3, BUCKETS): min, max and RMS per
+    bucket, levels one after the other as in LEVELS, scaled to 127 at full
+    scale. None for an empty track.
+    """
+    mins, maxs, squares = [], [], []
+    pending = numpy.zeros(0, dtype=numpy.float32)
+    for chunk in chunks:
+        samples = numpy.concatenate((pending, chunk))
+        blocks = len(samples) // BLOCK
+        pending = samples[blocks * BLOCK:]
+        if blocks:
+            shaped = samples[:blocks * BLOCK].reshape(blocks, BLOCK)
+            mins.append(shaped.min(axis=1))
+            maxs.append(shaped.max(axis=1))
+            squares.append(numpy.square(shaped, dtype=numpy.float64).sum(axis=1))
+    if len(pending):
+        mins.append(pending.min(keepdims=True))
+        maxs.append(pending.max(keepdims=True))
+        squares.append(numpy.square(pending, dtype=numpy.float64).sum(keepdims=True))
+    if not mins:
+        return None
+    mins = numpy.concatenate(mins)
+    maxs = numpy.concatenate(maxs)
+    squares = numpy.concatenate(squares)
+    sizes = numpy.full(len(squares), BLOCK)
+    sizes[-1] = len(pending) or BLOCK
+
+    # Short tracks repeat blocks, so every bucket holds at least one
+    starts = (numpy.arange(LEVELS[0]) * len(mins)) // LEVELS[0]
+    level_min = numpy.minimum.reduceat(mins, starts)
+    level_max = numpy.maximum.reduceat(maxs, starts)
+    level_square = numpy.add.reduceat(squares, starts) \
+        / numpy.add.reduceat(sizes, starts)
+
+    out_min, out_max, out_square = [level_min], [level_max], [level_square]
+    for count in LEVELS[1:]:
+        ratio = len(level_min) // count
+        level_min = level_min.reshape(count, ratio).min(axis=1)
+        level_max = level_max.reshape(count, ratio).max(axis=1)
+        level_square = level_square.reshape(count, ratio).mean(axis=1)
+        out_min.append(level_min)
+        out_max.append(level_max)
+        out_square.append(level_square)
+
+    summary = numpy.stack((
+        numpy.concatenate(out_min),
+        numpy.concatenate(out_max),
+        numpy.sqrt(numpy.concatenate(out_square))
+    ))
+    return numpy.clip(numpy.round(summary * 127), -127, 127).astype(numpy.int8)
+
+def decode(path):
+    """Yields the PCM of path as mono float32 chunks at RATE.
+
+    Raises OSError if ffmpeg cannot be run or fails on the file.
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg", "-nostdin", "-v", "error", "-i", path,
+            "-vn", "-ac", "1", "-ar", str(RATE), "-f", "f32le", "-"
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            data = process.stdout.read(CHUNK * 4)
+            if not data:
+                break
+            yield numpy.frombuffer(data[:len(data) - len(data) % 4], dtype='<f4')
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise OSError(f"ffmpeg failed on {path}")
+
+class Waveform:
+    """Summary of one track, read straight from the cache file.
+
+    ``data`` is an int8 view of shape (3, BUCKETS) into the memory map, so
+    loading a summary copies nothing.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._columns = {}
+
+    def level(self, count):
+        """Returns the (min, max, rms) rows of the level with count buckets."""
+        start = 0
+        for size in LEVELS:
+            if size == count:
+                return self.data[:, start:start + count]
+            start += size
+        raise ValueError(f"no level with {count} buckets")
+
+    def columns(self, width):
+        """Returns the waveform as width block characters, one per column,
+        scaled to the loudest part of the track."""
+        text = self._columns.get(width)
+        if text is None:
+            # The coarsest level that still has a bucket for every column
+            count = next(
+                (size for size in reversed(LEVELS) if size >= width),
+                LEVELS[0]
+            )
+            rms = self.level(count)[2].astype(numpy.int64)
+            starts = (numpy.arange(width) * count) // width
+            heights = numpy.maximum.reduceat(rms, starts)
+            top = max(1, int(heights.max()))
+            cells = numpy.ceil(heights * 8 / top).astype(numpy.int64)
+            text = "".join(BLOCKS[cell] for cell in cells.tolist())
+            self._columns[width] = text
+        return text
+
+class WaveformCache:
+    """Waveform summaries of tracks in one memory-mapped file.
+
+    The file is split into ``size_cap // SLOT_SIZE`` fixed slots and a
+    small SQLite index maps each path, with its size and mtime, to a slot
+    and the time it was last shown. When every slot is taken, the least
+    recently used summary makes room. The file is sparse, so it only takes
+    disk space for slots in use.
+
+    Summaries are computed on a background thread for the paths passed to
+    ``request``, and ``on_ready`` is called after each one is stored.
+    """
+
+    def __init__(self, size_cap, on_ready=None,
+                 db_file=WAVEFORM_DB, data_file=WAVEFORM_FILE):
+        CONFIG_DIR.mkdir(parents=True, exist_ok=True)
+        self.slots = max(1, size_cap // SLOT_SIZE)
+        self.on_ready = on_ready
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(db_file), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        with self._db:
+            # Slots past a lowered cap are gone
+            self._db.execute(
+                "DELETE FROM waveforms WHERE slot >= ?", (self.slots,)
+            )
+
+        fd = os.open(data_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            size = self.slots * SLOT_SIZE
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._failed = set()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name="waveforms",
+            daemon=True
+        )
+        self._thread.start()
+
+    def get(self, path):
+        """Returns the Waveform of path, or None if it has none yet or the
+        file changed since it was summarized."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT slot FROM waveforms "
+                "WHERE path = ? AND size = ? AND mtime = ?",
+                (path, st.st_size, st.st_mtime_ns)
+            ).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE waveforms SET used = ? WHERE path = ?",
+                    (time.time(), path)
+                )
+        data = numpy.frombuffer(
+            self._map,
+            dtype=numpy.int8,
+            count=3 * BUCKETS,
+            offset=row[0] * SLOT_SIZE
+        )
+        return Waveform(data.reshape(3, BUCKETS))
+
+    def request(self, paths):
+        """Summarizes the paths that have none, in order, replacing any
+        earlier request."""
+        with self._cond:
+            self._pending = [path for path in paths if path not in self._failed]
+            self._cond.notify()
+
+    def _take_slot(self):
+        """Returns a free slot, evicting the least recently used summary
+        when the file is full."""
+        taken = [row[0] for row in self._db.execute(
+            "SELECT slot FROM waveforms ORDER BY slot"
+        )]
+        if len(taken) < self.slots:
+            for slot, used in enumerate(taken):
+                if slot != used:
+                    return slot
+            return len(taken)
+        path, slot = self._db.execute(
+            "SELECT path, slot FROM waveforms ORDER BY used LIMIT 1"
+        ).fetchone()
+        with self._db:
+            self._db.execute("DELETE FROM waveforms WHERE path = ?", (path,))
+        return slot
+
+    def _store(self, path, st, summary):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM waveforms WHERE path = ?", (path,))
+            slot = self._take_slot()
+            # The slot is written before its row exists, so readers never
+            # see a half-written summary
+            offset = slot * SLOT_SIZE
+            self._map[offset:offset + summary.nbytes] = summary.tobytes()
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO waveforms (path, size, mtime, slot, used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (path, st.st_size, st.st_mtime_ns, slot, time.time())
+                )
+
+    def _has(self, path, st):
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM waveforms WHERE path = ? AND size = ? AND mtime = ?",
+                (path, st.st_size, st.st_mtime_ns)
+            ).fetchone() is not None
+
+    def _until_closed(self, chunks):
+        for chunk in chunks:
+            if self._closed:
+                return
+            yield chunk
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                path = self._pending.pop(0)
+
+            try:
+                st = os.stat(path)
+                if self._has(path, st):
+                    continue
+                chunks = decode(path)
+                try:
+                    summary = summarize(self._until_closed(chunks))
+                finally:
+                    chunks.close()
+            except OSError:
+                with self._cond:
+                    self._failed.add(path)
+                continue
+            if summary is None or self._closed:
+                continue
+            self._store(path, st, summary)
+            if self.on_ready is not None:
+                self.on_ready()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        with self._lock:
+            self._db.close()
+        try:
+            self._map.close()
+        except BufferError:
+            # A Waveform still points into the map; it goes with the process
+            pass